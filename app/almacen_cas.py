@@ -0,0 +1,150 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+
+from google.api_core.exceptions import PreconditionFailed
+
+import transferencia
+
+# ==========================================
+# ALMACÉN DIRECCIONADO POR CONTENIDO (DEDUPLICACIÓN ENTRE PROYECTOS)
+# ==========================================
+# Muchos expedientes comparten documentos (resoluciones, plantillas ICSARA, anexos
+# de firma.sea.gob.cl). Cada archivo se guarda una sola vez en
+# cas/sha256/{aa}/{sha256}{ext}; el manifiesto de cada proyecto solo lo referencia.
+# Además, cas/urls/{sha1(url)}.json recuerda qué contenido entregó cada URL (con su
+# ETag/Last-Modified), así un documento ya visto se revalida con un GET condicional
+# (304). Sin validadores se vuelve a bajar completo (un documento puede reemplazarse
+# detrás de la misma URL); con CAS_CONFIAR_SIN_VALIDADOR=1 los PDF ya vistos ni se piden.
+
+USAR_CAS = os.getenv("ALMACEN_CAS", "1") == "1"
+PREFIJO_CAS = "cas/"
+# Sin ETag/Last-Modified: confiar en la caché por URL para PDFs sin pedirlos (opt-in: no detecta reemplazos)
+CONFIAR_SIN_VALIDADOR = os.getenv("CAS_CONFIAR_SIN_VALIDADOR", "0") == "1"
+
+
+class AlmacenCAS:
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def ruta(self, sha256_hex, extension):
+        return f"{PREFIJO_CAS}sha256/{sha256_hex[:2]}/{sha256_hex}{extension}"
+
+    def uri(self, ruta):
+        return f"gs://{self.bucket.name}/{ruta}"
+
+    @staticmethod
+    def _ruta_url(url):
+        return f"{PREFIJO_CAS}urls/{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+    # --- Caché por URL ---
+
+    def entrada_url(self, url):
+        """Qué contenido entregó esta URL la última vez (dict) o None."""
+        with self._lock:
+            if url in self._urls:
+                return self._urls[url]
+        blob = self.bucket.blob(self._ruta_url(url))
+        try:
+            entrada = json.loads(blob.download_as_text()) if blob.exists() else None
+        except Exception:
+            entrada = None
+        with self._lock:
+            self._urls[url] = entrada
+        return entrada
+
+    def _registrar_url(self, url, entrada):
+        with self._lock:
+            self._urls[url] = entrada
+        self.bucket.blob(self._ruta_url(url)).upload_from_string(
+            json.dumps(entrada, ensure_ascii=False), content_type="application/json")
+
+    def preparar(self, tarea):
+        """Para descargas.descargar_concurrente: (omitir_get, headers_condicionales)."""
+        entrada = self.entrada_url(tarea['url'])
+        tarea['cas'] = entrada
+        if not entrada:
+            return False, None
+        headers = {}
+        if entrada.get("etag"):
+            headers["If-None-Match"] = entrada["etag"]
+        if entrada.get("last_modified"):
+            headers["If-Modified-Since"] = entrada["last_modified"]
+        if headers or tarea.get('revalidar'):
+            return False, headers or None
+        return CONFIAR_SIN_VALIDADOR and entrada.get("extension") == ".pdf", None
+
+    def reutilizable(self, tarea, res):
+        """Entrada de la caché si la respuesta (o su ausencia) confirma que el contenido no cambió."""
+        entrada = tarea.get('cas')
+        if not entrada:
+            return None
+        if res is None or res.status_code == 304:
+            return entrada
+        if res.status_code == 200 and entrada.get("etag") and res.headers.get("ETag") == entrada["etag"]:
+            return entrada
+        return None
+
+    # --- Subidas ---
+
+    def _entrada(self, url, hashes, extension, content_type, res=None):
+        entrada = {
+            "url": url, "sha256": hashes["sha256"], "md5": hashes["md5"], "bytes": hashes["bytes"],
+            "extension": extension, "content_type": content_type,
+            "uri": self.uri(self.ruta(hashes["sha256"], extension)),
+            "etag": res.headers.get("ETag") if res is not None else None,
+            "last_modified": res.headers.get("Last-Modified") if res is not None else None,
+            "visto": datetime.now().isoformat(timespec="seconds"),
+        }
+        if url:
+            self._registrar_url(url, entrada)
+        return entrada
+
+    def guardar_respuesta(self, url, res, content_type, extension, nombre_descarga=None):
+        """
+        Sube el cuerpo de `res` en streaming a un temporal y lo deja en su ruta por hash
+        (copia en el servidor, solo si el contenido no existía). Retorna la entrada.
+        """
+        largo = res.headers.get("Content-Length")
+        if largo and largo.isdigit() and int(largo) <= transferencia.CHUNK_SIZE:
+            # Chico: se hashea en memoria y se sube directo a su ruta final (si no existe)
+            return self.guardar_bytes(url, res.raw.read(decode_content=True), content_type, extension, nombre_descarga, res)
+
+        tmp = self.bucket.blob(f"{PREFIJO_CAS}_tmp/{uuid.uuid4().hex}")
+        try:
+            hashes = transferencia.subir_respuesta_streaming(res, tmp, content_type)
+            destino = self.ruta(hashes["sha256"], extension)
+            if not self.bucket.blob(destino).exists():
+                try:
+                    copia = self.bucket.copy_blob(tmp, self.bucket, destino, if_generation_match=0)
+                    if nombre_descarga:
+                        copia.content_disposition = f'attachment; filename="{nombre_descarga}"'
+                        copia.patch()
+                except PreconditionFailed:
+                    pass  # otro proyecto lo subió entre medio: mismo contenido
+        finally:
+            try:
+                tmp.delete()
+            except Exception:
+                pass
+        return self._entrada(url, hashes, extension, content_type, res)
+
+    def guardar_bytes(self, url, contenido, content_type, extension, nombre_descarga=None, res=None):
+        """Igual que guardar_respuesta para contenido ya en memoria (ej: HTML capturado con Chrome)."""
+        md5_b64, crc32c_b64 = transferencia.hashes_de_bytes(contenido)
+        hashes = {"sha256": hashlib.sha256(contenido).hexdigest(), "md5": md5_b64, "bytes": len(contenido)}
+        blob = self.bucket.blob(self.ruta(hashes["sha256"], extension))
+        if nombre_descarga:
+            blob.content_disposition = f'attachment; filename="{nombre_descarga}"'
+        try:
+            blob.upload_from_string(contenido, content_type=content_type, if_generation_match=0)
+            transferencia._verificar(blob, md5_b64, crc32c_b64)
+        except PreconditionFailed:
+            pass  # ya estaba: no se vuelve a subir
+        return self._entrada(url, hashes, extension, content_type, res)
@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import uuid
+import base64
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import google_crc32c
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+# ==========================================
+# CAPA DE ALMACENAMIENTO (GCS O DIRECTORIO LOCAL)
+# ==========================================
+# Todo el pipeline usa el subconjunto de la API de google.cloud.storage que ya
+# ocupaba (bucket.blob(), upload_from_string/file, download_as_text, exists,
+# delete, compose, copy_blob, list_blobs). BucketLocal implementa ese mismo
+# subconjunto sobre un directorio, así se puede correr y medir todo el flujo en
+# un notebook o en CI sin pasar por la red:
+#
+#   STORAGE_BACKEND=local STORAGE_LOCAL_DIR=/tmp/almacen python worker.py
+#
+# Los metadatos de cada objeto (content-type, md5, crc32c, generación) van en
+# {raiz}/{bucket}/.meta/{objeto}.json.
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")   # "gcs" | "local"
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", os.path.join(os.getcwd(), "almacen_local"))
+HILOS_ALMACENAMIENTO = int(os.getenv("STORAGE_HILOS", "8"))
+_DIR_META = ".meta"
+
+
+def obtener_bucket(bucket_name, project=None):
+    """Bucket del backend configurado (google.cloud.storage.Bucket o BucketLocal)."""
+    if STORAGE_BACKEND == "local":
+        return BucketLocal(bucket_name, STORAGE_LOCAL_DIR)
+    from google.cloud import storage
+    return storage.Client(project=project).bucket(bucket_name)
+
+
+def url_consola(bucket, prefijo=""):
+    """Dónde mirar lo subido: consola de GCS o ruta local."""
+    if isinstance(bucket, BucketLocal):
+        return f"file://{os.path.join(bucket.raiz, prefijo)}"
+    return f"https://console.cloud.google.com/storage/browser/{bucket.name}/{prefijo}?project={bucket.client.project}"
+
+
+def glob_a_regex(patron):
+    """Glob de GCS (match_glob): * y ? no cruzan '/', ** sí."""
+    partes, i = [], 0
+    while i < len(patron):
+        if patron.startswith("**", i):
+            partes.append(".*")
+            i += 2
+        elif patron[i] == "*":
+            partes.append("[^/]*")
+            i += 1
+        elif patron[i] == "?":
+            partes.append("[^/]")
+            i += 1
+        else:
+            partes.append(re.escape(patron[i]))
+            i += 1
+    return re.compile("^" + "".join(partes) + "$")
+
+
+def listar_blobs(bucket, prefix="", match_glob=None, hilos=HILOS_ALMACENAMIENTO):
+    """
+    Lista blobs bajo `prefix` (opcionalmente filtrados por glob). En GCS se pide el primer
+    nivel de "carpetas" con delimitador y cada una se lista en paralelo.
+    """
+    if isinstance(bucket, BucketLocal):
+        return list(bucket.list_blobs(prefix=prefix, match_glob=match_glob))
+
+    regex = glob_a_regex(match_glob) if match_glob else None
+    raiz = bucket.list_blobs(prefix=prefix or None, delimiter="/")
+    blobs = [b for b in raiz if regex is None or regex.match(b.name)]
+    subprefijos = sorted(raiz.prefixes)
+    if not subprefijos:
+        return blobs
+
+    def _listar(sub):
+        return list(bucket.list_blobs(prefix=sub, match_glob=match_glob))
+
+    with ThreadPoolExecutor(max_workers=hilos) as ex:
+        for parte in ex.map(_listar, subprefijos):
+            blobs.extend(parte)
+    return blobs
+
+
+class EscrituraPorLotes:
+    """
+    Encola subidas pequeñas y las hace en paralelo (las de GCS son una petición cada una).
+    Uso:  with EscrituraPorLotes(bucket) as lote: lote.subir(nombre, contenido, content_type)
+    Al salir espera todas y relanza el primer error.
+    """
+
+    def __init__(self, bucket, hilos=HILOS_ALMACENAMIENTO, max_pendientes=None):
+        self.bucket = bucket
+        self._ex = ThreadPoolExecutor(max_workers=hilos)
+        self._futuros = []
+        # Tope de subidas en vuelo: acota la memoria si se encola más rápido de lo que se sube
+        self._max_pendientes = max_pendientes or hilos * 2
+
+    def subir(self, nombre, contenido, content_type=None):
+        en_vuelo = [f for f in self._futuros if not f.done()]
+        if len(en_vuelo) >= self._max_pendientes:
+            wait(en_vuelo, return_when=FIRST_COMPLETED)
+        self._futuros.append(self._ex.submit(
+            lambda: self.bucket.blob(nombre).upload_from_string(contenido, content_type=content_type)))
+
+    def esperar(self):
+        futuros, self._futuros = self._futuros, []
+        errores = [f.exception() for f in futuros if f.exception() is not None]
+        if errores:
+            raise errores[0]
+        return len(futuros)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if exc[0] is None:
+                self.esperar()
+        finally:
+            self._ex.shutdown(wait=True)
+        return False
+
+
+# ==========================================
+# BACKEND LOCAL
+# ==========================================
+
+class _ClienteLocal:
+    project = "local"
+
+
+class BucketLocal:
+
+    def __init__(self, name, raiz_base):
+        self.name = name
+        self.raiz = os.path.join(raiz_base, name)
+        self.client = _ClienteLocal()
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def blob(self, blob_name, generation=None, **kwargs):
+        return BlobLocal(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix=None, match_glob=None, **kwargs):
+        regex = glob_a_regex(match_glob) if match_glob else None
+        prefix = prefix or ""
+        # Se parte desde el directorio más profundo que cubre el prefijo
+        base = os.path.join(self.raiz, os.path.dirname(prefix))
+        nombres = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            if os.path.abspath(dirpath) == os.path.abspath(self.raiz):
+                dirnames[:] = [d for d in dirnames if d != _DIR_META]
+            for f in filenames:
+                if f.endswith(".tmp-escritura"):
+                    continue
+                nombre = os.path.relpath(os.path.join(dirpath, f), self.raiz).replace(os.sep, "/")
+                if nombre.startswith(prefix) and (regex is None or regex.match(nombre)):
+                    nombres.append(nombre)
+        for nombre in sorted(nombres):
+            blob = self.blob(nombre)
+            blob.reload()
+            yield blob
+
+    def copy_blob(self, blob, destination_bucket, new_name=None, if_generation_match=None, **kwargs):
+        destino = destination_bucket.blob(new_name or blob.name)
+        destino.content_type = blob.content_type
+        destino._escribir(blob.download_as_bytes(), blob.content_type, if_generation_match)
+        return destino
+
+    def rename_blob(self, blob, new_name, **kwargs):
+        nuevo = self.copy_blob(blob, self, new_name)
+        blob.delete()
+        return nuevo
+
+
+class BlobLocal:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.content_disposition = None
+        self.chunk_size = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.generation = None
+        self.size = None
+        self.updated = None
+
+    @property
+    def _ruta(self):
+        return os.path.join(self.bucket.raiz, *self.name.split("/"))
+
+    @property
+    def _ruta_meta(self):
+        return os.path.join(self.bucket.raiz, _DIR_META, *self.name.split("/")) + ".json"
+
+    # --- lectura ---
+
+    def exists(self, **kwargs):
+        return os.path.isfile(self._ruta)
+
+    def reload(self, **kwargs):
+        if not self.exists():
+            raise NotFound(f"No existe {self.name}")
+        meta = {}
+        if os.path.exists(self._ruta_meta):
+            with open(self._ruta_meta, encoding="utf-8") as f:
+                meta = json.load(f)
+        st = os.stat(self._ruta)
+        self.content_type = meta.get("content_type")
+        self.content_disposition = meta.get("content_disposition")
+        self.md5_hash = meta.get("md5_hash")
+        self.crc32c = meta.get("crc32c")
+        self.generation = meta.get("generation", st.st_mtime_ns)
+        self.size = st.st_size
+        self.updated = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+
+    def download_as_bytes(self, **kwargs):
+        try:
+            with open(self._ruta, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise NotFound(f"No existe {self.name}")
+
+    def download_as_text(self, encoding="utf-8", **kwargs):
+        return self.download_as_bytes().decode(encoding)
+
+    def download_to_filename(self, filename, **kwargs):
+        with open(filename, "wb") as f:
+            f.write(self.download_as_bytes())
+
+    # --- escritura ---
+
+    def _escribir(self, contenido, content_type=None, if_generation_match=None):
+        os.makedirs(os.path.dirname(self._ruta), exist_ok=True)
+        tmp = f"{self._ruta}.{uuid.uuid4().hex}.tmp-escritura"
+        with open(tmp, "wb") as f:
+            f.write(contenido)
+        try:
+            if if_generation_match == 0:
+                # Igual que en GCS: solo si el objeto no existe (os.link es atómico)
+                try:
+                    os.link(tmp, self._ruta)
+                except FileExistsError:
+                    raise PreconditionFailed(f"{self.name} ya existe")
+            else:
+                os.replace(tmp, self._ruta)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        self.content_type = content_type or self.content_type or "application/octet-stream"
+        self.md5_hash = base64.b64encode(hashlib.md5(contenido).digest()).decode("ascii")
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(contenido).digest()).decode("ascii")
+        self.generation = os.stat(self._ruta).st_mtime_ns
+        self.size = len(contenido)
+        self._guardar_meta()
+
+    def _guardar_meta(self):
+        os.makedirs(os.path.dirname(self._ruta_meta), exist_ok=True)
+        with open(self._ruta_meta, "w", encoding="utf-8") as f:
+            json.dump({"content_type": self.content_type, "content_disposition": self.content_disposition,
+                       "md5_hash": self.md5_hash, "crc32c": self.crc32c, "generation": self.generation}, f)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        self._escribir(data.encode("utf-8") if isinstance(data, str) else data, content_type, if_generation_match)
+
+    def upload_from_file(self, file_obj, content_type=None, if_generation_match=None, **kwargs):
+        # Mismo patrón que la subida resumable: se lee por bloques
+        partes = []
+        while True:
+            bloque = file_obj.read(self.chunk_size or 8 * 1024 * 1024)
+            if not bloque:
+                break
+            partes.append(bloque)
+        self._escribir(b"".join(partes), content_type, if_generation_match)
+
+    def upload_from_filename(self, filename, content_type=None, **kwargs):
+        with open(filename, "rb") as f:
+            self._escribir(f.read(), content_type)
+
+    def patch(self, **kwargs):
+        self._guardar_meta()
+
+    def compose(self, sources, **kwargs):
+        self._escribir(b"".join(s.download_as_bytes() for s in sources), self.content_type)
+
+    def delete(self, **kwargs):
+        try:
+            os.remove(self._ruta)
+        except FileNotFoundError:
+            raise NotFound(f"No existe {self.name}")
+        if os.path.exists(self._ruta_meta):
+            os.remove(self._ruta_meta)
@@ -1,12 +1,14 @@
 import streamlit as st
 import os
+import sys
+import subprocess
+from contextlib import closing
 from google.cloud import bigquery
-from scraper import ejecutar_scrapping 
 # Importamos nuestros nuevos módulos
 import data_manager as dm
 import ui_components as ui
-import time
-import gc 
+import cola_trabajos as cola
+import motor_local
 # --- CONFIGURACIÓN ---
 PROJECT_ID = os.getenv("PROJECT_ID", "geo-ambiental-482615") 
 BUCKET_NAME = os.getenv("BUCKET_NAME", "almacen_antecedentes_482615")
@@ -14,16 +16,27 @@ BQ_TABLE_PATH = os.getenv("BQ_TABLE_PATH", "geo-ambiental-482615.dataset_ambient
 
 st.set_page_config(page_title="GeoAmbiental Pro", layout="wide", page_icon="🌍")
 ui.inyectar_estilos()
-bq_client = bigquery.Client(project=PROJECT_ID)
+# Con MOTOR_CONSULTA=local las búsquedas usan el snapshot y no se necesita BigQuery
+bq_client = bigquery.Client(project=PROJECT_ID) if motor_local.MOTOR_CONSULTA != "local" else None
+
+@st.cache_resource
+def iniciar_worker_embebido():
+    # En Cloud Run hay un solo contenedor: el worker corre como proceso hermano de Streamlit
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")])
+
+if os.getenv("WORKER_EMBEBIDO", "1") == "1":
+    iniciar_worker_embebido()
 
 # --- ESTADO DE SESIÓN ---
 if 'punto_seleccionado' not in st.session_state:
     st.session_state.punto_seleccionado = {"lat": -33.4489, "lon": -70.6693}
 if 'df_resultados' not in st.session_state:
     st.session_state.df_resultados = None
-# === AGREGAR ESTO ===
-if 'ejecutando_scraping' not in st.session_state:
-    st.session_state.ejecutando_scraping = False
+if 'resultado_paginado' not in st.session_state:
+    st.session_state.resultado_paginado = None
+# Trabajo de scraping que se está monitoreando (id en la cola SQLite)
+if 'trabajo_actual' not in st.session_state:
+    st.session_state.trabajo_actual = None
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -38,18 +51,41 @@ with st.sidebar:
     radio_km = st.slider("Radio (Km)", 1, 50, 10)
     
     if st.button("🔍 BUSCAR PROYECTOS"):
-        st.session_state.df_resultados = dm.consultar_proyectos_bq(
-            bq_client, BQ_TABLE_PATH, 
-            st.session_state.punto_seleccionado['lat'], 
-            st.session_state.punto_seleccionado['lon'], 
-            radio_km
-        )
+        # Resultado completo (sin tope): primero la consulta cacheada; si es grande, páginas a pedido
+        if bq_client is None:
+            st.session_state.resultado_paginado = motor_local.consultar_proyectos_local_paginado(
+                st.session_state.punto_seleccionado['lat'], 
+                st.session_state.punto_seleccionado['lon'], 
+                radio_km
+            )
+        else:
+            st.session_state.resultado_paginado = dm.consultar_proyectos_paginado(
+                bq_client, BQ_TABLE_PATH, 
+                st.session_state.punto_seleccionado['lat'], 
+                st.session_state.punto_seleccionado['lon'], 
+                radio_km
+            )
+        st.session_state.df_resultados = st.session_state.resultado_paginado.cargar_siguiente(bq_client)
         st.rerun()
 
 # --- CUERPO PRINCIPAL ---
 st.title("🌍 Inteligencia Territorial + Scraper")
 ui.renderizar_mapa(st.session_state.punto_seleccionado['lat'], st.session_state.punto_seleccionado['lon'], st.session_state.df_resultados)
 
+paginado = st.session_state.resultado_paginado
+if paginado is not None and st.session_state.df_resultados is not None:
+    c_info, c_mas, c_todo = st.columns([3, 1, 1])
+    c_info.caption(f"📍 Mostrando {len(st.session_state.df_resultados)} de {paginado.total} proyectos en el radio (ordenados por distancia)")
+    if not paginado.completo:
+        if c_mas.button(f"⬇️ Cargar {min(dm.TAMANO_PAGINA, paginado.total - paginado.n_cargadas)} más"):
+            st.session_state.df_resultados = paginado.cargar_siguiente(bq_client)
+            st.rerun()
+        if c_todo.button("⏬ Cargar todos"):
+            st.session_state.df_resultados = paginado.cargar_todo(bq_client)
+            st.rerun()
+        st.info(f"ℹ️ Los filtros, la tabla y el mapa consideran solo los {len(st.session_state.df_resultados)} proyectos "
+                f"más cercanos ya cargados. Use «Cargar todos» para filtrar sobre los {paginado.total}.")
+
 if st.session_state.df_resultados is not None:
     # Bloque de Filtros
     with st.expander("🛠️ PANEL DE FILTROS", expanded=True):
@@ -99,96 +135,69 @@ if st.session_state.df_resultados is not None:
         df_final = df_f.iloc[indices]
 
 
-# Lógica de Ejecución
-        if len(df_final) > 0:
-            
-            # 1. LIMITADOR DE SEGURIDAD
-            cantidad_sel = len(df_final)
-            if cantidad_sel > 10:
-                st.warning(f"⚠️ Has seleccionado {cantidad_sel}. Se procesarán los primeros 10.")
-                df_final = df_final.iloc[:10]
-                cantidad_sel = 10
-
-            # 2. BOTÓN QUE ACTIVA LA BANDERA
-            # Deshabilitamos el botón si ya está corriendo
-            boton_disabled = st.session_state.ejecutando_scraping
-            
-            if st.button(f"🚀 INICIAR SCRAPPING (Lote: {cantidad_sel})", disabled=boton_disabled):
-                st.session_state.ejecutando_scraping = True
-                st.rerun() # Recarga para bloquear la UI
-
-            # 3. PROCESO PERSISTENTE (Se mantiene vivo tras el rerun)
-            if st.session_state.ejecutando_scraping:
-                
-                import traceback # Para ver errores detallados si falla
-                
-                contenedor = st.container()
-                with contenedor:
-                    st.info("⚠️ Procesando... Por favor no cierres esta pestaña.")
-                    barra_progreso = st.progress(0, text="Iniciando secuencia...")
-                    console_log = st.empty() 
-
-                    try:
-                        # --- INICIO DEL BUCLE FOR ---
-                        for i, (_, row) in enumerate(df_final.iterrows()):
-                            
-                            nombre_limpio = row['nombre_original'].replace("(e-seia)", "").strip()
-                            
-                            # Actualizar barra
-                            pct = (i) / cantidad_sel
-                            barra_progreso.progress(pct, text=f"⏳ [{i+1}/{cantidad_sel}] Procesando: {nombre_limpio}")
-                            
-                            with st.status(f"Analizando: {nombre_limpio}", expanded=False) as status:
-                                st.write("⚙️ Iniciando navegador...")
-                                
-                                # LLAMADA AL SCRAPER
-                                res, logs, excel_path = ejecutar_scrapping(
-                                    row['id'], nombre_limpio, row['titular'], 
-                                    row['fecha_presentacion'], BUCKET_NAME,
-                                    region=row['region'], comuna=row['comuna']
-                                )
-
-                                # PROCESAMIENTO DE RESPUESTA
-                                if "✅ EXITOSO" in res:
-                                    st.write("✅ Descarga completada. Actualizando BD...")
-                                    if excel_path:
-                                        ok_upd, msg_upd = dm.actualizar_desde_excel(bq_client, BQ_TABLE_PATH, row['id'], excel_path)
-                                        if os.path.exists(excel_path): os.remove(excel_path)
-                                        
-                                        if ok_upd:
-                                            status.update(label=f"✅ Finalizado: {nombre_limpio}", state="complete")
-                                        else:
-                                            status.update(label=f"⚠️ Error BQ: {nombre_limpio}", state="error")
-                                            st.error(msg_upd)
-                                    else:
-                                        status.update(label=f"✅ Finalizado (Sin Excel): {nombre_limpio}", state="complete")
-
-                                elif "⚠️ SIN RESULTADOS" in res:
-                                    status.update(label=f"⚠️ Sin datos: {nombre_limpio}", state="error")
-                                    st.warning("No se encontraron documentos.")
-                                else:
-                                    status.update(label=f"❌ Falló: {nombre_limpio}", state="error")
-                                    st.error(res)
-
-                                with st.expander("Ver Logs Técnicos"):
-                                    st.code(logs)
-
-                            # LIMPIEZA DE MEMORIA
-                            console_log.text(f"♻️ Liberando memoria tras proyecto {i+1}...")
-                            gc.collect()
-                            time.sleep(2)
-
-                        # --- FIN DEL PROCESO ---
-                        barra_progreso.progress(1.0, text="✅ ¡Lote completado!")
-                        st.success(f"Proceso finalizado. {cantidad_sel} proyectos procesados.")
-                        st.balloons()
-                    
-                    except Exception as e:
-                        st.error(f"💥 Error crítico: {e}")
-                        print(traceback.format_exc()) # Imprime error real en consola negra
-                    
-                    finally:
-                        # APAGAMOS LA BANDERA AL TERMINAR (SEA ÉXITO O ERROR)
-                        st.session_state.ejecutando_scraping = False
-                        if st.button("🔄 Reiniciar Vista"):
-                            st.rerun()
\ No newline at end of file
+# Lógica de Ejecución: se encola y el worker procesa (sobrevive al cierre de la pestaña)
+        def _proyectos_desde_df(df):
+            return [{
+                'id': row['id'],
+                'nombre': row['nombre_original'].replace("(e-seia)", "").strip(),
+                'titular': row['titular'],
+                'fecha_presentacion': row['fecha_presentacion'],
+                'region': row['region'],
+                'comuna': row['comuna']
+            } for _, row in df.iterrows()]
+
+        c_sel, c_todos = st.columns(2)
+        with c_sel:
+            if st.button(f"🚀 ENCOLAR SCRAPPING (Lote: {len(df_final)})", disabled=len(df_final) == 0):
+                with closing(cola.conectar()) as conn:
+                    st.session_state.trabajo_actual = cola.encolar_trabajo(conn, _proyectos_desde_df(df_final), BUCKET_NAME, "Selección manual")
+                st.rerun()
+        with c_todos:
+            if st.button(f"📥 ENCOLAR TODOS LOS FILTRADOS ({len(df_f)})", disabled=len(df_f) == 0):
+                with closing(cola.conectar()) as conn:
+                    st.session_state.trabajo_actual = cola.encolar_trabajo(conn, _proyectos_desde_df(df_f), BUCKET_NAME, "Resultados filtrados")
+                st.rerun()
+
+
+# --- MONITOREO DEL TRABAJO (se refresca solo, sin re-ejecutar toda la app) ---
+@st.fragment(run_every="5s")
+def mostrar_progreso_trabajo(trabajo_id):
+    conn = cola.conectar()
+    try:
+        prog = cola.progreso_trabajo(conn, trabajo_id)
+        detalle = cola.proyectos_de_trabajo(conn, trabajo_id)
+    finally:
+        conn.close()
+
+    total = prog['total'] or 1
+    st.subheader(f"📦 Trabajo #{trabajo_id}")
+    st.progress(prog['terminados'] / total, text=(
+        f"⏳ {prog['terminados']}/{prog['total']} terminados · "
+        f"✅ {prog[cola.EXITOSO]} · ⚠️ {prog[cola.SIN_RESULTADOS]} · ❌ {prog[cola.ERROR]} · "
+        f"⚙️ {prog[cola.EN_CURSO]} en curso"
+    ))
+
+    iconos = {cola.PENDIENTE: "🕒", cola.EN_CURSO: "⚙️", cola.EXITOSO: "✅", cola.SIN_RESULTADOS: "⚠️", cola.ERROR: "❌"}
+    for item in detalle:
+        if item['estado'] in cola.ESTADOS_FINALES:
+            with st.expander(f"{iconos[item['estado']]} {item['nombre']} (intentos: {item['intentos']})"):
+                st.write(item['resultado'])
+                if item['logs']:
+                    st.code(item['logs'])
+
+    if prog['terminados'] == prog['total']:
+        st.success(f"Proceso finalizado. {prog['total']} proyectos procesados.")
+
+
+if st.session_state.trabajo_actual is not None:
+    st.info("ℹ️ El lote se procesa en segundo plano: puedes cerrar esta pestaña y volver más tarde.")
+    mostrar_progreso_trabajo(st.session_state.trabajo_actual)
+
+with st.sidebar:
+    with st.expander("🗂️ Trabajos recientes"):
+        with closing(cola.conectar()) as conn:
+            trabajos = cola.listar_trabajos(conn)
+        for t in trabajos:
+            if st.button(f"#{t['id']} · {t['descripcion'] or ''} · {t['total']} proy. · {t['creado']}", key=f"trabajo_{t['id']}"):
+                st.session_state.trabajo_actual = t['id']
+                st.rerun()
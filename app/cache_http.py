@@ -0,0 +1,381 @@
+import os
+import io
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+# ==========================================
+# CACHÉ HTTP EN DISCO (BAJO requests.Session)
+# ==========================================
+# Un HTTPAdapter que guarda en disco local los GET 200 (cuerpo + ETag/Last-Modified)
+# y en la siguiente petición a la misma URL manda If-None-Match / If-Modified-Since:
+# si el SEIA responde 304 el cuerpo sale del disco y no viaja por la red.
+#   CACHE_HTTP=0        desactivada (por defecto)
+#   CACHE_HTTP=1        revalidación condicional contra el servidor
+#   CACHE_HTTP=offline  solo caché: no sale a la red; lo que no está lanza SinCopiaEnCache
+# El índice es SQLite (compartido entre procesos, como cola_trabajos.py) y los cuerpos
+# son archivos por hash de URL. Pasado CACHE_HTTP_MAX_MB se desalojan los menos usados (LRU).
+# Si el llamador ya trae sus propios headers condicionales (ej: almacen_cas.preparar),
+# la petición pasa tal cual y un 304 le llega a él; un 200 igual queda guardado.
+# Los POST de formulario (la búsqueda del SEIA) son consultas idempotentes: se guardan
+# por método + URL + cuerpo, sin revalidar, para que el modo offline también los sirva.
+
+MODO = os.getenv("CACHE_HTTP", "0").lower()
+ACTIVA = MODO in ("1", "offline")
+OFFLINE = MODO == "offline"
+DIRECTORIO = os.getenv("CACHE_HTTP_DIR", "/tmp/cache_http" if os.environ.get("K_SERVICE") else os.path.join(os.getcwd(), "cache_http"))
+MAX_BYTES = int(float(os.getenv("CACHE_HTTP_MAX_MB", "2048")) * 1024 * 1024)
+# Respuestas más grandes que esto (según Content-Length) no se guardan
+MAX_BYTES_OBJETO = int(float(os.getenv("CACHE_HTTP_MAX_OBJETO_MB", "200")) * 1024 * 1024)
+CHUNK_LECTURA = 64 * 1024
+
+HEADERS_CONDICIONALES = ("If-None-Match", "If-Modified-Since")
+# Headers de la respuesta original que no se guardan (describen la conexión, no el contenido)
+HEADERS_DESCARTADOS = {"connection", "keep-alive", "transfer-encoding", "content-encoding", "set-cookie"}
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS entradas (
+    clave TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    bytes INTEGER NOT NULL,
+    guardado REAL NOT NULL,
+    ultimo_acceso REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entradas_acceso ON entradas(ultimo_acceso);
+"""
+
+_estadisticas = Counter()
+_lock_estadisticas = threading.Lock()
+
+
+class SinCopiaEnCache(requests.RequestException):
+    """Modo offline y la URL no está en la caché."""
+
+
+def _contar(nombre, n=1):
+    with _lock_estadisticas:
+        _estadisticas[nombre] += n
+
+
+def estadisticas(desde=None):
+    """
+    Contadores del proceso (aciertos, revalidados, guardados, desalojados, bytes ahorrados); {} si está desactivada.
+    Con `desde` (un resultado anterior de esta función) solo lo ocurrido desde entonces.
+    """
+    if not ACTIVA:
+        return {}
+    with _lock_estadisticas:
+        actuales = dict(_estadisticas)
+    if desde:
+        actuales = {k: v - desde.get(k, 0) for k, v in actuales.items()}
+    return {"modo": MODO, **actuales}
+
+
+class CacheDisco:
+    """Índice SQLite + cuerpos en archivos. Seguro entre hilos; varios procesos pueden compartir el directorio."""
+
+    def __init__(self, directorio=DIRECTORIO, max_bytes=MAX_BYTES):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directorio, "cuerpos"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directorio, "indice.db"), timeout=30,
+                                     isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_ESQUEMA)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, "cuerpos", clave[:2], clave)
+
+    def buscar(self, url):
+        """Entrada (dict) de la URL si existe y su cuerpo sigue en disco; None si no."""
+        with self._lock:
+            fila = self._conn.execute("SELECT * FROM entradas WHERE clave = ?", (self.clave(url),)).fetchone()
+        if fila is None:
+            return None
+        entrada = dict(fila)
+        if not os.path.exists(self.ruta(entrada["clave"])):
+            self._borrar([entrada["clave"]])
+            return None
+        entrada["headers"] = json.loads(entrada["headers"])
+        return entrada
+
+    def tocar(self, clave, headers_nuevos=None):
+        """Marca el acceso (para el LRU) y, tras un 304, actualiza los headers con los que trajo el servidor."""
+        with self._lock:
+            if headers_nuevos:
+                fila = self._conn.execute("SELECT headers FROM entradas WHERE clave = ?", (clave,)).fetchone()
+                if fila:
+                    headers = {**json.loads(fila["headers"]), **headers_nuevos}
+                    self._conn.execute(
+                        "UPDATE entradas SET headers = ?, etag = ?, last_modified = ? WHERE clave = ?",
+                        (json.dumps(headers), headers.get("ETag"), headers.get("Last-Modified"), clave))
+            self._conn.execute("UPDATE entradas SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave))
+
+    def archivo_temporal(self, clave):
+        ruta = self.ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        return f"{ruta}.{uuid.uuid4().hex}.tmp"
+
+    def confirmar(self, url, temporal, status, reason, headers, total):
+        """Deja el temporal como cuerpo de la URL y registra la entrada; luego desaloja si se pasó del tope."""
+        clave = self.clave(url)
+        os.replace(temporal, self.ruta(clave))
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (clave, url, status, reason, json.dumps(headers), headers.get("ETag"),
+                 headers.get("Last-Modified"), total, ahora, ahora))
+        _contar("guardados")
+        self.desalojar()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entradas").fetchone()[0]
+
+    def desalojar(self):
+        """LRU: borra las entradas con acceso más antiguo hasta quedar bajo el 90% del tope."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        objetivo = int(self.max_bytes * 0.9)
+        with self._lock:
+            filas = self._conn.execute("SELECT clave, bytes FROM entradas ORDER BY ultimo_acceso").fetchall()
+        borrar = []
+        for fila in filas:
+            if total <= objetivo:
+                break
+            borrar.append(fila["clave"])
+            total -= fila["bytes"]
+        self._borrar(borrar)
+        _contar("desalojados", len(borrar))
+
+    def _borrar(self, claves):
+        with self._lock:
+            self._conn.executemany("DELETE FROM entradas WHERE clave = ?", [(c,) for c in claves])
+        for clave in claves:
+            try: os.remove(self.ruta(clave))
+            except OSError: pass
+
+
+_cache = None
+_lock_cache = threading.Lock()
+
+
+def _clave_peticion(request):
+    """Identidad de la petición en la caché: la URL para GET; método + URL + hash del cuerpo para un POST de formulario."""
+    if request.method == "GET":
+        return request.url
+    cuerpo = request.body or b""
+    if isinstance(cuerpo, str):
+        cuerpo = cuerpo.encode("utf-8")
+    return f"{request.method} {request.url} {hashlib.sha256(cuerpo).hexdigest()}"
+
+
+def _es_formulario(request):
+    return (request.method == "POST"
+            and "application/x-www-form-urlencoded" in request.headers.get("Content-Type", "")
+            and not hasattr(request.body, "read"))
+
+
+def cache_compartida():
+    """CacheDisco del proceso (se abre la primera vez que se usa)."""
+    global _cache
+    with _lock_cache:
+        if _cache is None:
+            _cache = CacheDisco()
+        return _cache
+
+
+class LectorQueGuarda(io.RawIOBase):
+    """
+    Envuelve el `raw` de la respuesta de red: entrega los bytes (ya decodificados) al llamador
+    y los va escribiendo a un temporal. Si el cuerpo se lee completo, al cerrarse queda en la caché;
+    si el llamador lo abandona a medias, el temporal se descarta.
+    """
+
+    def __init__(self, raw, cache, url, status, reason, headers):
+        super().__init__()
+        self._raw = raw
+        self._cache = cache
+        self._url = url
+        self._meta = (status, reason, headers)
+        self._temporal = cache.archivo_temporal(cache.clave(url))
+        self._archivo = open(self._temporal, "wb")
+        self._total = 0
+        self._fin = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.closed:
+            return b""
+        if size is None or size < 0:
+            partes = []
+            while True:
+                dato = self._raw.read(CHUNK_LECTURA, decode_content=True)
+                if not dato:
+                    break
+                partes.append(dato)
+            dato = b"".join(partes)
+            self._fin = True
+        else:
+            dato = self._raw.read(size, decode_content=True)
+            self._fin = not dato
+        if dato:
+            self._archivo.write(dato)
+            self._total += len(dato)
+        return dato
+
+    def readinto(self, b):
+        dato = self.read(len(b))
+        b[:len(dato)] = dato
+        return len(dato)
+
+    def close(self):
+        if self.closed:
+            return
+        self._archivo.close()
+        try:
+            if self._fin:
+                status, reason, headers = self._meta
+                self._cache.confirmar(self._url, self._temporal, status, reason, headers, self._total)
+                self._raw.release_conn()
+            else:
+                self._raw.close()
+        except Exception as e:
+            print(f"      ⚠️ No se pudo guardar en la caché HTTP {self._url}: {e}", flush=True)
+        finally:
+            if os.path.exists(self._temporal):
+                try: os.remove(self._temporal)
+                except OSError: pass
+            super().close()
+
+
+class AdaptadorCache(HTTPAdapter):
+    """HTTPAdapter con caché en disco; se monta en descargas.crear_sesion cuando CACHE_HTTP está activa."""
+
+    def __init__(self, *args, cache=None, offline=OFFLINE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache or cache_compartida()
+        self.offline = offline
+
+    def send(self, request, **kwargs):
+        formulario = _es_formulario(request)
+        if request.method != "GET" and not formulario:
+            if self.offline:
+                raise SinCopiaEnCache(f"Modo offline: {request.method} {request.url} no se puede servir desde la caché")
+            return super().send(request, **kwargs)
+
+        clave_url = _clave_peticion(request)
+        entrada = self.cache.buscar(clave_url)
+        condicional_propio = any(h in request.headers for h in HEADERS_CONDICIONALES)
+
+        if self.offline:
+            respuesta = None
+            if entrada is not None:
+                if condicional_propio and entrada["etag"] and request.headers.get("If-None-Match") == entrada["etag"]:
+                    respuesta = self._respuesta_cache(request, entrada, status=304)
+                else:
+                    respuesta = self._respuesta_cache(request, entrada)
+            if respuesta is None:
+                _contar("fallos_offline")
+                raise SinCopiaEnCache(f"Modo offline: {request.method} {request.url} no está en la caché HTTP")
+            self.cache.tocar(entrada["clave"])
+            _contar("aciertos_offline")
+            return respuesta
+
+        # Un POST no se revalida: va siempre al servidor y su respuesta reemplaza a la guardada
+        agregados = []
+        if entrada and not condicional_propio and not formulario:
+            if entrada["etag"]:
+                request.headers["If-None-Match"] = entrada["etag"]
+                agregados.append("If-None-Match")
+            if entrada["last_modified"]:
+                request.headers["If-Modified-Since"] = entrada["last_modified"]
+                agregados.append("If-Modified-Since")
+
+        res = super().send(request, **kwargs)
+
+        if res.status_code == 304 and agregados:
+            res.close()
+            respuesta = self._respuesta_cache(request, entrada)
+            if respuesta is not None:
+                self.cache.tocar(entrada["clave"], {k: v for k, v in res.headers.items() if k in ("ETag", "Last-Modified", "Date")})
+                _contar("revalidados")
+                _contar("bytes_ahorrados", entrada["bytes"])
+                return respuesta
+            # El cuerpo se desalojó entre buscar() y el 304: se pide de nuevo sin condicionales
+            for header in agregados:
+                del request.headers[header]
+            res = super().send(request, **kwargs)
+        if self._guardable(res):
+            _contar("descargados")
+            return self._guardar_al_leer(request, res, clave_url)
+        return res
+
+    @staticmethod
+    def _guardable(res):
+        if res.status_code != 200 or "no-store" in res.headers.get("Cache-Control", ""):
+            return False
+        largo = res.headers.get("Content-Length", "")
+        return not (largo.isdigit() and int(largo) > MAX_BYTES_OBJETO)
+
+    @staticmethod
+    def _headers_guardados(res):
+        headers = {k: v for k, v in res.headers.items() if k.lower() not in HEADERS_DESCARTADOS}
+        if "Content-Encoding" in res.headers:
+            # El cuerpo se guarda ya descomprimido: el largo original no aplica
+            headers.pop("Content-Length", None)
+        return headers
+
+    def _guardar_al_leer(self, request, res, clave_url):
+        """Reemplaza el raw de `res` por uno que va guardando en disco lo que el llamador lee."""
+        headers = self._headers_guardados(res)
+        lector = LectorQueGuarda(res.raw, self.cache, clave_url, res.status_code, res.reason, headers)
+        nuevo = HTTPResponse(body=lector, headers=headers, status=res.status_code, reason=res.reason,
+                             preload_content=False, decode_content=False, request_method=request.method,
+                             request_url=request.url)
+        respuesta = self.build_response(request, nuevo)
+        respuesta.cookies.update(res.cookies)
+        respuesta.history = res.history
+        return respuesta
+
+    def _respuesta_cache(self, request, entrada, status=None):
+        """Respuesta armada desde el disco; None si el cuerpo ya no está (lo desalojó otro hilo o proceso)."""
+        status = status or entrada["status"]
+        headers = {**entrada["headers"], "X-Cache": "OFFLINE" if self.offline else "REVALIDADO"}
+        if status == 200:
+            try:
+                cuerpo = open(self.cache.ruta(entrada["clave"]), "rb")
+            except FileNotFoundError:
+                self.cache._borrar([entrada["clave"]])
+                return None
+        else:
+            cuerpo = io.BytesIO(b"")
+            headers.pop("Content-Length", None)
+        nuevo = HTTPResponse(body=cuerpo, headers=headers, status=status,
+                             reason=entrada["reason"] if status == 200 else "Not Modified",
+                             preload_content=False, decode_content=False, request_method=request.method,
+                             request_url=request.url)
+        return self.build_response(request, nuevo)
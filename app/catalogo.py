@@ -0,0 +1,244 @@
+import os
+import io
+import re
+import sys
+import json
+import argparse
+import unicodedata
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import almacenamiento
+
+# ==========================================
+# CATÁLOGO DE DOCUMENTOS (PARQUET POR REGIÓN)
+# ==========================================
+# Una fila tipada por documento (proyecto, id SEIA, nombre, fecha, URL de origen,
+# URI en GCS, tamaño, hashes, mime) en
+#
+#   catalogo/region=<slug>/<proyecto_id>.parquet
+#
+# El archivo del proyecto se reescribe completo en cada ejecución a partir del
+# manifiesto (que ya tiene todo lo subido, también lo de intentos anteriores):
+# re-scrapear no duplica filas, y si el proyecto cambió de región (ej: primero
+# "No especificada" desde la UI) se borra su archivo de la partición anterior. consultar() solo lee las particiones de las
+# regiones pedidas y filtra por fecha al leer cada archivo, así una pregunta como
+# "todas las RCA de Antofagasta desde 2020" no baja cientos de Excel.
+#
+#   python app/catalogo.py --region Antofagasta --desde 2020-01-01 --patron "RCA|calificaci[oó]n ambiental"
+#
+# El Excel Indice_Expediente_{id_seia}.xlsx por proyecto queda como exportación
+# opcional (SCRAPER_INDICE_EXCEL=1).
+
+PREFIJO = os.getenv("CATALOGO_PREFIJO", "catalogo")
+USAR_CATALOGO = os.getenv("SCRAPER_CATALOGO", "1") == "1"
+INDICE_EXCEL = os.getenv("SCRAPER_INDICE_EXCEL", "0") == "1"
+HILOS_LECTURA = int(os.getenv("CATALOGO_HILOS", "16"))
+
+ESQUEMA = pa.schema([
+    ("proyecto_id", pa.string()),
+    ("id_seia", pa.string()),
+    ("nombre_proyecto", pa.string()),
+    ("titular", pa.string()),
+    ("region", pa.string()),
+    ("comuna", pa.string()),
+    ("tipo_fuente", pa.string()),
+    ("nombre_documento", pa.string()),
+    ("fecha_documento", pa.date32()),
+    ("url_fuente", pa.string()),
+    ("uri_gcs", pa.string()),
+    ("ruta_logica", pa.string()),
+    ("bytes", pa.int64()),
+    ("sha256", pa.string()),
+    ("md5", pa.string()),
+    ("mime", pa.string()),
+    ("actualizado", pa.timestamp("s")),
+])
+
+_RE_FECHA = re.compile(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})")
+_MIME_POR_EXTENSION = {".pdf": "application/pdf", ".html": "text/html", ".htm": "text/html",
+                       ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+
+
+def slug_region(region):
+    """'Región de Antofagasta' / 'antofagasta' -> 'antofagasta' (nombre de la partición)."""
+    texto = unicodedata.normalize("NFKD", str(region or "")).encode("ascii", "ignore").decode("ascii").lower()
+    texto = re.sub(r"^\s*region\s+(de\s+(la\s+)?|del\s+)?", "", texto)
+    return re.sub(r"[^a-z0-9]+", "_", texto).strip("_") or "sin_region"
+
+
+def ruta_proyecto(region, id_proyecto):
+    return f"{PREFIJO}/region={slug_region(region)}/{id_proyecto}.parquet"
+
+
+def _fecha(valor):
+    """Fecha de la bitácora del SEIA (dd/mm/aaaa, a veces con hora) como date; None si no se entiende."""
+    m = _RE_FECHA.search(valor or "")
+    if not m:
+        return None
+    try:
+        return date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+    except ValueError:
+        return None
+
+
+def _mime(entrada):
+    if entrada.get("content_type"):
+        return entrada["content_type"].split(";")[0].strip()
+    ruta = entrada.get("ruta_logica") or entrada.get("ruta_gcs") or ""
+    return _MIME_POR_EXTENSION.get(os.path.splitext(ruta)[1].lower())
+
+
+def filas_de_manifiesto(manifiesto, params_base, id_seia=None):
+    """Una fila por documento con URL de origen (la ficha principal y el Excel de búsqueda no van)."""
+    filas = []
+    for url, entrada in manifiesto.entradas.items():
+        if not url.startswith("http"):
+            continue
+        info = entrada.get("info") or {}
+        actualizado = entrada.get("actualizado")
+        filas.append({
+            "proyecto_id": str(params_base.get("proyecto_id", manifiesto.id_proyecto)),
+            "id_seia": str(id_seia) if id_seia else None,
+            "nombre_proyecto": params_base.get("nombre_proyecto"),
+            "titular": params_base.get("titular"),
+            "region": params_base.get("region"),
+            "comuna": params_base.get("comuna"),
+            "tipo_fuente": info.get("tipo_fuente"),
+            "nombre_documento": info.get("nombre_documento"),
+            "fecha_documento": _fecha(info.get("fecha_documento") or entrada.get("fecha")),
+            "url_fuente": url,
+            "uri_gcs": entrada.get("ruta_gcs"),
+            "ruta_logica": entrada.get("ruta_logica"),
+            "bytes": entrada.get("bytes"),
+            "sha256": entrada.get("sha256"),
+            "md5": entrada.get("md5"),
+            "mime": _mime(entrada),
+            "actualizado": datetime.fromisoformat(actualizado) if actualizado else None,
+        })
+    return filas
+
+
+def escribir_proyecto(bucket, params_base, manifiesto, id_seia=None):
+    """
+    Reescribe el Parquet del proyecto en la partición de su región y borra los que tenga en
+    otras regiones (consultar() los devolvería duplicados). Retorna la cantidad de filas.
+    """
+    filas = filas_de_manifiesto(manifiesto, params_base, id_seia)
+    tabla = pa.Table.from_pylist(filas, schema=ESQUEMA)
+    buffer = io.BytesIO()
+    pq.write_table(tabla, buffer, compression="zstd")
+    ruta = ruta_proyecto(params_base.get("region"), manifiesto.id_proyecto)
+    bucket.blob(ruta).upload_from_string(buffer.getvalue(), content_type="application/vnd.apache.parquet")
+    for blob in almacenamiento.listar_blobs(bucket, prefix=f"{PREFIJO}/",
+                                            match_glob=f"{PREFIJO}/region=*/{manifiesto.id_proyecto}.parquet"):
+        if blob.name != ruta:
+            blob.delete()
+    return len(filas)
+
+
+def consultar(bucket, regiones=None, desde=None, hasta=None, patron=None, proyectos=None, columnas=None,
+              hilos=HILOS_LECTURA):
+    """
+    Documentos del catálogo como DataFrame.
+    `regiones`: nombre o lista ('Antofagasta', 'Región de Antofagasta'...); sin regiones se lee todo.
+    `desde` / `hasta`: date o 'aaaa-mm-dd' sobre fecha_documento (inclusive).
+    `patron`: regex (sin distinguir mayúsculas) sobre nombre_documento, ej: 'RCA|calificaci[oó]n ambiental'.
+    `proyectos`: lista de proyecto_id. `columnas`: subconjunto de columnas a leer.
+    """
+    if isinstance(regiones, str):
+        regiones = [regiones]
+    prefijos = [f"{PREFIJO}/region={slug_region(r)}/" for r in regiones] if regiones else [f"{PREFIJO}/"]
+    blobs = [b for p in prefijos for b in almacenamiento.listar_blobs(bucket, prefix=p) if b.name.endswith(".parquet")]
+    if proyectos:
+        nombres = {f"{p}.parquet" for p in map(str, proyectos)}
+        blobs = [b for b in blobs if b.name.rsplit("/", 1)[-1] in nombres]
+
+    filtros = []
+    if desde:
+        filtros.append(("fecha_documento", ">=", date.fromisoformat(str(desde))))
+    if hasta:
+        filtros.append(("fecha_documento", "<=", date.fromisoformat(str(hasta))))
+    leer = None
+    if columnas:
+        # Las columnas de filtro y orden se leen igual (se descartan al final)
+        leer = list(dict.fromkeys(list(columnas) + ["fecha_documento", "nombre_documento", "proyecto_id"]))
+
+    def _leer(blob):
+        return pq.read_table(pa.BufferReader(blob.download_as_bytes()), columns=leer, filters=filtros or None)
+
+    with ThreadPoolExecutor(max_workers=hilos) as ex:
+        tablas = [t for t in ex.map(_leer, blobs) if t.num_rows]
+    if not tablas:
+        vacio = ESQUEMA.empty_table().to_pandas()
+        return vacio[list(columnas)] if columnas else vacio
+
+    df = pa.concat_tables(tablas).to_pandas()
+    if patron:
+        df = df[df["nombre_documento"].fillna("").str.contains(patron, case=False, regex=True)]
+    df = df.sort_values(["fecha_documento", "proyecto_id"], na_position="last").reset_index(drop=True)
+    return df[list(columnas)] if columnas else df
+
+
+def indice_excel(df):
+    """Exportación opcional a Excel (bytes .xlsx) de un índice o de una consulta al catálogo."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False)
+    return output.getvalue()
+
+
+def main():
+    """Consulta el catálogo, o lo reconstruye para proyectos ya scrapeados (--reconstruir)."""
+    from manifiesto import ManifiestoProyecto
+
+    parser = argparse.ArgumentParser(description="Consulta el catálogo de documentos (Parquet por región).")
+    parser.add_argument("--bucket", default="almacen_antecedentes")
+    parser.add_argument("--region", action="append", help="Se puede repetir.")
+    parser.add_argument("--desde", help="aaaa-mm-dd")
+    parser.add_argument("--hasta", help="aaaa-mm-dd")
+    parser.add_argument("--patron", help="Regex sobre el nombre del documento.")
+    parser.add_argument("--proyecto", action="append")
+    parser.add_argument("--csv", help="Guarda el resultado en CSV.")
+    parser.add_argument("--excel", help="Guarda el resultado en Excel.")
+    parser.add_argument("--reconstruir", nargs="+", metavar="PROYECTO",
+                        help="Reescribe el catálogo de estos proyectos desde su manifiesto y metadata_import.jsonl.")
+    args = parser.parse_args()
+
+    bucket = almacenamiento.obtener_bucket(args.bucket)
+    if args.reconstruir:
+        for id_proyecto in args.reconstruir:
+            blob = bucket.blob(f"{id_proyecto}/metadata_import.jsonl")
+            if not blob.exists():
+                print(f"⚠️ {id_proyecto}: sin metadata_import.jsonl")
+                continue
+            # Los datos del proyecto (región, titular...) van repetidos en cada registro de Vertex
+            primera = next(l for l in blob.download_as_text().splitlines() if l.strip())
+            params_base = json.loads(json.loads(primera)["jsonData"])
+            n = escribir_proyecto(bucket, params_base, ManifiestoProyecto(bucket, id_proyecto))
+            print(f"✅ {id_proyecto}: {n} documentos en {ruta_proyecto(params_base.get('region'), id_proyecto)}")
+        return 0
+
+    t0 = datetime.now()
+    df = consultar(bucket, regiones=args.region, desde=args.desde, hasta=args.hasta, patron=args.patron,
+                   proyectos=args.proyecto)
+    print(f"🔎 {len(df)} documentos ({(datetime.now() - t0).total_seconds():.2f}s)")
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"💾 {args.csv}")
+    if args.excel:
+        with open(args.excel, "wb") as f:
+            f.write(indice_excel(df))
+        print(f"💾 {args.excel}")
+    if not args.csv and not args.excel:
+        with pd.option_context("display.max_rows", 50, "display.width", 200, "display.max_colwidth", 60):
+            print(df[["proyecto_id", "region", "fecha_documento", "nombre_documento", "uri_gcs"]])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+# ==========================================
+# CHECKPOINTS POR PROYECTO (REANUDAR SCRAPES INTERRUMPIDOS)
+# ==========================================
+# {id_proyecto}/_checkpoint.json registra qué etapas terminaron (ficha, documentos
+# de detalle, listado del expediente, cada fila del expediente, Excel de búsqueda)
+# junto con los registros de metadata ya generados. Un nuevo intento parte desde
+# el primer ítem incompleto. Al terminar todo se elimina.
+# El listado guardado del expediente caduca (MAX_EDAD_LISTADO_HORAS): pasado ese
+# tiempo se vuelve a pedir, para no quedar ciego a documentos nuevos.
+
+NOMBRE_CHECKPOINT = "_checkpoint.json"
+
+# Etapas en el orden en que las recorre ejecutar_scrapping
+FICHA = "ficha"
+DETALLE = "documentos_detalle"
+EXPEDIENTE_INDICE = "expediente_indice"
+EXPEDIENTE = "expediente"
+EXCEL_BUSQUEDA = "excel_busqueda"
+
+# Cada cuántas filas (o segundos) se persiste el avance del expediente
+GUARDAR_CADA_FILAS = 20
+GUARDAR_CADA_SEGUNDOS = 30
+MAX_EDAD_LISTADO_HORAS = float(os.getenv("CHECKPOINT_MAX_EDAD_LISTADO_HORAS", "24"))
+
+
+class CheckpointProyecto:
+
+    def __init__(self, bucket, id_proyecto):
+        self.bucket = bucket
+        self.ruta = f"{id_proyecto}/{NOMBRE_CHECKPOINT}"
+        self.estado = {"etapas": {}, "filas_expediente": {}}
+        self._lock = threading.Lock()
+        self._filas_sin_guardar = 0
+        self._ultimo_guardado = time.monotonic()
+        self._cargar()
+
+    def _cargar(self):
+        blob = self.bucket.blob(self.ruta)
+        try:
+            if blob.exists():
+                self.estado = json.loads(blob.download_as_text())
+                self.estado.setdefault("etapas", {})
+                self.estado.setdefault("filas_expediente", {})
+                print(f"   ♻️ Checkpoint encontrado: etapas completas {list(self.estado['etapas'])}, "
+                      f"{len(self.estado['filas_expediente'])} filas de expediente.", flush=True)
+        except Exception as e:
+            print(f"   ⚠️ Checkpoint ilegible ({self.ruta}), se parte de cero: {e}", flush=True)
+
+    @property
+    def reanudando(self):
+        return bool(self.estado["etapas"] or self.estado["filas_expediente"])
+
+    def completada(self, etapa):
+        return etapa in self.estado["etapas"]
+
+    def datos(self, etapa):
+        return self.estado["etapas"].get(etapa)
+
+    def marcar(self, etapa, datos=None):
+        """Marca la etapa como completa (con sus datos para reanudar) y persiste de inmediato."""
+        with self._lock:
+            self.estado["etapas"][etapa] = datos if datos is not None else {}
+        self.guardar()
+
+    def listado_vigente(self):
+        """Datos del listado del expediente guardado si no superó MAX_EDAD_LISTADO_HORAS; si caducó lo descarta."""
+        guardado = self.datos(EXPEDIENTE_INDICE)
+        if not guardado:
+            return None
+        marcado = guardado.get("guardado")
+        edad_h = (datetime.now() - datetime.fromisoformat(marcado)).total_seconds() / 3600 if marcado else float("inf")
+        if edad_h <= MAX_EDAD_LISTADO_HORAS:
+            return guardado
+        # La numeración NNN_ de las filas depende del listado: caduca junto con él
+        print(f"   ♻️ Listado del checkpoint con {edad_h:.0f}h de antigüedad: se vuelve a pedir.", flush=True)
+        with self._lock:
+            self.estado["etapas"].pop(EXPEDIENTE_INDICE, None)
+            self.estado["filas_expediente"] = {}
+        return None
+
+    def marcar_listado(self, datos):
+        self.marcar(EXPEDIENTE_INDICE, {**datos, "guardado": datetime.now().isoformat(timespec="seconds")})
+
+    def fila(self, indice):
+        """Registro de metadata de una fila del expediente ya subida, o None."""
+        return self.estado["filas_expediente"].get(str(indice))
+
+    def marcar_fila(self, indice, registro):
+        with self._lock:
+            self.estado["filas_expediente"][str(indice)] = registro
+            self._filas_sin_guardar += 1
+            toca_guardar = (self._filas_sin_guardar >= GUARDAR_CADA_FILAS
+                            or time.monotonic() - self._ultimo_guardado >= GUARDAR_CADA_SEGUNDOS)
+        if toca_guardar:
+            self.guardar()
+
+    def guardar(self):
+        with self._lock:
+            self.estado["actualizado"] = datetime.now().isoformat(timespec="seconds")
+            contenido = json.dumps(self.estado, ensure_ascii=False)
+            self._filas_sin_guardar = 0
+            self._ultimo_guardado = time.monotonic()
+        self.bucket.blob(self.ruta).upload_from_string(contenido, content_type="application/json")
+
+    def limpiar(self):
+        """El proyecto terminó completo: el próximo scrape parte de cero (o en modo incremental)."""
+        blob = self.bucket.blob(self.ruta)
+        try:
+            if blob.exists():
+                blob.delete()
+        except Exception as e:
+            print(f"   ⚠️ No se pudo borrar el checkpoint: {e}", flush=True)
+        self.estado = {"etapas": {}, "filas_expediente": {}}
@@ -0,0 +1,235 @@
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+# ==========================================
+# COLA DURABLE DE TRABAJOS (SQLite)
+# ==========================================
+# app.py encola lotes de proyectos y consulta su progreso; worker.py (proceso
+# aparte) los toma y los procesa. Cada proyecto se "arrienda" por un tiempo
+# (lease): si el worker muere, el lease vence y otro worker lo retoma.
+
+DB_PATH = os.getenv("COLA_DB_PATH", "/tmp/cola_trabajos.db" if os.environ.get("K_SERVICE") else os.path.join(os.getcwd(), "cola_trabajos.db"))
+LEASE_SEGUNDOS = int(os.getenv("COLA_LEASE_SEGUNDOS", "1800"))
+MAX_INTENTOS = int(os.getenv("COLA_MAX_INTENTOS", "3"))
+
+# Estados de un proyecto dentro de un trabajo
+PENDIENTE, EN_CURSO, EXITOSO, SIN_RESULTADOS, ERROR = "pendiente", "en_curso", "exitoso", "sin_resultados", "error"
+ESTADOS_FINALES = (EXITOSO, SIN_RESULTADOS, ERROR)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    creado TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    descripcion TEXT,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS proyectos_trabajo (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trabajo_id INTEGER NOT NULL REFERENCES trabajos(id),
+    proyecto_id TEXT NOT NULL,
+    nombre TEXT,
+    payload TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_hasta TEXT,
+    resultado TEXT,
+    logs TEXT,
+    actualizado TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_pt_estado ON proyectos_trabajo(estado, lease_hasta);
+CREATE INDEX IF NOT EXISTS idx_pt_trabajo ON proyectos_trabajo(trabajo_id);
+CREATE TABLE IF NOT EXISTS filas_bq (
+    item_id INTEGER PRIMARY KEY REFERENCES proyectos_trabajo(id),
+    fila TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    creado TEXT NOT NULL
+);
+"""
+
+
+def _ahora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def conectar(db_path=None):
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL: la UI puede leer el progreso mientras el worker escribe
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_ESQUEMA)
+    return conn
+
+
+def _serializar(valor):
+    # Fechas en el mismo formato que el scraper usa para buscar en SEIA (dd/mm/aaaa)
+    return valor.strftime('%d/%m/%Y') if hasattr(valor, "strftime") else str(valor)
+
+
+def encolar_trabajo(conn, proyectos, bucket_name, descripcion=None):
+    """Crea un trabajo con sus proyectos (dicts con id, nombre, titular, fecha_presentacion, region, comuna)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute(
+            "INSERT INTO trabajos (creado, bucket, descripcion, total) VALUES (?, ?, ?, ?)",
+            (_ahora(), bucket_name, descripcion, len(proyectos))
+        )
+        trabajo_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO proyectos_trabajo (trabajo_id, proyecto_id, nombre, payload, actualizado) VALUES (?, ?, ?, ?, ?)",
+            [(trabajo_id, str(p['id']), p.get('nombre'), json.dumps(p, default=_serializar, ensure_ascii=False), _ahora()) for p in proyectos]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return trabajo_id
+
+
+def tomar_siguiente(conn, worker_id, lease_segundos=LEASE_SEGUNDOS):
+    """
+    Reserva atómicamente el siguiente proyecto pendiente (o con lease vencido).
+    Retorna dict con id, trabajo_id, bucket y proyecto; None si no hay nada que hacer.
+    """
+    ahora = _ahora()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Lease vencido en el último intento: el worker murió con él, no hay a quién devolverlo
+        conn.execute(
+            """UPDATE proyectos_trabajo
+               SET estado = ?, lease_hasta = NULL, actualizado = ?,
+                   resultado = COALESCE(resultado || '|', '') || '❌ ERROR: el worker dejó de responder en el último intento'
+               WHERE estado = ? AND lease_hasta < ? AND intentos >= ?""",
+            (ERROR, ahora, EN_CURSO, ahora, MAX_INTENTOS)
+        )
+        fila = conn.execute(
+            """SELECT pt.id, pt.trabajo_id, pt.payload, pt.intentos, t.bucket
+               FROM proyectos_trabajo pt JOIN trabajos t ON t.id = pt.trabajo_id
+               WHERE (pt.estado = ? OR (pt.estado = ? AND pt.lease_hasta < ?))
+                 AND pt.intentos < ?
+               ORDER BY pt.trabajo_id, pt.id LIMIT 1""",
+            (PENDIENTE, EN_CURSO, ahora, MAX_INTENTOS)
+        ).fetchone()
+        if fila is None:
+            conn.execute("COMMIT")
+            return None
+        lease = (datetime.now() + timedelta(seconds=lease_segundos)).isoformat(timespec="seconds")
+        conn.execute(
+            "UPDATE proyectos_trabajo SET estado = ?, worker = ?, lease_hasta = ?, intentos = intentos + 1, actualizado = ? WHERE id = ?",
+            (EN_CURSO, worker_id, lease, ahora, fila["id"])
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {"id": fila["id"], "trabajo_id": fila["trabajo_id"], "bucket": fila["bucket"],
+            "intentos": fila["intentos"] + 1, "proyecto": json.loads(fila["payload"])}
+
+
+def renovar_lease(conn, item_id, worker_id, lease_segundos=LEASE_SEGUNDOS):
+    """Latido del worker: extiende el lease mientras el proyecto sigue en proceso. False si ya no es suyo."""
+    lease = (datetime.now() + timedelta(seconds=lease_segundos)).isoformat(timespec="seconds")
+    cur = conn.execute(
+        "UPDATE proyectos_trabajo SET lease_hasta = ?, actualizado = ? WHERE id = ? AND worker = ? AND estado = ?",
+        (lease, _ahora(), item_id, worker_id, EN_CURSO)
+    )
+    return cur.rowcount > 0
+
+
+def finalizar_proyecto(conn, item_id, estado, resultado=None, logs=None, fila_bq=None):
+    """
+    Cierra el proyecto. Con `fila_bq` (dict de data_manager.leer_fila_excel) la fila para
+    seia_limpio queda guardada en la misma transacción: si el worker muere antes del MERGE
+    se envía al volver a arrancar.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "UPDATE proyectos_trabajo SET estado = ?, resultado = ?, logs = ?, lease_hasta = NULL, actualizado = ? WHERE id = ?",
+            (estado, resultado, logs, _ahora(), item_id)
+        )
+        if fila_bq is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO filas_bq (item_id, fila, intentos, error, creado) VALUES (?, ?, 0, NULL, ?)",
+                (item_id, json.dumps(fila_bq, default=lambda v: v.isoformat(), ensure_ascii=False), _ahora())
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# --- Filas pendientes para BigQuery (se aplican por lote desde worker.py) ---
+
+def filas_bq_pendientes(conn, max_intentos, limite=None):
+    """Lista de (item_id, fila) que aún no llegan a BigQuery y no agotaron sus intentos (más antiguas primero)."""
+    filas = conn.execute(
+        "SELECT item_id, fila FROM filas_bq WHERE intentos < ? ORDER BY creado, item_id LIMIT ?",
+        (max_intentos, -1 if limite is None else limite)
+    )
+    return [(f["item_id"], json.loads(f["fila"])) for f in filas]
+
+
+def antiguedad_filas_bq(conn, max_intentos):
+    """(cantidad, segundos desde la más antigua) de las filas pendientes."""
+    fila = conn.execute("SELECT COUNT(*) AS n, MIN(creado) AS primera FROM filas_bq WHERE intentos < ?", (max_intentos,)).fetchone()
+    if not fila["n"]:
+        return 0, 0.0
+    return fila["n"], (datetime.now() - datetime.fromisoformat(fila["primera"])).total_seconds()
+
+
+def confirmar_filas_bq(conn, item_ids):
+    conn.executemany("DELETE FROM filas_bq WHERE item_id = ?", [(i,) for i in item_ids])
+
+
+def fallo_filas_bq(conn, item_ids, error):
+    conn.executemany("UPDATE filas_bq SET intentos = intentos + 1, error = ? WHERE item_id = ?", [(error, i) for i in item_ids])
+
+
+def reactivar_filas_bq(conn):
+    """Al arrancar un worker: las filas que agotaron sus intentos vuelven a probarse (no se descartan nunca)."""
+    return conn.execute("UPDATE filas_bq SET intentos = 0").rowcount
+
+
+def anotar_resultado(conn, item_id, nota):
+    """Agrega una nota al resultado de un proyecto ya finalizado (ej: su fila aún no entra a BigQuery)."""
+    conn.execute(
+        "UPDATE proyectos_trabajo SET resultado = COALESCE(resultado, '') || '|' || ?, actualizado = ? WHERE id = ?",
+        (nota, _ahora(), item_id)
+    )
+
+
+def liberar_proyecto(conn, item_id, resultado=None, logs=None):
+    """Devuelve un proyecto fallido a la cola si le quedan intentos; si no, lo marca como error."""
+    conn.execute(
+        """UPDATE proyectos_trabajo
+           SET estado = CASE WHEN intentos < ? THEN ? ELSE ? END,
+               resultado = ?, logs = ?, lease_hasta = NULL, actualizado = ?
+           WHERE id = ?""",
+        (MAX_INTENTOS, PENDIENTE, ERROR, resultado, logs, _ahora(), item_id)
+    )
+
+
+def progreso_trabajo(conn, trabajo_id):
+    """Conteo por estado de un trabajo: {'total': n, 'pendiente': n, ...}."""
+    conteo = {e: 0 for e in (PENDIENTE, EN_CURSO) + ESTADOS_FINALES}
+    for fila in conn.execute("SELECT estado, COUNT(*) AS n FROM proyectos_trabajo WHERE trabajo_id = ? GROUP BY estado", (trabajo_id,)):
+        conteo[fila["estado"]] = fila["n"]
+    conteo["total"] = sum(conteo.values())
+    conteo["terminados"] = sum(conteo[e] for e in ESTADOS_FINALES)
+    return conteo
+
+
+def proyectos_de_trabajo(conn, trabajo_id):
+    return [dict(f) for f in conn.execute(
+        "SELECT id, proyecto_id, nombre, estado, intentos, resultado, logs, actualizado FROM proyectos_trabajo WHERE trabajo_id = ? ORDER BY id",
+        (trabajo_id,)
+    )]
+
+
+def listar_trabajos(conn, limite=20):
+    return [dict(f) for f in conn.execute("SELECT * FROM trabajos ORDER BY id DESC LIMIT ?", (limite,))]
@@ -0,0 +1,189 @@
+import os
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+# ==========================================
+# CONTROL ADAPTATIVO DE TASA POR HOST (AIMD + CORTACIRCUITOS)
+# ==========================================
+# Un controlador por host (seia.sea.gob.cl, firma.sea.gob.cl, ...) compartido por
+# todos los hilos y proyectos del proceso. Decide cuántas peticiones puede haber
+# en vuelo contra ese host:
+#   - cada respuesta sana y con latencia normal suma 1/límite (≈ +1 por "ventana")
+#   - un 429, 5xx o timeout corta el límite a la mitad (una vez por ventana)
+#   - 429 con Retry-After pausa el host ese tiempo
+#   - FALLAS_PARA_ABRIR fallas seguidas abren el circuito: el host se pausa
+#     (PAUSA_INICIAL_S, duplicándose hasta PAUSA_MAX_S) y al volver se prueba con
+#     una sola petición antes de reabrir el tráfico; las respuestas de peticiones
+#     que ya estaban en vuelo cuando se abrió no cuentan (solo la sonda decide)
+# Quien esperaría más de ESPERA_MAX_S por un circuito abierto recibe CircuitoAbierto:
+# la etapa termina y el checkpoint deja las filas pendientes para el próximo intento.
+
+CONTROL_ADAPTATIVO = os.getenv("CONTROL_TASA", "1") == "1"
+LIMITE_INICIAL = int(os.getenv("DESCARGA_MAX_POR_HOST", "3"))
+LIMITE_MINIMO = int(os.getenv("CONTROL_LIMITE_MINIMO", "1"))
+LIMITE_MAXIMO = int(os.getenv("CONTROL_LIMITE_MAXIMO", "12"))
+# Latencia sobre FACTOR_LATENCIA veces la mejor observada: se deja de subir
+FACTOR_LATENCIA = float(os.getenv("CONTROL_FACTOR_LATENCIA", "2.0"))
+FALLAS_PARA_ABRIR = int(os.getenv("CONTROL_FALLAS_PARA_ABRIR", "6"))
+PAUSA_INICIAL_S = float(os.getenv("CONTROL_PAUSA_INICIAL_S", "15"))
+PAUSA_MAX_S = float(os.getenv("CONTROL_PAUSA_MAX_S", "240"))
+ESPERA_MAX_S = float(os.getenv("CONTROL_ESPERA_MAX_S", "600"))
+VENTANA_TASA_S = 10.0
+
+ESTADOS_SOBRECARGA = {429, 500, 502, 503, 504}
+
+
+class CircuitoAbierto(Exception):
+    """El host sigue fallando: no tiene sentido seguir pidiéndole documentos ahora."""
+
+
+class ControlHost:
+
+    def __init__(self, host, inicial=LIMITE_INICIAL, minimo=LIMITE_MINIMO, maximo=LIMITE_MAXIMO,
+                 adaptativo=CONTROL_ADAPTATIVO):
+        self.host = host
+        self.minimo = minimo
+        self.maximo = max(maximo, inicial)
+        self.limite = float(inicial)
+        self.adaptativo = adaptativo
+        self.en_vuelo = 0
+        self.latencia_ewma = None
+        self.latencia_minima = None
+        self.fallas_seguidas = 0
+        self.abierto_hasta = 0.0
+        self.semiabierto = False
+        self.pausa = PAUSA_INICIAL_S
+        self.aperturas = 0
+        self.generacion = 0   # sube con cada apertura del circuito
+        self.reducciones = 0
+        self._ultima_reduccion = 0.0
+        self._completadas = deque()
+        self._cond = threading.Condition()
+
+    # --- permisos ---
+
+    def adquirir(self, espera_max=ESPERA_MAX_S):
+        """Espera cupo. Retorna el ticket (generación, es_sonda) que hay que devolver en liberar()."""
+        limite_espera = time.monotonic() + espera_max
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                if self.abierto_hasta > ahora:
+                    if self.abierto_hasta > limite_espera:
+                        raise CircuitoAbierto(f"{self.host} en pausa por {self.abierto_hasta - ahora:.0f}s más")
+                    self._cond.wait(self.abierto_hasta - ahora)
+                    continue
+                # Semiabierto: solo una petición de prueba a la vez
+                tope = 1 if self.semiabierto else max(self.minimo, int(self.limite))
+                if self.en_vuelo < tope:
+                    self.en_vuelo += 1
+                    return (self.generacion, self.semiabierto)
+                if ahora >= limite_espera:
+                    raise CircuitoAbierto(f"{self.host}: sin cupo tras {espera_max:.0f}s")
+                self._cond.wait(min(1.0, limite_espera - ahora))
+
+    def liberar(self, status=None, latencia_s=None, error_red=False, retry_after=None, ticket=None):
+        """
+        Informa cómo terminó la petición: `status` HTTP, o error_red=True (timeout/conexión).
+        Sin ninguno de los dos solo devuelve el cupo (error local, no dice nada del host).
+        `ticket` es lo que retornó adquirir(): una petición de antes de la última apertura, o
+        una que no es la sonda mientras el circuito está semiabierto, solo devuelve el cupo.
+        """
+        with self._cond:
+            self.en_vuelo -= 1
+            ahora = time.monotonic()
+            self._completadas.append(ahora)
+            while self._completadas and self._completadas[0] < ahora - VENTANA_TASA_S:
+                self._completadas.popleft()
+
+            generacion, sonda = ticket if ticket is not None else (self.generacion, self.semiabierto)
+            vigente = generacion == self.generacion and (sonda or not self.semiabierto)
+            if not vigente:
+                pass
+            elif error_red or status in ESTADOS_SOBRECARGA:
+                self._falla(ahora, retry_after)
+            elif status is not None:
+                self._exito(latencia_s)
+            self._cond.notify_all()
+
+    def _exito(self, latencia_s):
+        self.fallas_seguidas = 0
+        if self.semiabierto:
+            self.semiabierto = False
+            self.pausa = PAUSA_INICIAL_S
+            self.limite = float(self.minimo)
+            print(f"      🔌 Circuito cerrado para {self.host}: se retoma con {self.minimo} conexión(es).", flush=True)
+        if latencia_s is not None:
+            self.latencia_ewma = latencia_s if self.latencia_ewma is None else 0.8 * self.latencia_ewma + 0.2 * latencia_s
+            self.latencia_minima = latencia_s if self.latencia_minima is None else min(self.latencia_minima, latencia_s)
+        if not self.adaptativo:
+            return
+        # Aumento aditivo solo mientras la latencia no se degrade (la cola del servidor no está creciendo)
+        if self.latencia_ewma is None or self.latencia_ewma <= FACTOR_LATENCIA * max(self.latencia_minima, 0.05):
+            self.limite = min(self.maximo, self.limite + 1.0 / max(self.limite, 1.0))
+
+    def _falla(self, ahora, retry_after):
+        self.fallas_seguidas += 1
+        if self.adaptativo and ahora - self._ultima_reduccion >= max(self.latencia_ewma or 0.0, 1.0):
+            # Disminución multiplicativa, una vez por ventana: una ráfaga de 503 no lo lleva a cero
+            self.limite = max(float(self.minimo), self.limite / 2)
+            self._ultima_reduccion = ahora
+            self.reducciones += 1
+        if retry_after:
+            self.abierto_hasta = max(self.abierto_hasta, ahora + retry_after)
+        if self.semiabierto or self.fallas_seguidas >= FALLAS_PARA_ABRIR:
+            self._abrir(ahora)
+
+    def _abrir(self, ahora):
+        self.abierto_hasta = max(self.abierto_hasta, ahora + self.pausa)
+        print(f"      🔌 Circuito abierto para {self.host} ({self.fallas_seguidas} fallas seguidas): pausa de {self.pausa:.0f}s.", flush=True)
+        self.pausa = min(self.pausa * 2, PAUSA_MAX_S)
+        self.semiabierto = True
+        self.fallas_seguidas = 0
+        self.aperturas += 1
+        self.generacion += 1
+
+    def estado(self):
+        with self._cond:
+            ahora = time.monotonic()
+            if self.abierto_hasta > ahora:
+                circuito = "abierto"
+            else:
+                circuito = "semiabierto" if self.semiabierto else "cerrado"
+            return {
+                "limite": round(self.limite, 2),
+                "en_vuelo": self.en_vuelo,
+                "tasa_rps": round(len(self._completadas) / VENTANA_TASA_S, 2),
+                "latencia_ms": round(self.latencia_ewma * 1000) if self.latencia_ewma is not None else None,
+                "circuito": circuito,
+                "aperturas": self.aperturas,
+                "reducciones": self.reducciones,
+            }
+
+
+class ControlTasa:
+    """Registro de ControlHost por host: `host(url)` entrega el controlador de ese host."""
+
+    def __init__(self, inicial=LIMITE_INICIAL, adaptativo=CONTROL_ADAPTATIVO):
+        self.inicial = inicial
+        self.adaptativo = adaptativo
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        nombre = urlparse(url).netloc
+        with self._lock:
+            if nombre not in self._hosts:
+                self._hosts[nombre] = ControlHost(nombre, inicial=self.inicial, adaptativo=self.adaptativo)
+            return self._hosts[nombre]
+
+    def estado(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {nombre: control.estado() for nombre, control in hosts.items()}
+
+
+# Compartido por todo el proceso (varios proyectos en paralelo pegan a los mismos hosts)
+CONTROL = ControlTasa()
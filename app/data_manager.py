@@ -1,110 +1,509 @@
+import os
+import time
+import threading
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 from google.cloud import bigquery
 
-def consultar_proyectos_bq(client, table_path, lat, lon, radio_km):
-    """Ejecuta la query geoespacial en BigQuery."""
-    query = f"""
-        SELECT 
-            id,
+# ==========================================
+# CONSULTA GEOESPACIAL CON CACHÉ (BigQuery)
+# ==========================================
+# La query se parametriza y se centra en la celda geohash del punto (con el radio
+# ampliado para cubrir toda la celda). Así, puntos cercanos generan exactamente
+# la misma query: pegan en la caché de BigQuery y en la caché local TTL/LRU.
+# Las distancias reales al punto se recalculan localmente (haversine).
+
+GEOHASH_PRECISION = int(os.getenv("GEOHASH_PRECISION", "6"))   # celda de ~1.2 x 0.6 km
+CACHE_TTL_SEGUNDOS = int(os.getenv("BQ_CACHE_TTL_S", "600"))
+CACHE_MAX_ENTRADAS = int(os.getenv("BQ_CACHE_MAX", "64"))
+# Tope de filas de la consulta cacheada por celda; más allá se pagina la query completa
+LIMITE_CONSULTA = int(os.getenv("BQ_LIMITE_CONSULTA", "1000"))
+# Tabla opcional con columna GEOGRAPHY `geo` materializada y CLUSTER BY geo (ver crear_tabla_geografica)
+BQ_GEO_TABLE_PATH = os.getenv("BQ_GEO_TABLE_PATH")
+
+RADIO_TIERRA_KM = 6371.0088
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+COLUMNAS_PROYECTO = """id,
             nombre_proyecto as nombre_original,
             titular, 
             fecha_presentacion,
             fecha_calificacion,
-            latitud, longitud, region, provincia, comuna, tipo_proyecto, estado_proyecto, inversion_mmu,
-            ST_DISTANCE(SAFE.ST_GEOGPOINT(longitud, latitud), SAFE.ST_GEOGPOINT({lon}, {lat})) / 1000 as distancia_km
-        FROM `{table_path}`
-        WHERE SAFE.ST_GEOGPOINT(longitud, latitud) IS NOT NULL
-          AND ST_DWITHIN(SAFE.ST_GEOGPOINT(longitud, latitud), SAFE.ST_GEOGPOINT({lon}, {lat}), {radio_km * 1000})
-        ORDER BY distancia_km ASC LIMIT 1000
+            latitud, longitud, region, provincia, comuna, tipo_proyecto, estado_proyecto, inversion_mmu"""
+COLUMNAS_RESULTADO = ['id', 'nombre_original', 'titular', 'fecha_presentacion', 'fecha_calificacion', 'latitud', 'longitud',
+                      'region', 'provincia', 'comuna', 'tipo_proyecto', 'estado_proyecto', 'inversion_mmu', 'distancia_km']
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Celda geohash (base32) que contiene el punto."""
+    lat_rng, lon_rng = [-90.0, 90.0], [-180.0, 180.0]
+    bits, bit, ch, es_lon, celda = [16, 8, 4, 2, 1], 0, 0, True, []
+    while len(celda) < precision:
+        rng, valor = (lon_rng, lon) if es_lon else (lat_rng, lat)
+        medio = (rng[0] + rng[1]) / 2
+        if valor >= medio:
+            ch |= bits[bit]
+            rng[0] = medio
+        else:
+            rng[1] = medio
+        es_lon = not es_lon
+        if bit < 4:
+            bit += 1
+        else:
+            celda.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(celda)
+
+
+def geohash_bbox(celda):
+    """(lat_min, lat_max, lon_min, lon_max) de una celda geohash."""
+    lat_rng, lon_rng, es_lon = [-90.0, 90.0], [-180.0, 180.0], True
+    for c in celda:
+        cd = _BASE32.index(c)
+        for mascara in (16, 8, 4, 2, 1):
+            rng = lon_rng if es_lon else lat_rng
+            medio = (rng[0] + rng[1]) / 2
+            if cd & mascara:
+                rng[0] = medio
+            else:
+                rng[1] = medio
+            es_lon = not es_lon
+    return lat_rng[0], lat_rng[1], lon_rng[0], lon_rng[1]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distancia (km) desde un punto a arreglos de puntos, vectorizada."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+
+
+class CacheTTL:
+    """Caché LRU en memoria con expiración por tiempo (segura entre hilos/sesiones)."""
+
+    def __init__(self, max_entradas=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL_SEGUNDOS):
+        self.max_entradas, self.ttl = max_entradas, ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            creado, valor = item
+            if time.monotonic() - creado > self.ttl:
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic(), valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_cache_consultas = CacheTTL()
+
+
+def _query_radio(table_path, limite=LIMITE_CONSULTA, deduplicar=False):
+    if BQ_GEO_TABLE_PATH:
+        # Columna geo materializada y clusterizada: BigQuery poda bloques por cercanía
+        origen = f"`{BQ_GEO_TABLE_PATH}`"
+    else:
+        # Sin tabla materializada, el punto se calcula UNA vez por fila
+        origen = f"(SELECT *, SAFE.ST_GEOGPOINT(longitud, latitud) AS geo FROM `{table_path}`)"
+    # En modo paginado los duplicados se quitan en SQL para que el total sea exacto
+    qualify = """
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY id, nombre_proyecto, titular, fecha_presentacion
+            ORDER BY ST_DISTANCE(geo, ST_GEOGPOINT(@lon, @lat))) = 1""" if deduplicar else ""
+    return f"""
+        SELECT 
+            {COLUMNAS_PROYECTO},
+            ST_DISTANCE(geo, ST_GEOGPOINT(@lon, @lat)) / 1000 as distancia_km
+        FROM {origen}
+        WHERE geo IS NOT NULL
+          AND ST_DWITHIN(geo, ST_GEOGPOINT(@lon, @lat), @radio_m){qualify}
+        ORDER BY distancia_km ASC{f" LIMIT {int(limite)}" if limite else ""}
+    """
+
+
+def crear_tabla_geografica(client, table_path, destino=None):
+    """
+    Crea/reemplaza la copia de `table_path` con `geo` GEOGRAPHY materializada y CLUSTER BY geo.
+    Debe refrescarse después de actualizar seia_limpio (ej: al terminar un lote de scraping).
     """
-    raw_df = client.query(query).to_dataframe()
-    # Limpieza de duplicados
-    return raw_df.drop_duplicates(subset=['id', 'nombre_original', 'titular', 'fecha_presentacion'])
+    destino = destino or BQ_GEO_TABLE_PATH or f"{table_path}_geo"
+    client.query(f"""
+        CREATE OR REPLACE TABLE `{destino}`
+        CLUSTER BY geo AS
+        SELECT *, SAFE.ST_GEOGPOINT(longitud, latitud) AS geo FROM `{table_path}`
+    """).result()
+    _cache_consultas.limpiar()
+    return destino
+
+
+def _consulta_celda(client, table_path, lat, lon, radio_km):
+    """
+    Resultado crudo (hasta LIMITE_CONSULTA filas) para la celda geohash del punto, con caché TTL/LRU.
+    Retorna (df, completo): completo=False si la query llegó al tope (se cuenta antes de quitar duplicados).
+    """
+    celda = geohash_encode(lat, lon)
+    clave = (table_path, BQ_GEO_TABLE_PATH, celda, float(radio_km))
+
+    guardado = _cache_consultas.obtener(clave)
+    if guardado is None:
+        # Centro de la celda + semidiagonal: el círculo ampliado contiene el de cualquier punto de la celda
+        lat_min, lat_max, lon_min, lon_max = geohash_bbox(celda)
+        lat_c, lon_c = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+        margen_km = float(haversine_km(lat_c, lon_c, [lat_max], [lon_max])[0])
+
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("lat", "FLOAT64", lat_c),
+            bigquery.ScalarQueryParameter("lon", "FLOAT64", lon_c),
+            bigquery.ScalarQueryParameter("radio_m", "FLOAT64", (radio_km + margen_km) * 1000),
+        ])
+        raw_df = client.query(_query_radio(table_path), job_config=job_config).to_dataframe()
+        completo = len(raw_df) < LIMITE_CONSULTA
+        # Limpieza de duplicados
+        raw_df = raw_df.drop_duplicates(subset=['id', 'nombre_original', 'titular', 'fecha_presentacion'])
+        guardado = (raw_df, completo)
+        _cache_consultas.guardar(clave, guardado)
+    return guardado
+
+
+def _distancias_exactas(raw_df, lat, lon, radio_km):
+    df = raw_df.copy()
+    df['distancia_km'] = haversine_km(lat, lon, df['latitud'], df['longitud'])
+    df = df[df['distancia_km'] <= radio_km]
+    return df.sort_values('distancia_km').reset_index(drop=True)
+
+
+def consultar_proyectos_bq(client, table_path, lat, lon, radio_km):
+    """Ejecuta la query geoespacial en BigQuery (parametrizada y con caché por celda geohash)."""
+    raw_df, _ = _consulta_celda(client, table_path, lat, lon, radio_km)
+    return _distancias_exactas(raw_df, lat, lon, radio_km)
+
+# ==========================================
+# RESULTADOS PAGINADOS (SIN TOPE DE FILAS)
+# ==========================================
+# La búsqueda pasa primero por la consulta cacheada por celda geohash: si el radio
+# tiene menos de LIMITE_CONSULTA proyectos (lo normal) ese resultado ya es el
+# completo y no se vuelve a facturar BigQuery. Solo si se llega al tope se corre
+# la query sin LIMIT y sus páginas se leen a pedido desde la tabla de resultados
+# del job (ruta + offset: nada vivo de BigQuery queda en st.session_state).
+
+TAMANO_PAGINA = int(os.getenv("BQ_TAMANO_PAGINA", "1000"))
+
+
+class ResultadoPaginado:
+    """
+    Total exacto + páginas (DataFrames) que se cargan a medida que la UI las pide.
+    Guarda solo datos planos: el DataFrame completo (resultado chico o local) o la ruta
+    de la tabla de resultados de BigQuery; `cargar_siguiente(client)` lee la página que sigue.
+    `identidad` (la consulta que lo produjo) junto con las filas cargadas identifica el DataFrame
+    en motor_filtros sin hashear su contenido en cada rerun.
+    """
+
+    def __init__(self, total, df_completo=None, destino=None, tamano_pagina=TAMANO_PAGINA, identidad=None):
+        self.total = total
+        self.identidad = identidad or uuid.uuid4().hex
+        self.tamano_pagina = tamano_pagina
+        self.destino = destino
+        self._df_completo = df_completo
+        self._cargadas = []
+        self._df = None
+        self.completo = total == 0
+
+    @classmethod
+    def desde_dataframe(cls, df, tamano_pagina=TAMANO_PAGINA, identidad=None):
+        return cls(len(df), df_completo=df.reset_index(drop=True), tamano_pagina=tamano_pagina, identidad=identidad)
+
+    @property
+    def n_cargadas(self):
+        return sum(len(p) for p in self._cargadas)
+
+    def _pagina(self, client, desde):
+        if self._df_completo is not None:
+            return self._df_completo.iloc[desde:desde + self.tamano_pagina]
+        filas = client.list_rows(self.destino, start_index=desde, max_results=self.tamano_pagina)
+        return filas.to_dataframe(create_bqstorage_client=False)
+
+    def cargar_siguiente(self, client=None):
+        """Trae la siguiente página y retorna todo lo cargado hasta ahora."""
+        if not self.completo:
+            pagina = self._pagina(client, self.n_cargadas)
+            if len(pagina):
+                self._cargadas.append(pagina)
+                self._df = None
+            if not len(pagina) or self.n_cargadas >= self.total:
+                self.completo = True
+        return self.dataframe()
+
+    def cargar_todo(self, client=None):
+        while not self.completo:
+            self.cargar_siguiente(client)
+        return self.dataframe()
+
+    def dataframe(self):
+        if self._df is None:
+            self._df = (pd.concat(self._cargadas, ignore_index=True) if self._cargadas
+                        else pd.DataFrame(columns=COLUMNAS_RESULTADO))
+            self._df.attrs["huella"] = (self.identidad, self.n_cargadas)
+        return self._df
+
+
+def consultar_proyectos_paginado(client, table_path, lat, lon, radio_km, tamano_pagina=TAMANO_PAGINA):
+    """Query geoespacial completa (sin tope), ordenada por distancia y leída por páginas."""
+    clave = ("paginado", table_path, BQ_GEO_TABLE_PATH, float(lat), float(lon), float(radio_km))
+    raw_df, completo = _consulta_celda(client, table_path, lat, lon, radio_km)
+    if completo:
+        # La celda trajo todo lo que hay en el radio ampliado: resultado completo y cacheado
+        return ResultadoPaginado.desde_dataframe(_distancias_exactas(raw_df, lat, lon, radio_km), tamano_pagina,
+                                                 identidad=clave[1:])
+
+    guardado = _cache_consultas.obtener(clave)
+    if guardado is None:
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("lat", "FLOAT64", lat),
+            bigquery.ScalarQueryParameter("lon", "FLOAT64", lon),
+            bigquery.ScalarQueryParameter("radio_m", "FLOAT64", radio_km * 1000),
+        ])
+        job = client.query(_query_radio(table_path, limite=None, deduplicar=True), job_config=job_config)
+        total = job.result().total_rows or 0
+        destino = job.destination
+        # Tabla anónima del job (vive ~24 h, más que el TTL de la caché)
+        guardado = (total, f"{destino.project}.{destino.dataset_id}.{destino.table_id}")
+        _cache_consultas.guardar(clave, guardado)
+    total, destino = guardado
+    return ResultadoPaginado(total, destino=destino, tamano_pagina=tamano_pagina, identidad=clave[1:])
+
+
+# ==========================================
+# MOTOR DE FILTROS (PANEL DE FILTROS)
+# ==========================================
+# Por cada set de resultados se precalculan códigos categóricos y arreglos NumPy
+# una sola vez; cada interacción arma una única máscara y la vista filtrada queda
+# memoizada por el estado de los filtros.
+
+COLUMNAS_CATEGORICAS = {'region': 'region', 'comuna': 'comuna', 'provincia': 'provincia',
+                        'tipo': 'tipo_proyecto', 'titular': 'titular', 'estado': 'estado_proyecto'}
+COLUMNAS_RANGO = {'inversion': 'inversion_mmu', 'distancia': 'distancia_km'}
+MAX_VISTAS_MEMO = 32
+
+
+class MotorFiltros:
+
+    def __init__(self, df):
+        self.df = df
+        self.codigos = {}
+        for clave, col in COLUMNAS_CATEGORICAS.items():
+            cat = pd.Categorical(df[col])
+            self.codigos[clave] = (cat.codes, cat.categories)
+        self.rangos = {clave: pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                       for clave, col in COLUMNAS_RANGO.items()}
+        self._memo = OrderedDict()
+
+    @staticmethod
+    def clave_filtros(filtros):
+        return tuple(
+            (k, tuple(sorted(map(str, filtros.get(k) or ())))) for k in COLUMNAS_CATEGORICAS
+        ) + tuple((k, tuple(float(v) for v in filtros[k])) for k in COLUMNAS_RANGO if filtros.get(k) is not None)
+
+    def mascara(self, filtros):
+        m = np.ones(len(self.df), dtype=bool)
+        for clave, (codigos, categorias) in self.codigos.items():
+            valores = filtros.get(clave)
+            if valores:
+                permitidos = categorias.get_indexer(list(valores))
+                m &= np.isin(codigos, permitidos[permitidos >= 0])
+        for clave, valores in self.rangos.items():
+            if filtros.get(clave) is not None:
+                lo, hi = filtros[clave]
+                # NaN queda fuera, igual que las comparaciones de pandas
+                m &= (valores >= lo) & (valores <= hi)
+        return m
+
+    def filtrar(self, filtros):
+        clave = self.clave_filtros(filtros)
+        vista = self._memo.get(clave)
+        if vista is None:
+            vista = self.df[self.mascara(filtros)]
+            self._memo[clave] = vista
+            while len(self._memo) > MAX_VISTAS_MEMO:
+                self._memo.popitem(last=False)
+        else:
+            self._memo.move_to_end(clave)
+        return vista
+
+
+# Pocos motores vivos a la vez (LRU), reconocidos por una huella del contenido: un
+# DataFrame que ya no está en ninguna sesión sale del LRU y se libera.
+MAX_MOTORES = int(os.getenv("FILTROS_MAX_MOTORES", "8"))
+_motores = OrderedDict()
+_motores_lock = threading.Lock()
+
+
+def huella_dataframe(df):
+    """Huella del contenido (índice + valores) para reconocer el mismo set de resultados entre reruns."""
+    valores = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return (len(df), tuple(df.columns), hashlib.blake2b(valores.tobytes(), digest_size=16).hexdigest())
+
+
+def motor_filtros(df):
+    # Los DataFrames de ResultadoPaginado traen su huella (consulta + filas cargadas); el resto se hashea
+    clave = df.attrs.get("huella") or huella_dataframe(df)
+    with _motores_lock:
+        motor = _motores.get(clave)
+        if motor is not None:
+            _motores.move_to_end(clave)
+            return motor
+    motor = MotorFiltros(df)
+    with _motores_lock:
+        _motores[clave] = motor
+        while len(_motores) > MAX_MOTORES:
+            _motores.popitem(last=False)
+    return motor
+
 
 def filtrar_dataframe(df, filtros):
-    """Aplica la lógica de filtrado de pandas de forma aislada."""
-    df_f = df.copy()
-    if filtros['region']: df_f = df_f[df_f['region'].isin(filtros['region'])]
-    if filtros['comuna']: df_f = df_f[df_f['comuna'].isin(filtros['comuna'])]
-    if filtros['provincia']: df_f = df_f[df_f['provincia'].isin(filtros['provincia'])]
-    if filtros['tipo']: df_f = df_f[df_f['tipo_proyecto'].isin(filtros['tipo'])]
-    if filtros['titular']: df_f = df_f[df_f['titular'].isin(filtros['titular'])]
-    if filtros['estado']: df_f = df_f[df_f['estado_proyecto'].isin(filtros['estado'])]
-    
-    df_f = df_f[(df_f['inversion_mmu'] >= filtros['inversion'][0]) & 
-                (df_f['inversion_mmu'] <= filtros['inversion'][1])]
-    df_f = df_f[(df_f['distancia_km'] >= filtros['distancia'][0]) & 
-                (df_f['distancia_km'] <= filtros['distancia'][1])]
-    return df_f
+    """Aplica los filtros del panel con una sola máscara (memoizada por estado de filtros)."""
+    return motor_filtros(df).filtrar(filtros)
 
-def actualizar_desde_excel(client, table_path, id_interno, excel_path):
-    # Mapeo de columnas (Excel -> BigQuery)
-    mapping = {
-        'Nombre del Proyecto': 'nombre_proyecto',
-        'Tipo de Presentación': 'tipo_presentacion',
-        'Región': 'region',
-        'Comuna': 'comuna',
-        'Provincia': 'provincia',
-        'Tipo de Proyecto': 'tipo_proyecto',
-        'Razón de Ingreso': 'razon_ingreso',
-        'Titular': 'titular',
-        'Inversión (MMU$)': 'inversion_mmu',
-        'Fecha Presentación': 'fecha_presentacion',
-        'Estado del Proyecto': 'estado_proyecto',
-        'Fecha Calificación': 'fecha_calificacion',
-        'Sector Productivo': 'sector_productivo',
-        'Latitud Punto Representativo': 'latitud',
-        'Longitud Punto Representativo': 'longitud'
-    }
+# ==========================================
+# ACTUALIZACIÓN DE seia_limpio DESDE LOS EXCEL DEL SCRAPER
+# ==========================================
+# Las filas de un lote se cargan a una tabla staging (load job Parquet, tipada con
+# el esquema de la tabla destino) y se aplican con un solo MERGE: un job DML por
+# lote en vez de un UPDATE armado a mano por proyecto.
+
+# Mapeo de columnas (Excel -> BigQuery)
+MAPEO_EXCEL_BQ = {
+    'Nombre del Proyecto': 'nombre_proyecto',
+    'Tipo de Presentación': 'tipo_presentacion',
+    'Región': 'region',
+    'Comuna': 'comuna',
+    'Provincia': 'provincia',
+    'Tipo de Proyecto': 'tipo_proyecto',
+    'Razón de Ingreso': 'razon_ingreso',
+    'Titular': 'titular',
+    'Inversión (MMU$)': 'inversion_mmu',
+    'Fecha Presentación': 'fecha_presentacion',
+    'Estado del Proyecto': 'estado_proyecto',
+    'Fecha Calificación': 'fecha_calificacion',
+    'Sector Productivo': 'sector_productivo',
+    'Latitud Punto Representativo': 'latitud',
+    'Longitud Punto Representativo': 'longitud'
+}
+COLUMNAS_NUMERICAS = ['inversion_mmu', 'latitud', 'longitud']
+STAGING_EXPIRA_MINUTOS = 60
+
+
+def leer_fila_excel(id_interno, excel_path):
+    """Primera fila del Excel de búsqueda como dict {columna_bq: valor}; None si viene vacío."""
+    df = pd.read_excel(excel_path)
+    if df.empty:
+        return None
+    row = df.iloc[0]
+    fila = {'id': str(id_interno)}
+    for excel_col, bq_col in MAPEO_EXCEL_BQ.items():
+        valor = row.get(excel_col)
+        if "Fecha" in excel_col:
+            fecha = None if pd.isna(valor) or str(valor).strip() == "" else pd.to_datetime(valor, errors='coerce')
+            fila[bq_col] = None if fecha is None or pd.isna(fecha) else fecha
+        elif bq_col in COLUMNAS_NUMERICAS:
+            fila[bq_col] = None if pd.isna(valor) else float(valor)
+        else:
+            fila[bq_col] = None if pd.isna(valor) else str(valor)
+    return fila
+
+
+def _ruta_staging(table_path):
+    proyecto, dataset, tabla = table_path.split(".")
+    return f"{proyecto}.{dataset}._staging_{tabla}_{uuid.uuid4().hex[:12]}"
 
+
+def actualizar_lote(client, table_path, filas):
+    """
+    Aplica un lote de filas (de leer_fila_excel) con un load job a staging + un MERGE.
+    Retorna (ok, mensaje).
+    """
+    if not filas:
+        return True, "Sin filas"
     try:
-        # 1. Leer Excel
-        df = pd.read_excel(excel_path)
-        if df.empty: return False, "Excel vacío"
-        
-        row = df.iloc[0]
-        set_clauses = []
-
-        for excel_col, bq_col in mapping.items():
-            valor = row.get(excel_col)
-            
-            # --- TRATAMIENTO ESPECIAL DE FECHAS ---
-            if "Fecha" in excel_col:
-                if pd.isna(valor) or str(valor).strip() == "":
-                    set_clauses.append(f"{bq_col} = NULL")
-                else:
-                    try:
-                        # Convertimos a datetime y luego a string formato ISO BQ
-                        dt_obj = pd.to_datetime(valor)
-                        fecha_iso = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-                        set_clauses.append(f"{bq_col} = '{fecha_iso}'")
-                    except:
-                        set_clauses.append(f"{bq_col} = NULL")
-                continue
-
-            # --- TRATAMIENTO DE NÚMEROS (Inversión, Lat, Lon) ---
-            if bq_col in ['inversion_mmu', 'latitud', 'longitud']:
-                if pd.isna(valor):
-                    set_clauses.append(f"{bq_col} = NULL")
-                else:
-                    set_clauses.append(f"{bq_col} = {valor}")
-                continue
-
-            # --- TRATAMIENTO DE STRINGS ---
-            if pd.isna(valor):
-                set_clauses.append(f"{bq_col} = NULL")
+        # Si un proyecto aparece dos veces en el lote manda la última versión
+        df = pd.DataFrame(filas).drop_duplicates(subset=['id'], keep='last')
+        columnas = list(MAPEO_EXCEL_BQ.values())
+
+        # Esquema staging = tipos reales de la tabla destino (id + columnas mapeadas)
+        tipos = {f.name: f.field_type for f in client.get_table(table_path).schema}
+        esquema = [bigquery.SchemaField(c, tipos.get(c, "STRING")) for c in ['id'] + columnas]
+        for campo in esquema:
+            if campo.field_type == "DATE":
+                df[campo.name] = pd.to_datetime(df[campo.name]).dt.date
+            elif campo.field_type in ("DATETIME", "TIMESTAMP"):
+                df[campo.name] = pd.to_datetime(df[campo.name])
+            elif campo.field_type in ("FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC"):
+                df[campo.name] = pd.to_numeric(df[campo.name], errors='coerce')
+            elif campo.field_type in ("INTEGER", "INT64"):
+                df[campo.name] = pd.to_numeric(df[campo.name], errors='coerce').astype("Int64")
             else:
-                val_str = str(valor).replace("'", "''") # Escapar comillas
-                set_clauses.append(f"{bq_col} = '{val_str}'")
+                df[campo.name] = df[campo.name].astype("string")
+
+        staging = _ruta_staging(table_path)
+        carga = client.load_table_from_dataframe(
+            df[['id'] + columnas], staging,
+            job_config=bigquery.LoadJobConfig(schema=esquema, source_format=bigquery.SourceFormat.PARQUET,
+                                              write_disposition="WRITE_TRUNCATE"))
+        carga.result()
+        try:
+            tabla_staging = client.get_table(staging)
+            tabla_staging.expires = datetime.now(timezone.utc) + timedelta(minutes=STAGING_EXPIRA_MINUTOS)
+            client.update_table(tabla_staging, ["expires"])
 
-        # Agregar timestamp de actualización
-        set_clauses.append("fecha_actualizacion = TIMESTAMP(CURRENT_DATETIME('America/Santiago'))")
+            sets = ", ".join(f"T.{c} = S.{c}" for c in columnas)
+            query = f"""
+                MERGE `{table_path}` T
+                USING `{staging}` S
+                ON T.id = S.id
+                WHEN MATCHED THEN UPDATE SET {sets},
+                    fecha_actualizacion = TIMESTAMP(CURRENT_DATETIME(@zona_horaria))
+            """
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter("zona_horaria", "STRING", "America/Santiago")
+            ])
+            job = client.query(query, job_config=job_config)
+            job.result()
+        finally:
+            client.delete_table(staging, not_found_ok=True)
 
-        # 2. Ejecutar Update
-        query = f"UPDATE `{table_path}` SET {', '.join(set_clauses)} WHERE id = '{id_interno}'"
-        client.query(query).result()
-        
-        return True, "Actualización exitosa"
+        _cache_consultas.limpiar()
+        return True, f"Actualización exitosa ({job.num_dml_affected_rows} filas)"
 
     except Exception as e:
-        return False, f"Error en procesamiento de datos: {str(e)}"
\ No newline at end of file
+        return False, f"Error en procesamiento de datos: {str(e)}"
+
+
+def actualizar_desde_excel(client, table_path, id_interno, excel_path):
+    """Atajo para un solo proyecto (mismo camino staging + MERGE)."""
+    try:
+        fila = leer_fila_excel(id_interno, excel_path)
+    except Exception as e:
+        return False, f"Error en procesamiento de datos: {str(e)}"
+    if fila is None:
+        return False, "Excel vacío"
+    return actualizar_lote(client, table_path, [fila])
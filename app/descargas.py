@@ -0,0 +1,183 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import control_tasa
+import cache_http
+from control_tasa import CircuitoAbierto
+from metricas import RegistroTiempos
+
+# ==========================================
+# DESCARGA CONCURRENTE DE DOCUMENTOS
+# ==========================================
+# Etapa de descarga en paralelo (hilos sobre requests) con:
+#   - límite global de concurrencia (hilos)
+#   - límite adaptativo de conexiones simultáneas por host y cortacircuitos
+#     (control_tasa.py, compartido por todo el proceso)
+#   - reintentos con backoff exponencial ante 5xx / 429 / timeouts
+
+# Tope de hilos; cuántos pegan a la vez a cada host lo decide control_tasa
+CONCURRENCIA_DEFECTO = int(os.getenv("DESCARGA_CONCURRENCIA", "12"))
+REINTENTOS_DEFECTO = int(os.getenv("DESCARGA_REINTENTOS", "3"))
+BACKOFF_BASE = float(os.getenv("DESCARGA_BACKOFF_BASE", "1.0"))
+
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+def crear_sesion(headers=None, cookies=None, pool_size=CONCURRENCIA_DEFECTO):
+    """
+    Sesión HTTP con un pool de conexiones del tamaño de la concurrencia (se comparte entre hilos).
+    Con CACHE_HTTP activa las respuestas pasan por la caché en disco (cache_http.py).
+    """
+    session = requests.Session()
+    clase = cache_http.AdaptadorCache if cache_http.ACTIVA else HTTPAdapter
+    adapter = clase(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    for c in cookies or []:
+        session.cookies.set(c['name'], c['value'])
+    return session
+
+
+def _retry_after(res):
+    valor = res.headers.get("Retry-After", "")
+    return float(valor) if valor.isdigit() else None
+
+
+def get_con_reintentos(session, url, reintentos=REINTENTOS_DEFECTO, backoff=BACKOFF_BASE, tiempos=None,
+                       control=None, retener=False, **kwargs):
+    """
+    GET con reintentos ante errores transitorios.
+    Retorna la respuesta (con stream=True si así se pidió); el llamador debe cerrarla.
+    Cada intento pasa por el control de tasa del host (`control`, por defecto control_tasa.CONTROL),
+    que puede lanzar CircuitoAbierto. Con `retener=True` el cupo sigue ocupado hasta que el
+    llamador invoque `res.liberar_cupo()` (ej: después de leer el cuerpo en streaming).
+    Con `tiempos` (metricas.RegistroTiempos) se cuentan los reintentos y los errores definitivos.
+    """
+    host = (control or control_tasa.CONTROL).host(url)
+    intento = 0
+    while True:
+        ticket = host.adquirir()
+        t0 = time.monotonic()
+        try:
+            res = session.get(url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            host.liberar(error_red=True, ticket=ticket)
+            if intento >= reintentos:
+                if tiempos:
+                    tiempos.contar("errores_red")
+                raise
+            motivo, pausa_servidor = type(e).__name__, None
+        except Exception:
+            host.liberar(ticket=ticket)
+            raise
+        else:
+            latencia = time.monotonic() - t0
+            pausa_servidor = _retry_after(res) if res.status_code == 429 else None
+            if res.status_code not in ESTADOS_REINTENTABLES or intento >= reintentos:
+                if tiempos and res.status_code >= 400:
+                    tiempos.contar("errores_http")
+                liberar = lambda: host.liberar(res.status_code, latencia, retry_after=pausa_servidor, ticket=ticket)
+                if retener:
+                    res.liberar_cupo = liberar
+                else:
+                    liberar()
+                return res
+            host.liberar(res.status_code, latencia, retry_after=pausa_servidor, ticket=ticket)
+            res.close()
+            motivo = f"HTTP {res.status_code}"
+
+        intento += 1
+        if tiempos:
+            tiempos.contar("reintentos_http")
+        espera = max(backoff * (2 ** (intento - 1)) + random.uniform(0, backoff), pausa_servidor or 0)
+        print(f"      🔁 Reintento {intento}/{reintentos} ({motivo}) en {espera:.1f}s: {url}", flush=True)
+        time.sleep(espera)
+
+
+def descargar_concurrente(tareas, procesar, session, max_concurrencia=CONCURRENCIA_DEFECTO,
+                          reintentos=REINTENTOS_DEFECTO, preparar=None, tiempos=None, nombre_span="descarga",
+                          control=None, **kwargs_get):
+    """
+    Descarga `tareas` (dicts con clave 'url') en paralelo.
+    Por cada respuesta se llama `procesar(tarea, respuesta)` dentro del hilo trabajador
+    (ahí se sube a GCS, etc.). La respuesta se cierra al volver de `procesar`.
+    `preparar(tarea)` (opcional, también en el hilo) retorna (omitir, headers_extra): con
+    omitir=True no se hace el GET y se llama `procesar(tarea, None)`; los headers extra
+    sirven para GET condicionales (If-None-Match / If-Modified-Since).
+    Retorna la lista de resultados de `procesar` en el MISMO orden de `tareas`
+    (None si la descarga falló).
+    Cada tarea queda como un span `nombre_span` en `tiempos`; las que terminan en None
+    suman a `fallas_<nombre_span>`. El límite y la tasa de cada host quedan como series en `tiempos`.
+    Si un host abre su circuito por más tiempo del tolerable, las tareas que faltan se
+    dan por fallidas sin pedirlas (quedan para el próximo intento).
+    """
+    control = control or control_tasa.CONTROL
+    tiempos = tiempos or RegistroTiempos()
+    circuito_abierto = threading.Event()
+
+    def _trabajo(tarea):
+        if circuito_abierto.is_set():
+            tiempos.contar(f"omitidas_circuito_{nombre_span}")
+            return None
+        with tiempos.span(nombre_span, url=tarea['url']) as span:
+            resultado = _descargar(tarea, span)
+        if resultado is None:
+            tiempos.contar(f"fallas_{nombre_span}")
+        host = urlparse(tarea['url']).netloc
+        estado = control.host(tarea['url']).estado()
+        tiempos.valor(f"limite_conexiones:{host}", estado["limite"])
+        tiempos.valor(f"tasa_rps:{host}", estado["tasa_rps"])
+        return resultado
+
+    def _descargar(tarea, span):
+        kwargs = kwargs_get
+        try:
+            omitir, headers_extra = preparar(tarea) if preparar else (False, None)
+        except Exception as e:
+            print(f"      ⚠️ Error preparando {tarea['url']}: {e}", flush=True)
+            omitir, headers_extra = False, None
+        if omitir:
+            span["omitido"] = True
+            try:
+                return procesar(tarea, None)
+            except Exception as e:
+                print(f"      ⚠️ Error procesando {tarea['url']}: {e}", flush=True)
+                return None
+        if headers_extra:
+            kwargs = dict(kwargs_get, headers={**(kwargs_get.get('headers') or {}), **headers_extra})
+        try:
+            res = get_con_reintentos(session, tarea['url'], reintentos=reintentos, tiempos=tiempos,
+                                     control=control, retener=True, **kwargs)
+        except CircuitoAbierto as e:
+            if not circuito_abierto.is_set():
+                print(f"      🔌 Se detiene la descarga: {e}. Lo pendiente queda para el próximo intento.", flush=True)
+            circuito_abierto.set()
+            span["circuito_abierto"] = True
+            return None
+        except Exception as e:
+            print(f"      ⚠️ Error descargando {tarea['url']}: {e}", flush=True)
+            return None
+        span["status"] = res.status_code
+        try:
+            return procesar(tarea, res)
+        except Exception as e:
+            print(f"      ⚠️ Error procesando {tarea['url']}: {e}", flush=True)
+            return None
+        finally:
+            # El cupo del host se libera recién con el cuerpo ya leído (y subido)
+            res.close()
+            res.liberar_cupo()
+
+    if not tareas:
+        return []
+    with ThreadPoolExecutor(max_workers=max_concurrencia) as ex:
+        return list(ex.map(_trabajo, tareas))
@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bs4 import BeautifulSoup
+
+import almacenamiento
+from almacenamiento import EscrituraPorLotes
+from metricas import RegistroTiempos
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Opcional: sin pypdf los PDFs conservan su registro original
+    PdfReader = None
+
+# ==========================================
+# EXTRACCIÓN DE TEXTO PARA VERTEX (OPCIONAL)
+# ==========================================
+# Después de la descarga, el texto de cada PDF/HTML guardado se extrae en un pool
+# de procesos, se parte en chunks y se sube como .txt. En metadata_import.jsonl el
+# registro del documento original se reemplaza por un registro por chunk, así
+# Vertex indexa texto ya limpio en vez de volver a parsear anexos enormes.
+#
+# Caché por contenido: texto/{version}/{aa}/{sha256}/chunks.jsonl (+ NNNN.txt).
+# Un documento cuyo sha256 ya tiene chunks.jsonl no se vuelve a extraer, venga del
+# proyecto que venga. Un chunks.jsonl vacío recuerda que no había texto (ej: PDF
+# escaneado): se mantiene el registro original y tampoco se reintenta.
+
+EXTRAER_TEXTO = os.getenv("SCRAPER_EXTRAER_TEXTO", "0") == "1"
+PROCESOS_EXTRACCION = int(os.getenv("EXTRACCION_PROCESOS", str(os.cpu_count() or 2)))
+CHUNK_CARACTERES = int(os.getenv("EXTRACCION_CHUNK_CARACTERES", "4000"))
+SOLAPE_CARACTERES = int(os.getenv("EXTRACCION_SOLAPE_CARACTERES", "300"))
+PREFIJO_TEXTO = "texto/"
+# Cambia si cambian la limpieza o el chunking: la caché anterior queda sin uso
+VERSION_EXTRACCION = f"v1-c{CHUNK_CARACTERES}-s{SOLAPE_CARACTERES}"
+
+# Partes del layout del SEIA (y de firma.sea.gob.cl) que no son contenido
+_TAGS_RUIDO = ["script", "style", "noscript", "nav", "header", "footer", "form", "iframe", "button", "select", "svg"]
+_RE_ID_RUIDO = re.compile(r"menu|navbar|nav-|breadcrumb|migas|header|cabecera|footer|pie-?pagina|sidebar|barra|redes|banner|cookie",
+                          re.IGNORECASE)
+_SELECTORES_CONTENIDO = ["main", "[role=main]", "#contenido", "#content", "#principal", ".contenido"]
+_RE_URI_CAS = re.compile(r"/cas/sha256/[0-9a-f]{2}/([0-9a-f]{64})\.")
+
+
+# ==========================================
+# LIMPIEZA Y CHUNKING (corre en los procesos hijos)
+# ==========================================
+
+def limpiar_html(html):
+    """Texto visible del HTML sin el 'cromo' del sitio (menús, cabecera, pie, scripts)."""
+    soup = BeautifulSoup(html, "lxml")
+    for tag in soup(_TAGS_RUIDO):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed or tag.name in ("html", "body"):
+            continue
+        marca = " ".join([tag.get("id") or ""] + (tag.get("class") or []))
+        if marca.strip() and _RE_ID_RUIDO.search(marca):
+            tag.decompose()
+    raiz = next((n for n in (soup.select_one(s) for s in _SELECTORES_CONTENIDO) if n), None) or soup.body or soup
+    # Cada fila de tabla (las fichas SEIA son tablas campo/valor) queda en una sola línea
+    for fila in raiz.find_all("tr"):
+        if not fila.decomposed:
+            celdas = [c.get_text(" ", strip=True) for c in fila.find_all(["td", "th"], recursive=False)]
+            fila.replace_with(soup.new_string(" | ".join(c for c in celdas if c) + "\n\n"))
+    return raiz.get_text("\n")
+
+
+def _texto_pdf(ruta):
+    if PdfReader is None:
+        return None
+    lector = PdfReader(ruta)
+    return "\n\n".join((pagina.extract_text() or "") for pagina in lector.pages)
+
+
+def normalizar(texto):
+    """Espacios colapsados; los párrafos quedan separados por una línea en blanco."""
+    lineas = [re.sub(r"\s+", " ", linea).strip() for linea in texto.splitlines()]
+    parrafos, actual = [], []
+    for linea in lineas:
+        if linea:
+            actual.append(linea)
+        elif actual:
+            parrafos.append(" ".join(actual))
+            actual = []
+    if actual:
+        parrafos.append(" ".join(actual))
+    return "\n\n".join(parrafos)
+
+
+def partir_en_chunks(texto, tamano=CHUNK_CARACTERES, solape=SOLAPE_CARACTERES):
+    """Chunks de hasta `tamano` caracteres cortando en párrafos (o en frases/espacios si no cabe)."""
+    # Cada pieza deja espacio para el solape, así ningún chunk supera `tamano`
+    limite = max(1, tamano - solape)
+    piezas = []
+    for parrafo in texto.split("\n\n"):
+        while len(parrafo) > limite:
+            corte = max(parrafo.rfind(". ", 0, limite), parrafo.rfind(" ", 0, limite))
+            corte = corte + 1 if corte > limite // 2 else limite
+            piezas.append(parrafo[:corte].strip())
+            parrafo = parrafo[corte:].strip()
+        if parrafo:
+            piezas.append(parrafo)
+
+    chunks, actual = [], ""
+    for pieza in piezas:
+        if actual and len(actual) + 2 + len(pieza) > tamano:
+            chunks.append(actual)
+            # El inicio del siguiente repite la cola del anterior (desde un límite de palabra)
+            cola = actual[-solape:] if solape else ""
+            actual = cola[cola.find(" ") + 1:] if " " in cola else cola
+        actual = f"{actual}\n\n{pieza}" if actual else pieza
+    if actual:
+        chunks.append(actual)
+    return chunks
+
+
+def extraer_chunks(ruta, tipo):
+    """Archivo local de un documento ('pdf' | 'html') -> lista de chunks (vacía si no hay texto, None si no se pudo)."""
+    try:
+        if tipo == "pdf":
+            texto = _texto_pdf(ruta)
+            if texto is None:
+                return None
+        else:
+            with open(ruta, "rb") as f:
+                texto = limpiar_html(f.read().decode("utf-8", errors="replace"))
+    except Exception as e:
+        print(f"      ⚠️ Extracción fallida ({tipo}): {e}", flush=True)
+        return None
+    return partir_en_chunks(normalizar(texto))
+
+
+# ==========================================
+# ORQUESTACIÓN (proceso principal)
+# ==========================================
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def _pool_procesos():
+    # Un solo pool por proceso (lo comparten los proyectos que corren en paralelo).
+    # "spawn": el proceso padre tiene hilos vivos y fork con hilos no es seguro.
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PROCESOS_EXTRACCION, mp_context=mp.get_context("spawn"))
+        return _pool
+
+
+def _reiniciar_pool():
+    global _pool
+    with _lock_pool:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _tipo_documento(registro):
+    # Por extensión: crear_registro_metadata marca como text/html todo lo que no es PDF (incluido el Excel)
+    uri = registro["content"]["uri"].lower()
+    if uri.endswith(".pdf"):
+        return "pdf"
+    if uri.endswith((".html", ".htm")):
+        return "html"
+    return None
+
+
+def _ruta_en_bucket(uri):
+    return uri.split("/", 3)[3]
+
+
+def _sha256_archivo(ruta, bloque=1024 * 1024):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+class ExtractorTexto:
+
+    def __init__(self, bucket, tiempos=None, hilos=almacenamiento.HILOS_ALMACENAMIENTO):
+        self.bucket = bucket
+        self.tiempos = tiempos or RegistroTiempos()
+        self.hilos = hilos
+
+    def _prefijo(self, sha256_hex):
+        return f"{PREFIJO_TEXTO}{VERSION_EXTRACCION}/{sha256_hex[:2]}/{sha256_hex}/"
+
+    def _leer_cache(self, sha256_hex):
+        blob = self.bucket.blob(self._prefijo(sha256_hex) + "chunks.jsonl")
+        if not blob.exists():
+            return None
+        lineas = blob.download_as_text().splitlines()
+        return [json.loads(linea)["texto"] for linea in lineas if linea.strip()]
+
+    def _guardar_cache(self, sha256_hex, chunks):
+        prefijo = self._prefijo(sha256_hex)
+        with EscrituraPorLotes(self.bucket, hilos=4) as lote:
+            for n, chunk in enumerate(chunks):
+                lote.subir(f"{prefijo}{n:04d}.txt", chunk, content_type="text/plain; charset=utf-8")
+        # chunks.jsonl va al final: su existencia marca la extracción como completa
+        contenido = "".join(json.dumps({"n": n, "texto": c}, ensure_ascii=False) + "\n" for n, c in enumerate(chunks))
+        self.bucket.blob(prefijo + "chunks.jsonl").upload_from_string(contenido, content_type="application/jsonl")
+
+    def chunks_de(self, uri, tipo, sha256_hex=None):
+        """(sha256, chunks) de un documento guardado; chunks None si no se pudo extraer."""
+        if sha256_hex:
+            cache = self._leer_cache(sha256_hex)
+            if cache is not None:
+                self.tiempos.contar("texto_desde_cache")
+                return sha256_hex, cache
+        # El documento va a un temporal y el hijo lo lee de ahí: los anexos de cientos de MB
+        # no quedan en memoria del proceso principal ni se copian al pool
+        fd, ruta_tmp = tempfile.mkstemp(prefix="extraccion_", suffix=f".{tipo}")
+        os.close(fd)
+        try:
+            self.bucket.blob(_ruta_en_bucket(uri)).download_to_filename(ruta_tmp)
+            calculado = _sha256_archivo(ruta_tmp)
+            if calculado != sha256_hex:
+                cache = self._leer_cache(calculado)
+                if cache is not None:
+                    self.tiempos.contar("texto_desde_cache")
+                    return calculado, cache
+
+            with self.tiempos.span("extraccion_documento", tipo=tipo, bytes=os.path.getsize(ruta_tmp)):
+                chunks = _pool_procesos().submit(extraer_chunks, ruta_tmp, tipo).result()
+        finally:
+            os.remove(ruta_tmp)
+        if chunks is None:
+            self.tiempos.contar("texto_no_extraible")
+            return calculado, None
+        self._guardar_cache(calculado, chunks)
+        self.tiempos.contar("texto_extraido")
+        return calculado, chunks
+
+    def _registros_chunks(self, registro, sha256_hex, chunks):
+        meta = json.loads(registro["jsonData"])
+        meta["documento_origen"] = registro["content"]["uri"]
+        prefijo = self._prefijo(sha256_hex)
+        # El id de los chunks lleva el proyecto (registros de antes del prefijo, ej: en un backfill)
+        base = registro["id"]
+        proyecto = re.sub(r"[^a-zA-Z0-9]", "_", str(meta.get("proyecto_id") or ""))
+        if proyecto and not base.startswith(f"{proyecto}_"):
+            base = f"{proyecto}_{base}"
+        salida = []
+        for n in range(len(chunks)):
+            meta_chunk = dict(meta, chunk=n + 1, total_chunks=len(chunks))
+            salida.append({
+                "id": f"{base}_c{n:04d}",
+                "jsonData": json.dumps(meta_chunk, ensure_ascii=False),
+                "content": {"mimeType": "text/plain", "uri": f"gs://{self.bucket.name}/{prefijo}{n:04d}.txt"},
+            })
+        return salida
+
+    def procesar_registros(self, registros, manifiesto=None):
+        """
+        Reemplaza cada registro de PDF/HTML por sus registros de chunks. Los demás registros,
+        y los documentos sin texto extraíble, quedan como estaban. Mantiene el orden.
+        """
+        sha_por_uri = {}
+        if manifiesto:
+            sha_por_uri = {e["ruta_gcs"]: e["sha256"] for e in manifiesto.entradas.values() if e.get("sha256")}
+
+        def _uno(registro):
+            tipo = _tipo_documento(registro)
+            if tipo is None:
+                return [registro]
+            uri = registro["content"]["uri"]
+            m = _RE_URI_CAS.search(uri)
+            try:
+                sha, chunks = self.chunks_de(uri, tipo, sha_por_uri.get(uri) or (m.group(1) if m else None))
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _reiniciar_pool()  # un hijo murió (ej: sin memoria con un PDF enorme): el próximo documento parte con un pool nuevo
+                print(f"      ⚠️ Sin texto para {uri}: {e}", flush=True)
+                self.tiempos.contar("fallas_extraccion")
+                return [registro]
+            if not chunks:
+                return [registro]
+            self.tiempos.contar("chunks_generados", len(chunks))
+            return self._registros_chunks(registro, sha, chunks)
+
+        with ThreadPoolExecutor(max_workers=self.hilos) as ex:
+            return [r for grupo in ex.map(_uno, registros) for r in grupo]
+
+
+def main():
+    """Backfill: agrega el texto a proyectos ya scrapeados (reescribe su metadata_import.jsonl)."""
+    from manifiesto import ManifiestoProyecto
+
+    parser = argparse.ArgumentParser(description="Extrae texto de los documentos ya guardados de uno o más proyectos.")
+    parser.add_argument("--bucket", default="almacen_antecedentes")
+    parser.add_argument("proyectos", nargs="+")
+    args = parser.parse_args()
+
+    bucket = almacenamiento.obtener_bucket(args.bucket)
+    for id_proyecto in args.proyectos:
+        blob = bucket.blob(f"{id_proyecto}/metadata_import.jsonl")
+        if not blob.exists():
+            print(f"⚠️ {id_proyecto}: sin metadata_import.jsonl")
+            continue
+        registros = [json.loads(l) for l in blob.download_as_text().splitlines() if l.strip()]
+        tiempos = RegistroTiempos()
+        nuevos = ExtractorTexto(bucket, tiempos).procesar_registros(registros, ManifiestoProyecto(bucket, id_proyecto))
+        blob.upload_from_string("\n".join(json.dumps(r, ensure_ascii=False) for r in nuevos), content_type="application/jsonl")
+        print(f"✅ {id_proyecto}: {len(registros)} registros -> {len(nuevos)}")
+        print(tiempos.resumen())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import json
+import threading
+from datetime import datetime
+
+# ==========================================
+# MANIFIESTO POR PROYECTO (RE-SCRAPE INCREMENTAL)
+# ==========================================
+# Guarda en {id_proyecto}/manifest.json qué se subió desde cada URL de origen:
+# fecha de la fila del expediente, hash del contenido, ruta en GCS y la info
+# extra de su metadata. En modo incremental se omiten los documentos cuya
+# entrada sigue vigente, y la metadata se regenera desde el manifiesto.
+# Con el almacén CAS (almacen_cas.py) la entrada es solo una referencia al
+# contenido compartido, junto con la ruta lógica del documento en el proyecto.
+
+NOMBRE_MANIFIESTO = "manifest.json"
+
+
+class ManifiestoProyecto:
+
+    def __init__(self, bucket, id_proyecto):
+        self.bucket = bucket
+        self.id_proyecto = id_proyecto
+        self.ruta = f"{id_proyecto}/{NOMBRE_MANIFIESTO}"
+        self.entradas = {}
+        self._lock = threading.Lock()
+        self._cambios = False
+        self._cargar()
+
+    def _cargar(self):
+        blob = self.bucket.blob(self.ruta)
+        try:
+            if blob.exists():
+                self.entradas = json.loads(blob.download_as_text()).get("entradas", {})
+        except Exception as e:
+            # Un manifiesto corrupto equivale a no tener manifiesto: se re-descarga todo
+            print(f"   ⚠️ Manifiesto ilegible ({self.ruta}): {e}", flush=True)
+            self.entradas = {}
+
+    def vigente(self, url, fecha=None):
+        """Retorna la entrada si la URL ya se subió y (si aplica) su fecha no cambió; si no, None."""
+        entrada = self.entradas.get(url)
+        if not entrada:
+            return None
+        if fecha is not None and entrada.get("fecha") != fecha:
+            return None
+        return entrada
+
+    def registrar(self, url, ruta_gcs, md5=None, fecha=None, info=None, sha256=None, ruta_logica=None,
+                  tamano_bytes=None, content_type=None):
+        """
+        `ruta_gcs` es donde está el contenido (con el almacén CAS, cas/sha256/...);
+        `ruta_logica` es la ruta que tendría dentro del proyecto (y de la que sale el id de Vertex).
+        `tamano_bytes` y `content_type` alimentan el catálogo de documentos (catalogo.py).
+        """
+        with self._lock:
+            self.entradas[url] = {
+                "fecha": fecha,
+                "md5": md5,
+                "sha256": sha256,
+                "ruta_gcs": ruta_gcs,
+                "ruta_logica": ruta_logica,
+                "bytes": tamano_bytes,
+                "content_type": content_type,
+                "info": info or {},
+                "actualizado": datetime.now().isoformat(timespec="seconds")
+            }
+            self._cambios = True
+
+    def guardar(self):
+        if not self._cambios:
+            return
+        with self._lock:
+            contenido = json.dumps({"id_proyecto": str(self.id_proyecto), "entradas": self.entradas}, ensure_ascii=False, indent=1)
+            self._cambios = False
+        self.bucket.blob(self.ruta).upload_from_string(contenido, content_type="application/json")
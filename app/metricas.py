@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import marshal
+import pstats
+import cProfile
+import threading
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+
+# ==========================================
+# MEDICIÓN DE TIEMPOS POR ETAPA
+# ==========================================
+# RegistroTiempos junta, para una ejecución de ejecutar_scrapping:
+#   - etapas: duración acumulada por nombre (búsqueda, ficha, expediente...)
+#   - spans: cada operación individual (un documento, una subida) con su hilo,
+#     su inicio relativo y sus atributos, para ver la línea de tiempo
+#   - contadores: bytes, documentos, reintentos, fallas
+#   - valores: medidas que suben y bajan (límite y tasa por host), con su serie
+# reporte() lo deja todo en un dict listo para guardar como JSON.
+
+MAX_SPANS = int(os.getenv("METRICAS_MAX_SPANS", "20000"))
+
+
+class RegistroTiempos:
+    """Acumula duraciones por etapa (seguro entre hilos) para ver qué espera domina un proyecto."""
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.mediciones = []
+        self.spans = []
+        self.spans_descartados = 0
+        self.contadores = Counter()
+        self.valores = {}
+        self.max_spans = max_spans
+        self.inicio = datetime.now()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def etapa(self, nombre):
+        """Etapa del proyecto (búsqueda, ficha, expediente...): un span sin atributos."""
+        return self.span(nombre)
+
+    @contextmanager
+    def span(self, nombre, **atributos):
+        """
+        Mide una operación individual. Cuenta también como etapa (para totales()).
+        Si la operación lanza una excepción el span queda con error y se suma a `fallas_<nombre>`.
+        El dict que entrega el `with` admite atributos extra (ej: bytes) durante la operación.
+        """
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield atributos
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            duracion = time.perf_counter() - t0
+            with self._lock:
+                self.mediciones.append((nombre, duracion))
+                if error:
+                    self.contadores[f"fallas_{nombre}"] += 1
+                if len(self.spans) < self.max_spans:
+                    self.spans.append({
+                        "nombre": nombre,
+                        "inicio_s": round(t0 - self._t0, 4),
+                        "duracion_s": round(duracion, 4),
+                        "hilo": threading.current_thread().name,
+                        **({"error": error} if error else {}),
+                        **atributos,
+                    })
+                else:
+                    self.spans_descartados += 1
+
+    def contar(self, nombre, n=1):
+        with self._lock:
+            self.contadores[nombre] += n
+
+    def valor(self, nombre, v):
+        """Valor actual de una medida que sube y baja (ej: límite de conexiones de un host); se guarda su serie."""
+        with self._lock:
+            serie = self.valores.setdefault(nombre, [])
+            if len(serie) < self.max_spans:
+                serie.append((round(time.perf_counter() - self._t0, 3), v))
+            else:
+                serie[-1] = (round(time.perf_counter() - self._t0, 3), v)
+
+    def totales(self):
+        """Dict etapa -> {n, total_s, max_s}, ordenado de mayor a menor tiempo total."""
+        acumulado = {}
+        with self._lock:
+            for nombre, duracion in self.mediciones:
+                a = acumulado.setdefault(nombre, {"n": 0, "total_s": 0.0, "max_s": 0.0})
+                a["n"] += 1
+                a["total_s"] += duracion
+                a["max_s"] = max(a["max_s"], duracion)
+        return dict(sorted(acumulado.items(), key=lambda kv: kv[1]["total_s"], reverse=True))
+
+    def resumen(self):
+        lineas = ["⏱️ Tiempos por etapa:"]
+        for nombre, a in self.totales().items():
+            lineas.append(f"   - {nombre:<28} {a['total_s']:8.2f}s  (n={a['n']}, máx={a['max_s']:.2f}s)")
+        with self._lock:
+            contadores = dict(self.contadores)
+            ultimos = {k: serie[-1][1] for k, serie in self.valores.items() if serie}
+        if contadores:
+            lineas.append("🔢 Contadores: " + ", ".join(f"{k}={v}" for k, v in sorted(contadores.items())))
+        if ultimos:
+            lineas.append("📈 Últimos valores: " + ", ".join(f"{k}={v}" for k, v in sorted(ultimos.items())))
+        return "\n".join(lineas)
+
+    def reporte(self, **extra):
+        """Reporte de la ejecución (serializable a JSON). `extra` se agrega tal cual (proyecto, estado, ...)."""
+        totales = {k: {"n": v["n"], "total_s": round(v["total_s"], 4), "max_s": round(v["max_s"], 4)}
+                   for k, v in self.totales().items()}
+        with self._lock:
+            return {
+                **extra,
+                "inicio": self.inicio.isoformat(timespec="seconds"),
+                "duracion_s": round(time.perf_counter() - self._t0, 3),
+                "etapas": totales,
+                "contadores": dict(self.contadores),
+                "valores": {k: {"ultimo": serie[-1][1], "serie": list(serie)} for k, serie in self.valores.items() if serie},
+                "spans": list(self.spans),
+                "spans_descartados": self.spans_descartados,
+            }
+
+
+# ==========================================
+# PERFILADO OPCIONAL (SCRAPER_PERFIL)
+# ==========================================
+# "cprofile": cProfile del hilo que orquesta (las descargas corren en otros hilos,
+#             así que ahí se ve sobre todo el parseo y la espera de cada etapa).
+# "muestreo": muestreador de pilas de TODOS los hilos cada PERFIL_INTERVALO_MS;
+#             genera stacks colapsados (formato flamegraph.pl / speedscope). Con
+#             varios proyectos en paralelo en el mismo proceso se mezclan sus hilos.
+
+PERFIL = os.getenv("SCRAPER_PERFIL", "")
+INTERVALO_MUESTREO_S = float(os.getenv("PERFIL_INTERVALO_MS", "10")) / 1000
+
+
+class MuestreadorPilas:
+
+    def __init__(self, intervalo_s=INTERVALO_MUESTREO_S):
+        self.intervalo_s = intervalo_s
+        self.pilas = Counter()
+        self.muestras = 0
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="muestreador-pilas", daemon=True)
+
+    def _bucle(self):
+        propio = threading.get_ident()
+        while not self._detener.wait(self.intervalo_s):
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pila.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+                    frame = frame.f_back
+                self.pilas[";".join(reversed(pila))] += 1
+            self.muestras += 1
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo.join()
+
+    def colapsado(self):
+        return "\n".join(f"{pila} {n}" for pila, n in self.pilas.most_common())
+
+
+class Perfilador:
+    """
+    Uso:  with Perfilador(modo) as perfil: ...   (o iniciar() / detener())
+    luego perfil.salidas() -> {nombre_archivo: bytes} y perfil.resumen(n) -> lista de las
+    funciones más costosas (para el reporte JSON). Con modo vacío no hace nada.
+    """
+
+    def __init__(self, modo=PERFIL):
+        self.modo = (modo or "").lower()
+        self._perfil = None
+        self._muestreador = None
+
+    def iniciar(self):
+        if self.modo == "cprofile":
+            self._perfil = cProfile.Profile()
+            try:
+                self._perfil.enable()
+            except ValueError as e:
+                # Python >= 3.12: un solo cProfile activo por proceso (ej: otro proyecto en paralelo)
+                print(f"   ⚠️ cProfile no disponible ({e}); se ejecuta sin perfilar.", flush=True)
+                self._perfil = None
+        elif self.modo == "muestreo":
+            self._muestreador = MuestreadorPilas()
+            self._muestreador.iniciar()
+        elif self.modo:
+            print(f"   ⚠️ SCRAPER_PERFIL desconocido ({self.modo}); se ejecuta sin perfilar.", flush=True)
+        return self
+
+    def detener(self):
+        if self._perfil:
+            self._perfil.disable()
+        if self._muestreador and self._muestreador._hilo.is_alive():
+            self._muestreador.detener()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+        return False
+
+    def salidas(self):
+        if self._perfil:
+            # Mismo formato que pstats.dump_stats (se abre con pstats, snakeviz, etc.)
+            return {"perfil_ejecucion.prof": marshal.dumps(pstats.Stats(self._perfil).stats)}
+        if self._muestreador:
+            return {"perfil_ejecucion.folded": self._muestreador.colapsado().encode("utf-8")}
+        return {}
+
+    def resumen(self, n=25):
+        if self._perfil:
+            stats = pstats.Stats(self._perfil)
+            filas = []
+            for (archivo, linea, funcion), (_, llamadas, propio, acumulado, _) in stats.stats.items():
+                filas.append({"funcion": f"{os.path.basename(archivo)}:{linea}:{funcion}", "llamadas": llamadas,
+                              "propio_s": round(propio, 4), "acumulado_s": round(acumulado, 4)})
+            return sorted(filas, key=lambda f: f["acumulado_s"], reverse=True)[:n]
+        if self._muestreador:
+            # Funciones en la cima de la pila: dónde estaban los hilos al tomar la muestra
+            cimas = Counter()
+            for pila, veces in self._muestreador.pilas.items():
+                cimas[pila.rsplit(";", 1)[-1]] += veces
+            total = sum(cimas.values()) or 1
+            return [{"funcion": f, "muestras": v, "fraccion": round(v / total, 4)} for f, v in cimas.most_common(n)]
+        return []
@@ -0,0 +1,154 @@
+import os
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_manager import COLUMNAS_PROYECTO, TAMANO_PAGINA, ResultadoPaginado, haversine_km
+
+# ==========================================
+# MOTOR LOCAL DE CONSULTAS POR RADIO
+# ==========================================
+# seia_limpio solo cambia cuando un scrape actualiza filas: se puede trabajar con
+# un snapshot columnar (Parquet, o CSV como fixture) y un índice de cubetas por
+# cuadrícula lat/lon. Cada búsqueda revisa solo las cubetas que tocan el círculo
+# y calcula haversine vectorizado en NumPy (mismo resultado que ST_DWITHIN + ORDER BY).
+#
+# Uso:   MOTOR_CONSULTA=local SNAPSHOT_LOCAL_PATH=... streamlit run app.py
+# Snapshot:  python motor_local.py --tabla proyecto.dataset.seia_limpio [--region "Región de Valparaíso"]
+
+MOTOR_CONSULTA = os.getenv("MOTOR_CONSULTA", "bigquery")   # "bigquery" | "local"
+SNAPSHOT_LOCAL_PATH = os.getenv("SNAPSHOT_LOCAL_PATH", os.path.join(os.getcwd(), "datos", "seia_snapshot.parquet"))
+TAMANO_CELDA_GRADOS = float(os.getenv("SNAPSHOT_CELDA_GRADOS", "0.25"))   # ~28 km de latitud
+KM_POR_GRADO_LAT = 111.32
+LIMITE_RESULTADOS = 1000
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def crear_snapshot(client, table_path, ruta=None, region=None):
+    """Descarga seia_limpio (o una región) a Parquet. Retorna (ruta, filas)."""
+    from google.cloud import bigquery
+
+    ruta = ruta or SNAPSHOT_LOCAL_PATH
+    query = f"SELECT {COLUMNAS_PROYECTO} FROM `{table_path}`"
+    params = []
+    if region:
+        query += " WHERE region = @region"
+        params.append(bigquery.ScalarQueryParameter("region", "STRING", region))
+    df = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).to_dataframe()
+
+    # db-dtypes (dbdate) -> objetos date, igual que los lee read_parquet
+    for col in df.columns:
+        if str(df[col].dtype) == "dbdate":
+            df[col] = df[col].astype(object)
+
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    tmp = f"{ruta}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, ruta)
+    return ruta, len(df)
+
+
+class IndiceEspacial:
+    """Snapshot en memoria ordenado por celda de cuadrícula, con slices por celda."""
+
+    def __init__(self, df, tamano_celda=TAMANO_CELDA_GRADOS):
+        self.tamano_celda = tamano_celda
+        df = df.copy()
+        df['latitud'] = pd.to_numeric(df['latitud'], errors='coerce')
+        df['longitud'] = pd.to_numeric(df['longitud'], errors='coerce')
+        df = df[df['latitud'].between(-90, 90) & df['longitud'].between(-180, 180)]
+
+        fil = np.floor(df['latitud'].to_numpy() / tamano_celda).astype(np.int64)
+        col = np.floor(df['longitud'].to_numpy() / tamano_celda).astype(np.int64)
+        orden = np.lexsort((col, fil))
+        self.df = df.iloc[orden].reset_index(drop=True)
+        self.lats = self.df['latitud'].to_numpy()
+        self.lons = self.df['longitud'].to_numpy()
+
+        fil, col = fil[orden], col[orden]
+        self.celdas = {}
+        if len(fil):
+            cortes = np.flatnonzero((np.diff(fil) != 0) | (np.diff(col) != 0)) + 1
+            inicios = np.concatenate(([0], cortes))
+            finales = np.concatenate((cortes, [len(fil)]))
+            for ini, fin in zip(inicios, finales):
+                self.celdas[(int(fil[ini]), int(col[ini]))] = (int(ini), int(fin))
+
+    def _candidatos(self, lat, lon, radio_km):
+        d_lat = radio_km / KM_POR_GRADO_LAT
+        # Cerca de los polos el círculo cubre todas las longitudes
+        cos_lat = np.cos(np.radians(min(abs(lat) + d_lat, 89.9)))
+        d_lon = min(radio_km / (KM_POR_GRADO_LAT * cos_lat), 180.0)
+        t = self.tamano_celda
+        filas = range(int(np.floor((lat - d_lat) / t)), int(np.floor((lat + d_lat) / t)) + 1)
+        cols = range(int(np.floor((lon - d_lon) / t)), int(np.floor((lon + d_lon) / t)) + 1)
+        if len(filas) * len(cols) > len(self.celdas):
+            # Radio enorme: más barato recorrer las celdas existentes
+            tramos = [r for (f, c), r in self.celdas.items() if f in filas and c in cols]
+        else:
+            tramos = [self.celdas[(f, c)] for f in filas for c in cols if (f, c) in self.celdas]
+        if not tramos:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(ini, fin) for ini, fin in tramos])
+
+    def consultar(self, lat, lon, radio_km, limite=LIMITE_RESULTADOS):
+        idx = self._candidatos(lat, lon, radio_km)
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        dentro = dist <= radio_km
+        idx, dist = idx[dentro], dist[dentro]
+        orden = np.argsort(dist, kind="stable")[:limite]
+        df = self.df.iloc[idx[orden]].copy()
+        df['distancia_km'] = dist[orden]
+        return df.reset_index(drop=True)
+
+
+def _leer_snapshot(ruta):
+    if ruta.lower().endswith(".csv"):
+        return pd.read_csv(ruta)
+    return pd.read_parquet(ruta)
+
+
+def cargar_indice(ruta=None):
+    """Índice del snapshot, en caché por proceso; se reconstruye si el archivo cambió."""
+    ruta = ruta or SNAPSHOT_LOCAL_PATH
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No existe el snapshot local {ruta} (generarlo con: python motor_local.py --tabla ...)")
+    mtime = os.path.getmtime(ruta)
+    with _lock:
+        cacheado = _indices.get(ruta)
+        if cacheado and cacheado[0] == mtime:
+            return cacheado[1]
+        indice = IndiceEspacial(_leer_snapshot(ruta))
+        _indices[ruta] = (mtime, indice)
+        return indice
+
+
+def consultar_proyectos_local(lat, lon, radio_km, ruta=None, limite=LIMITE_RESULTADOS):
+    """Equivalente local de data_manager.consultar_proyectos_bq (mismas columnas y orden)."""
+    df = cargar_indice(ruta).consultar(lat, lon, radio_km, limite=None)
+    df = df.drop_duplicates(subset=['id', 'nombre_original', 'titular', 'fecha_presentacion'])
+    return df.iloc[:limite].reset_index(drop=True)
+
+
+def consultar_proyectos_local_paginado(lat, lon, radio_km, ruta=None, tamano_pagina=TAMANO_PAGINA):
+    """Equivalente local de data_manager.consultar_proyectos_paginado (sin tope de filas)."""
+    df = consultar_proyectos_local(lat, lon, radio_km, ruta, limite=None)
+    return ResultadoPaginado.desde_dataframe(df, tamano_pagina, identidad=("local", ruta, float(lat), float(lon), float(radio_km)))
+
+
+if __name__ == "__main__":
+    from google.cloud import bigquery
+
+    parser = argparse.ArgumentParser(description="Genera el snapshot local de seia_limpio")
+    parser.add_argument("--tabla", default=os.getenv("BQ_TABLE_PATH", "geo-ambiental-482615.dataset_ambiental.seia_limpio"))
+    parser.add_argument("--salida", default=SNAPSHOT_LOCAL_PATH)
+    parser.add_argument("--region", default=None)
+    args = parser.parse_args()
+
+    cliente = bigquery.Client(project=os.getenv("PROJECT_ID", "geo-ambiental-482615"))
+    ruta, filas = crear_snapshot(cliente, args.tabla, args.salida, args.region)
+    print(f"✅ Snapshot guardado en {ruta} ({filas} proyectos)")
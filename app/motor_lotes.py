@@ -0,0 +1,168 @@
+import os
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import scraper
+
+# ==========================================
+# MOTOR DE SCRAPING POR LOTES
+# ==========================================
+# Mantiene un pool acotado de Chrome "calientes" (cada uno con su carpeta de
+# descargas) y procesa N proyectos en paralelo, entregando cada resultado
+# apenas termina su proyecto.
+
+MAX_WORKERS_DEFECTO = int(os.getenv("SCRAPER_WORKERS", "3"))
+MAX_USOS_DRIVER = int(os.getenv("SCRAPER_MAX_USOS_DRIVER", "15"))
+
+
+def directorio_base():
+    return "/tmp/lotes" if os.environ.get("K_SERVICE") else os.path.join(os.getcwd(), "downloads", "lotes")
+
+
+class _SlotDriver:
+    """Un puesto del pool: driver (creado en forma perezosa) + carpeta de descargas propia."""
+
+    def __init__(self, indice, download_dir):
+        self.indice = indice
+        self.download_dir = download_dir
+        self.driver = None
+        self.usos = 0
+
+
+class PoolDrivers:
+    """Pool acotado de WebDrivers reutilizables."""
+
+    def __init__(self, tamano, base_dir):
+        self.tamano = tamano
+        self.base_dir = base_dir
+        self._libres = queue.Queue()
+        self._slots = []
+        for i in range(tamano):
+            download_dir = os.path.join(base_dir, f"driver_{i}")
+            os.makedirs(download_dir, exist_ok=True)
+            slot = _SlotDriver(i, download_dir)
+            self._slots.append(slot)
+            self._libres.put(slot)
+
+    def precalentar(self):
+        """Lanza todos los Chrome del pool en paralelo (opcional, evita el arranque en frío del primer lote)."""
+        with ThreadPoolExecutor(max_workers=self.tamano) as ex:
+            list(ex.map(self.asegurar_driver, self._slots))
+
+    def asegurar_driver(self, slot):
+        if slot.driver is None:
+            slot.driver = scraper.configurar_driver(slot.download_dir)
+            slot.usos = 0
+        return slot
+
+    def obtener(self):
+        """
+        Bloquea hasta que haya un puesto libre y deja limpia su carpeta de descargas.
+        El Chrome del puesto se lanza recién cuando el scraper lo pide (asegurar_driver),
+        así los proyectos resueltos por HTTP no pagan el arranque del navegador.
+        """
+        slot = self._libres.get()
+        try:
+            scraper.limpiar_directorio_descargas(slot.download_dir)
+        except Exception:
+            self._libres.put(slot)
+            raise
+        return slot
+
+    def devolver(self, slot, sano=True):
+        """Devuelve el driver al pool. Si quedó en mal estado (o se usó demasiado) se recicla."""
+        if slot.driver is None:
+            self._libres.put(slot)
+            return
+
+        slot.usos += 1
+        if sano and slot.usos < MAX_USOS_DRIVER:
+            try:
+                self._resetear_ventanas(slot.driver)
+            except Exception:
+                sano = False
+
+        if not sano or slot.usos >= MAX_USOS_DRIVER:
+            self._cerrar_driver(slot)
+
+        self._libres.put(slot)
+
+    @staticmethod
+    def _resetear_ventanas(driver):
+        # Dejamos una sola ventana en blanco para el siguiente proyecto
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.get("about:blank")
+
+    @staticmethod
+    def _cerrar_driver(slot):
+        if slot.driver:
+            try: slot.driver.quit()
+            except Exception as e: print(f"   [POOL] Error cerrando driver {slot.indice}: {e}", flush=True)
+        slot.driver = None
+        slot.usos = 0
+
+    def cerrar(self):
+        for slot in self._slots:
+            self._cerrar_driver(slot)
+
+
+def procesar_proyecto(pool, proyecto, bucket_name, dir_resultados):
+    """Procesa un proyecto con un puesto del pool. Retorna (res, logs, excel_path)."""
+    slot = None
+    sano = True
+    try:
+        slot = pool.obtener()
+        res, logs, excel_path = scraper.ejecutar_scrapping(
+            proyecto['id'], proyecto['nombre'], proyecto['titular'],
+            proyecto['fecha_presentacion'], bucket_name,
+            region=proyecto.get('region'), comuna=proyecto.get('comuna'),
+            obtener_driver=lambda: pool.asegurar_driver(slot).driver, download_dir=slot.download_dir
+        )
+        sano = not res.startswith("❌")
+
+        # El Excel vive en la carpeta del driver, que se limpia al tomar el siguiente proyecto:
+        # lo movemos a una ruta propia del proyecto antes de liberar el slot.
+        if excel_path and os.path.exists(excel_path):
+            destino = os.path.join(dir_resultados, f"{proyecto['id']}.xlsx")
+            shutil.move(excel_path, destino)
+            excel_path = destino
+
+        return res, logs, excel_path
+    except Exception as e:
+        sano = False
+        return f"❌ ERROR: {str(e)}", "", None
+    finally:
+        if slot:
+            pool.devolver(slot, sano=sano)
+
+
+def ejecutar_lote(proyectos, bucket_name, max_workers=None, pool=None):
+    """
+    Procesa una lista de proyectos en paralelo.
+    Cada proyecto es un dict con: id, nombre, titular, fecha_presentacion, region, comuna.
+    Genera tuplas (proyecto, res, logs, excel_path) a medida que cada proyecto termina.
+    Si no se entrega `pool`, se crea uno para el lote y se cierra al final.
+    """
+    max_workers = max_workers or MAX_WORKERS_DEFECTO
+    base_dir = directorio_base()
+    dir_resultados = os.path.join(base_dir, "resultados")
+    os.makedirs(dir_resultados, exist_ok=True)
+
+    pool_propio = pool is None
+    if pool_propio:
+        pool = PoolDrivers(min(max_workers, len(proyectos)) or 1, base_dir)
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.tamano) as ex:
+            futuros = {ex.submit(procesar_proyecto, pool, p, bucket_name, dir_resultados): p for p in proyectos}
+            for futuro in as_completed(futuros):
+                res, logs, excel_path = futuro.result()
+                yield futuros[futuro], res, logs, excel_path
+    finally:
+        if pool_propio:
+            pool.cerrar()
@@ -1,29 +1,43 @@
 import os
-import time
 import logging
 import traceback
 import io
 import re
-import requests
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from google.cloud import storage
+from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
+from urllib.parse import urljoin
 import pandas as pd
 import sys
 import json  # NUEVO IMPORT
+import descargas
+import seia_http
+from seia_http import SEIA_BASE_URL
+import transferencia
+from manifiesto import ManifiestoProyecto
+import almacen_cas
+import almacenamiento
+import extraccion_texto
+import catalogo
+import control_tasa
+import cache_http
+import metricas
+from metricas import RegistroTiempos
+import checkpoints as cp
 
 
 # ==========================================
 # 1. UTILIDADES Y CONFIGURACIÓN
 # ==========================================
 
-def crear_registro_metadata(uri, params_base, info_extra=None):
+def crear_registro_metadata(uri, params_base, info_extra=None, id_documento=None):
     """
     Genera el objeto JSON necesario para Vertex AI Search.
+    `id_documento` (nombre o ruta lógica) fija el ID cuando la URI es del almacén CAS.
     """
     # 1. Copiamos la metadata base del proyecto
     meta = params_base.copy()
@@ -32,8 +46,11 @@ def crear_registro_metadata(uri, params_base, info_extra=None):
     if info_extra:
         meta.update(info_extra)
     
-    # 3. Generamos un ID seguro para Vertex (solo letras, números y guiones bajos)
-    id_valido = re.sub(r'[^a-zA-Z0-9]', '_', uri.split('/')[-1])
+    # 3. Generamos un ID seguro para Vertex (solo letras, números y guiones bajos).
+    #    Lleva el proyecto: los nombres de archivo (ficha_principal_html, DOC_1_...) se repiten entre proyectos
+    nombre = (id_documento or uri).split('/')[-1]
+    proyecto = params_base.get("proyecto_id")
+    id_valido = re.sub(r'[^a-zA-Z0-9]', '_', f"{proyecto}_{nombre}" if proyecto else nombre)
     
     # 4. Retornamos la estructura exacta que pide Google Cloud
     return {
@@ -45,9 +62,11 @@ def crear_registro_metadata(uri, params_base, info_extra=None):
         }
     }
 
-def obtener_logger():
+def obtener_logger(sufijo=None):
+    # Con proyectos en paralelo cada uno necesita su propio logger (si no, se pisan los handlers)
     log_stream = io.StringIO()
-    logger = logging.getLogger("scraper")
+    logger = logging.getLogger(f"scraper.{sufijo}" if sufijo else "scraper")
+    logger.propagate = False
     logger.setLevel(logging.INFO)
     
     if logger.handlers:
@@ -61,6 +80,8 @@ def obtener_logger():
 
     return logger, log_stream
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
 def limpiar_nombre_archivo(nombre):
     nombre = re.sub(r'[\\/*?:"<>|]', "", nombre)
     return nombre.replace(" ", "_").strip()
@@ -72,7 +93,7 @@ def configurar_driver(download_dir):
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--disable-gpu')
     options.add_argument('--window-size=1920,1080')
-    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+    options.add_argument(f'--user-agent={USER_AGENT}')
     
     prefs = {
         "download.default_directory": download_dir, 
@@ -91,35 +112,99 @@ def configurar_driver(download_dir):
 # 2. ACCIONES DE NAVEGACIÓN (SEIA)
 # ==========================================
 
+# Modo de captura de los documentos de la ficha: "http" (por defecto) o "navegador"
+MODO_DETALLE = os.getenv("SCRAPER_MODO_DETALLE", "http")
+# Modo de búsqueda/resolución del proyecto: "http" (Chrome solo como respaldo) o "navegador"
+MODO_BUSQUEDA = os.getenv("SCRAPER_MODO_BUSQUEDA", "http")
+
+# Selectores que indican que la tabla de resultados terminó de dibujarse
+SEL_SIN_RESULTADOS = "td.dt-empty"
+SEL_LINK_FICHA = "td.dt-head-center a.color-primary"
+
+# Antes del click: se guarda el contenido actual de la tabla y se escucha el próximo draw de
+# DataTables (redibuja filas dentro del mismo <tbody>, así que no sirve esperar que se vuelva "stale")
+_JS_MARCAR_BUSQUEDA = """
+window.__seiaBusquedaDibujada = false;
+var tb = document.querySelector('table tbody');
+window.__seiaTablaPrevia = tb ? tb.innerHTML : null;
+if (window.jQuery) { window.jQuery('table').one('draw.dt', function () { window.__seiaBusquedaDibujada = true; }); }
+"""
+# Listo cuando DataTables dibujó tras el click (o, sin jQuery, cuando cambió el contenido) y no está procesando
+_JS_BUSQUEDA_DIBUJADA = """
+var proc = document.querySelector('.dt-processing, .dataTables_processing');
+if (proc && proc.offsetParent !== null && getComputedStyle(proc).display !== 'none') return false;
+if (window.__seiaBusquedaDibujada) return true;
+var tb = document.querySelector('table tbody');
+return !!tb && tb.innerHTML !== window.__seiaTablaPrevia;
+"""
+
+def esperar_documento_listo(driver, timeout=20):
+    """Espera a que la ventana actual termine de cargar (document.readyState == 'complete')."""
+    WebDriverWait(driver, timeout).until(lambda d: d.execute_script("return document.readyState") == "complete")
+
 def realizar_busqueda(driver, wait, nombre, titular, f_pres):
-    driver.get("https://seia.sea.gob.cl/busqueda/buscarProyecto.php")
+    driver.get(seia_http.URL_BUSQUEDA)
     
     wait.until(EC.presence_of_element_located((By.ID, "projectName"))).send_keys(nombre)
     driver.find_element(By.ID, "nombreTitular").send_keys(titular)
     driver.find_element(By.ID, "startDateFechaP").send_keys(f_pres)
     driver.find_element(By.ID, "endDateFechaP").send_keys(f_pres)
 
-    
-    time.sleep(2)
-    boton = driver.find_element(By.CSS_SELECTOR, "button.sg-btnForm")
+    # La fila "sin datos" de la tabla inicial no es una respuesta: se espera el dibujo de ESTA búsqueda
+    boton = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button.sg-btnForm")))
+    driver.execute_script(_JS_MARCAR_BUSQUEDA)
     driver.execute_script("arguments[0].click();", boton)
-    time.sleep(5)
+    try: wait.until(lambda d: d.execute_script(_JS_BUSQUEDA_DIBUJADA))
+    except TimeoutException: pass  # Sin jQuery y con el mismo "sin datos" de antes: el contenido no cambia
+
+    # Listo cuando aparece la fila "sin resultados" o el link a la ficha
+    wait.until(EC.any_of(
+        EC.presence_of_element_located((By.CSS_SELECTOR, SEL_SIN_RESULTADOS)),
+        EC.presence_of_element_located((By.CSS_SELECTOR, SEL_LINK_FICHA))
+    ))
 
 
+def excel_descargado(download_dir):
+    """Retorna la ruta del .xlsx si la descarga terminó (sin .crdownload pendientes), si no None."""
+    archivos = os.listdir(download_dir)
+    if any(f.endswith(".crdownload") for f in archivos):
+        return None
+    for f in archivos:
+        if f.endswith(".xlsx"):
+            return os.path.join(download_dir, f)
+    return None
 
 
-def descargar_excel(driver, wait):
+def descargar_excel(driver, wait, download_dir=None, timeout=30):
     try:
         link_excel = wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Descargar en formato Excel")))
         driver.execute_script("arguments[0].click();", link_excel)
-        time.sleep(2)
+        if download_dir:
+            WebDriverWait(driver, timeout, poll_frequency=0.2).until(lambda d: excel_descargado(download_dir))
     except: pass
 
 # ==========================================
 # 3. EXTRACCIÓN Y CARGA (GCS)
 # ==========================================
 
-def procesar_documentos_detalle(driver, wait, bucket, id_proyecto, v_busqueda, v_ficha, params_base):
+def _capturar_detalle_en_navegador(driver, wait, link_elem, v_ficha, tiempos):
+    """Abre el link en una ventana nueva, retorna su HTML renderizado y vuelve a la ficha."""
+    with tiempos.etapa("espera_ventana_detalle"):
+        previas = set(driver.window_handles)
+        driver.execute_script("arguments[0].click();", link_elem)
+        wait.until(lambda d: len(d.window_handles) > len(previas))
+        for handle in driver.window_handles:
+            if handle not in previas:
+                driver.switch_to.window(handle); break
+        esperar_documento_listo(driver)
+    html_doc = driver.page_source
+    driver.close()
+    driver.switch_to.window(v_ficha)
+    return html_doc
+
+
+def procesar_documentos_detalle(driver, wait, bucket, id_proyecto, v_busqueda, v_ficha, params_base, manifiesto=None, incremental=False, tiempos=None):
+    tiempos = tiempos or RegistroTiempos()
     enlaces = driver.find_elements(By.CSS_SELECTOR, "td.td-primary a")
     num_docs = len(enlaces)
     metadata_lista = []
@@ -130,70 +215,300 @@ def procesar_documentos_detalle(driver, wait, bucket, id_proyecto, v_busqueda, v
             url_doc = link_elem.get_attribute("href")
             nombre_original = link_elem.text.strip()
             nombre_limpio = limpiar_nombre_archivo(nombre_original)
-            
+            info_extra = {"nombre_documento": nombre_original, "tipo_fuente": "Documento Ficha"}
+
+            # Modo incremental: si la URL ya está en el manifiesto no se vuelve a descargar
+            entrada = manifiesto.vigente(url_doc) if (manifiesto and incremental) else None
+            if entrada:
+                metadata_lista.append(crear_registro_metadata(entrada['ruta_gcs'], params_base, entrada['info']))
+                continue
+            md5_doc, bytes_doc, mime_doc = None, None, None
+
             es_pdf = "firma.sea.gob.cl" in url_doc or url_doc.lower().endswith(".pdf")
             uri_gcs = ""
 
             if es_pdf:
-                nombre_f = f"DOC_{index+1}_{nombre_limpio}.pdf"
-                session = requests.Session()
-                session.headers.update({"User-Agent": driver.execute_script("return navigator.userAgent;"), "Referer": driver.current_url})
-                for c in driver.get_cookies(): session.cookies.set(c['name'], c['value'])
-                
-                res = session.get(url_doc, timeout=30)
-                if res.status_code == 200:
-                    blob = bucket.blob(f"{id_proyecto}/documentos_detalle/{nombre_f}")
-                    blob.content_disposition = f'attachment; filename="{nombre_f}"'
-                    blob.upload_from_string(res.content, content_type='application/pdf')
-                    uri_gcs = f"gs://{bucket.name}/{blob.name}"
+                with tiempos.etapa("documento_detalle_pdf"):
+                    nombre_f = f"DOC_{index+1}_{nombre_limpio}.pdf"
+                    session = descargas.crear_sesion(
+                        headers={"User-Agent": driver.execute_script("return navigator.userAgent;"), "Referer": driver.current_url},
+                        cookies=driver.get_cookies(), pool_size=1)
+
+                    # El cupo del host queda tomado hasta terminar de leer (y subir) el cuerpo
+                    with descargas.get_con_reintentos(session, url_doc, timeout=30, stream=True, retener=True) as res:
+                        try:
+                            if res.status_code == 200:
+                                blob = bucket.blob(f"{id_proyecto}/documentos_detalle/{nombre_f}")
+                                blob.content_disposition = f'attachment; filename="{nombre_f}"'
+                                subida = transferencia.subir_respuesta_streaming(res, blob, 'application/pdf')
+                                md5_doc, bytes_doc, mime_doc = subida['md5'], subida['bytes'], 'application/pdf'
+                                uri_gcs = f"gs://{bucket.name}/{blob.name}"
+                        finally:
+                            res.liberar_cupo()
             else:
-                driver.execute_script("arguments[0].click();", link_elem)
-                wait.until(EC.number_of_windows_to_be(3))
-                for handle in driver.window_handles:
-                    if handle not in [v_busqueda, v_ficha]:
-                        driver.switch_to.window(handle); break
-                
-                time.sleep(3)
-                html_doc = driver.page_source
+                html_doc = _capturar_detalle_en_navegador(driver, wait, link_elem, v_ficha, tiempos)
                 nombre_h = f"DOC_{index+1}_{nombre_limpio}.html"
                 blob = bucket.blob(f"{id_proyecto}/documentos_detalle/{nombre_h}")
                 blob.content_disposition = f'attachment; filename="{nombre_h}"'
                 blob.upload_from_string(html_doc, content_type='text/html')
+                md5_doc = transferencia.hashes_de_bytes(html_doc.encode('utf-8'))[0]
+                bytes_doc, mime_doc = len(html_doc.encode('utf-8')), 'text/html'
                 uri_gcs = f"gs://{bucket.name}/{blob.name}"
-                driver.close()
-                driver.switch_to.window(v_ficha)
             
             # --- CAPTURA DE METADATA ---
             if uri_gcs:
-                metadata_lista.append(crear_registro_metadata(uri_gcs, params_base, {"nombre_documento": nombre_original, "tipo_fuente": "Documento Ficha"}))
-            
-            time.sleep(2)
+                metadata_lista.append(crear_registro_metadata(uri_gcs, params_base, info_extra))
+                if manifiesto:
+                    manifiesto.registrar(url_doc, uri_gcs, md5=md5_doc, info=info_extra,
+                                         tamano_bytes=bytes_doc, content_type=mime_doc)
         except:
-            if len(driver.window_handles) > 2: driver.close()
+            if driver.current_window_handle != v_ficha: driver.close()
             driver.switch_to.window(v_ficha)
             
     return num_docs, metadata_lista
 
 
-def procesar_expediente_evaluacion(driver, wait, bucket, id_proyecto, v_busqueda, v_ficha, params_base):
+def extraer_enlaces_ficha(html_ficha, url_ficha):
+    """
+    Parsea la ficha UNA vez y resuelve todos los links de documentos (td.td-primary a).
+    Cada enlace queda marcado con `requiere_js` si no tiene una URL navegable directa.
+    """
+    soup = BeautifulSoup(html_ficha, 'lxml')
+    enlaces = []
+    for index, a in enumerate(soup.select("td.td-primary a")):
+        href = (a.get('href') or "").strip()
+        requiere_js = (not href) or href.startswith("#") or href.lower().startswith("javascript:")
+        enlaces.append({
+            "indice": index,
+            "nombre": a.get_text(strip=True),
+            "url": "" if requiere_js else urljoin(url_ficha, href),
+            "requiere_js": requiere_js
+        })
+    return enlaces
+
+
+def procesar_documentos_detalle_http(driver, wait, bucket, id_proyecto, v_busqueda, v_ficha, params_base, manifiesto=None, incremental=False, tiempos=None,
+                                     max_concurrencia=descargas.CONCURRENCIA_DEFECTO,
+                                     html_ficha=None, url_ficha=None, session=None, abrir_navegador=None, cas=None):
+    """
+    Variante sin navegador de procesar_documentos_detalle:
+    1. Parsea la ficha una sola vez y resuelve todos los links.
+    2. Descarga PDFs y HTML en paralelo por la sesión HTTP (con las cookies del driver).
+    3. Solo usa Chrome para links HTML que requieren JavaScript o que fallaron por HTTP
+       (un PDF no se puede capturar en el navegador: si falla cuenta en documentos_detalle_fallidos).
+    Misma salida (num_docs, metadata_lista) y mismos nombres DOC_{n}_... que el modo navegador.
+    Sin driver (búsqueda por HTTP) se usan `html_ficha`, `url_ficha` y `session`; si algún link
+    requiere JavaScript se pide un navegador con `abrir_navegador(url_ficha)` -> (driver, wait).
+    Con `cas` (almacen_cas.AlmacenCAS) cada contenido se guarda una vez por hash y se reutiliza entre proyectos.
     """
+    tiempos = tiempos or RegistroTiempos()
+    if driver is not None:
+        if driver.current_window_handle != v_ficha:
+            driver.switch_to.window(v_ficha)
+        url_ficha = driver.current_url
+        html_ficha = driver.page_source
+
+    with tiempos.etapa("parseo_ficha"):
+        enlaces = extraer_enlaces_ficha(html_ficha, url_ficha)
+
+    registros_por_indice = {}
+    pendientes_http, pendientes_navegador = [], []
+    for enlace in enlaces:
+        enlace["nombre_limpio"] = limpiar_nombre_archivo(enlace["nombre"])
+        enlace["info"] = {"nombre_documento": enlace["nombre"], "tipo_fuente": "Documento Ficha"}
+
+        entrada = manifiesto.vigente(enlace["url"]) if (manifiesto and incremental and enlace["url"]) else None
+        if entrada:
+            registros_por_indice[enlace["indice"]] = crear_registro_metadata(entrada['ruta_gcs'], params_base, entrada['info'], entrada.get('ruta_logica'))
+        elif enlace["requiere_js"]:
+            pendientes_navegador.append(enlace)
+        else:
+            pendientes_http.append(enlace)
+
+    def _registrar(enlace, uri_gcs, ruta_logica, md5_doc, sha256_doc=None, bytes_doc=None, mime_doc=None):
+        if manifiesto and enlace["url"]:
+            manifiesto.registrar(enlace["url"], uri_gcs, md5=md5_doc, info=enlace["info"], sha256=sha256_doc, ruta_logica=ruta_logica,
+                                 tamano_bytes=bytes_doc, content_type=mime_doc)
+        return crear_registro_metadata(uri_gcs, params_base, enlace["info"], ruta_logica)
+
+    def _subir(enlace, res):
+        reutilizada = cas.reutilizable(enlace, res) if cas else None
+        if reutilizada is None and (res is None or res.status_code != 200):
+            if res is not None and 'pdf' in res.headers.get('Content-Type', '').lower():
+                enlace["es_pdf"] = True
+            print(f"      ⚠️ Detalle {enlace['indice']+1}: HTTP {res.status_code if res is not None else '-'}", flush=True)
+            return None
+        if reutilizada:
+            extension, mime_type = reutilizada["extension"], reutilizada["content_type"]
+        else:
+            es_pdf = 'pdf' in res.headers.get('Content-Type', '').lower() or enlace["url"].lower().endswith(".pdf")
+            extension, mime_type = (".pdf", 'application/pdf') if es_pdf else (".html", 'text/html')
+        nombre_f = f"DOC_{enlace['indice']+1}_{enlace['nombre_limpio']}{extension}"
+        ruta_logica = f"{id_proyecto}/documentos_detalle/{nombre_f}"
+        if reutilizada:
+            tiempos.contar("documentos_reutilizados")
+            return _registrar(enlace, reutilizada["uri"], ruta_logica, reutilizada["md5"], reutilizada["sha256"],
+                              reutilizada.get("bytes"), mime_type)
+        with tiempos.span("subida_gcs", ruta=ruta_logica) as span:
+            if cas:
+                hashes = cas.guardar_respuesta(enlace["url"], res, mime_type, extension, nombre_f)
+                uri_gcs = hashes["uri"]
+            else:
+                blob = bucket.blob(ruta_logica)
+                blob.content_disposition = f'attachment; filename="{nombre_f}"'
+                hashes = transferencia.subir_respuesta_streaming(res, blob, mime_type)
+                uri_gcs = f"gs://{bucket.name}/{blob.name}"
+            span["bytes"] = hashes["bytes"]
+        tiempos.contar("documentos_descargados")
+        tiempos.contar("bytes_descargados", hashes["bytes"])
+        return _registrar(enlace, uri_gcs, ruta_logica, hashes['md5'], hashes['sha256'], hashes['bytes'], mime_type)
+
+    with tiempos.etapa("detalle_http"):
+        if session is None:
+            session = descargas.crear_sesion(
+                headers={"User-Agent": driver.execute_script("return navigator.userAgent;"), "Referer": url_ficha},
+                cookies=driver.get_cookies(), pool_size=max_concurrencia
+            )
+        resultados = descargas.descargar_concurrente(
+            pendientes_http, _subir, session,
+            max_concurrencia=max_concurrencia,
+            preparar=cas.preparar if cas else None, tiempos=tiempos, nombre_span="documento_detalle",
+            stream=True, timeout=30
+        )
+        for enlace, registro in zip(pendientes_http, resultados):
+            if registro:
+                registros_por_indice[enlace["indice"]] = registro
+            elif enlace.get("es_pdf") or enlace["url"].lower().endswith(".pdf"):
+                # El navegador no guarda PDFs (se descargan fuera de la ventana): queda como falla
+                print(f"      ❌ Detalle {enlace['indice']+1}: PDF no descargado, queda para el próximo intento", flush=True)
+                tiempos.contar("documentos_detalle_fallidos")
+            else:
+                # HTML con error HTTP o excepción tras los reintentos: se reintenta con navegador
+                pendientes_navegador.append(enlace)
+
+    # Respaldo con navegador: solo los links que de verdad lo necesitan
+    if pendientes_navegador:
+        print(f"   🌐 {len(pendientes_navegador)} documentos de la ficha requieren navegador.", flush=True)
+        if driver is None:
+            if abrir_navegador is None:
+                print("      ⚠️ Sin navegador disponible: se omiten.", flush=True)
+                pendientes_navegador = []
+            else:
+                driver, wait = abrir_navegador(url_ficha)
+                v_ficha = driver.current_window_handle
+        if driver is not None:
+            elementos = driver.find_elements(By.CSS_SELECTOR, "td.td-primary a")
+    for enlace in pendientes_navegador:
+        try:
+            with tiempos.span("documento_detalle_navegador", indice=enlace["indice"] + 1):
+                html_doc = _capturar_detalle_en_navegador(driver, wait, elementos[enlace["indice"]], v_ficha, tiempos)
+            tiempos.contar("documentos_navegador")
+            nombre_h = f"DOC_{enlace['indice']+1}_{enlace['nombre_limpio']}.html"
+            ruta_logica = f"{id_proyecto}/documentos_detalle/{nombre_h}"
+            if cas:
+                # Sin URL: lo renderizado por Chrome no entra a la caché por URL, pero sí se deduplica
+                guardada = cas.guardar_bytes(None, html_doc.encode('utf-8'), 'text/html', ".html", nombre_h)
+                registros_por_indice[enlace["indice"]] = _registrar(enlace, guardada["uri"], ruta_logica, guardada["md5"], guardada["sha256"],
+                                                                    guardada["bytes"], 'text/html')
+            else:
+                blob = bucket.blob(ruta_logica)
+                blob.content_disposition = f'attachment; filename="{nombre_h}"'
+                blob.upload_from_string(html_doc, content_type='text/html')
+                registros_por_indice[enlace["indice"]] = _registrar(
+                    enlace, f"gs://{bucket.name}/{blob.name}", ruta_logica, transferencia.hashes_de_bytes(html_doc.encode('utf-8'))[0],
+                    bytes_doc=len(html_doc.encode('utf-8')), mime_doc='text/html')
+        except Exception as e:
+            print(f"      ⚠️ Detalle {enlace['indice']+1} falló en navegador: {e}", flush=True)
+            tiempos.contar("fallas_documento_detalle_navegador")
+            if driver.current_window_handle != v_ficha: driver.close()
+            driver.switch_to.window(v_ficha)
+
+    metadata_lista = [registros_por_indice[i] for i in sorted(registros_por_indice)]
+    return len(enlaces), metadata_lista
+
+
+def _obtener_listado_expediente(session, url_tabla, headers):
+    """Lee xhr_documentos.php y retorna la lista de filas {Fecha, Documento, Enlace}; None si falla."""
+    print(f"   ⏳ Obteniendo listado: {url_tabla}...", flush=True)
+    response = descargas.get_con_reintentos(session, url_tabla, headers=headers, timeout=30)
+    
+    if response.status_code != 200:
+        print(f"   ❌ Error HTTP {response.status_code}", flush=True)
+        return None
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+    tabla = soup.find('table', {'id': 'tbldocumentos'})
+    
+    if not tabla:
+        return None
+
+    datos = []
+    rows = tabla.find_all('tr')[1:] 
+
+    for tr in rows:
+        cols = tr.find_all('td')
+        if len(cols) < 7: continue
+        
+        try:
+            celda_doc = cols[3]
+            nombre_visual = celda_doc.get_text(strip=True)
+            link_tag = celda_doc.find('a')
+            fecha = cols[6].get_text(strip=True)
+            
+            enlace = ""
+            if link_tag and 'href' in link_tag.attrs:
+                ruta = link_tag['href'].replace(r"\'", "").replace(r"'", "")
+                enlace = ruta if ruta.startswith("http") else f"{SEIA_BASE_URL}{ruta}"
+
+            if enlace:
+                datos.append({
+                    "Fecha": fecha,
+                    "Documento": nombre_visual,
+                    "Enlace": enlace
+                })
+        except:
+            continue
+    return datos
+
+
+def _info_expediente(doc):
+    return {
+        "nombre_documento": doc['Documento'],
+        "fecha_documento": doc['Fecha'],
+        "tipo_fuente": "Expediente Bitácora"
+    }
+
+
+def procesar_expediente_evaluacion(driver, wait, bucket, id_proyecto, v_busqueda, v_ficha, params_base,
+                                   max_concurrencia=descargas.CONCURRENCIA_DEFECTO,
+                                   manifiesto=None, incremental=False, url_ficha=None, session=None, checkpoint=None, cas=None,
+                                   tiempos=None):
+    """
+    Si se entregan `url_ficha` y `session` (flujo sin navegador) no se usa el driver.
+    Con `tiempos` (metricas.RegistroTiempos) quedan medidos el listado, cada descarga y cada subida.
+    Con `checkpoint` se retoma el listado y se omiten las filas ya subidas en un intento anterior.
+    Con `cas` los documentos van al almacén por hash (compartido entre proyectos) y las URLs ya vistas se revalidan sin descargar.
     1. Obtiene ID SEIA desde URL.
     2. Descarga Tabla.
-    3. Itera documentos:
+    3. Descarga documentos en paralelo (ver descargas.py):
         - Si es PDF -> Guarda .pdf
         - Si no es PDF -> Guarda el código fuente como .html
-    4. Sube Excel índice.
+       (en modo incremental solo las filas nuevas o con fecha distinta según el manifiesto)
+    4. Sube el Excel índice (solo con SCRAPER_INDICE_EXCEL=1; el índice de documentos es el catálogo).
     5. Genera Metadata para Vertex AI.
     """
     print(f"🚀 [INICIO] Descarga Híbrida (PDF/HTML) para: {id_proyecto}", flush=True)
+    tiempos = tiempos or RegistroTiempos()
     metadata_lista = []  # <--- NUEVO: Inicializamos lista
     
     # --- 1. OBTENER ID SEIA ---
     try:
-        if driver.current_window_handle != v_ficha:
-            driver.switch_to.window(v_ficha)
-        
-        url_actual = driver.current_url
+        if url_ficha:
+            url_actual = url_ficha
+        else:
+            if driver.current_window_handle != v_ficha:
+                driver.switch_to.window(v_ficha)
+            url_actual = driver.current_url
         match = re.search(r"id_expediente=(\d+)", url_actual)
         
         if match:
@@ -206,137 +521,154 @@ def procesar_expediente_evaluacion(driver, wait, bucket, id_proyecto, v_busqueda
         return 0, None, [] # <--- CAMBIO: Retornamos lista vacía
 
     # --- 2. PREPARAR SESIÓN ---
-    url_tabla = f"https://seia.sea.gob.cl/expediente/xhr_documentos.php?id_expediente={id_seia}"
-    session = requests.Session()
+    url_tabla = f"{SEIA_BASE_URL}/expediente/xhr_documentos.php?id_expediente={id_seia}"
     
     headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "User-Agent": USER_AGENT,
         "Referer": url_actual
     }
     
-    for cookie in driver.get_cookies():
-        session.cookies.set(cookie['name'], cookie['value'])
+    if session is None:
+        session = descargas.crear_sesion(cookies=driver.get_cookies())
 
     try:
-        # --- 3. OBTENER LISTADO ---
-        print(f"   ⏳ Obteniendo listado: {url_tabla}...", flush=True)
-        response = session.get(url_tabla, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"   ❌ Error HTTP {response.status_code}", flush=True)
-            return 0, None, [] # <--- CAMBIO
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        tabla = soup.find('table', {'id': 'tbldocumentos'})
-        
-        if not tabla:
-            return 0, None, [] # <--- CAMBIO
-
-        datos = []
-        rows = tabla.find_all('tr')[1:] 
-
-        for tr in rows:
-            cols = tr.find_all('td')
-            if len(cols) < 7: continue
-            
-            try:
-                celda_doc = cols[3]
-                nombre_visual = celda_doc.get_text(strip=True)
-                link_tag = celda_doc.find('a')
-                fecha = cols[6].get_text(strip=True)
-                
-                enlace = ""
-                if link_tag and 'href' in link_tag.attrs:
-                    ruta = link_tag['href'].replace(r"\'", "").replace(r"'", "")
-                    enlace = ruta if ruta.startswith("http") else f"https://seia.sea.gob.cl{ruta}"
-
-                if enlace:
-                    datos.append({
-                        "Fecha": fecha,
-                        "Documento": nombre_visual,
-                        "Enlace": enlace
-                    })
-            except:
-                continue
+        # --- 3. OBTENER LISTADO (o retomarlo del checkpoint, para no cambiar la numeración) ---
+        indice_guardado = checkpoint.listado_vigente() if checkpoint else None
+        if indice_guardado:
+            datos = indice_guardado["datos"]
+            print(f"   ♻️ Listado retomado del checkpoint ({len(datos)} filas).", flush=True)
+        else:
+            with tiempos.span("listado_expediente", url=url_tabla) as span:
+                datos = _obtener_listado_expediente(session, url_tabla, headers)
+                span["filas"] = len(datos) if datos is not None else None
+            if datos is None:
+                return 0, None, []
+            if checkpoint:
+                checkpoint.marcar_listado({"id_seia": id_seia, "datos": datos})
 
         print(f"   📊 Documentos detectados: {len(datos)}. Iniciando descarga...", flush=True)
 
-        # --- 4. DESCARGA INTELIGENTE (PDF vs HTML) ---
-        contador_exitos = 0
-        
-        for i, doc in enumerate(datos, 1):
-            url_archivo = doc['Enlace']
-            nombre_tabla = doc['Documento']
-            # Necesitamos la fecha para la metadata
-            fecha_tabla = doc['Fecha'] 
-            
+        # --- 4. DESCARGA INTELIGENTE (PDF vs HTML), EN PARALELO ---
+        filas_rotas = set()  # respuestas 4xx/404: no se recuperan reintentando
+        def _subir_documento(tarea, res_file):
+            i = tarea['indice']
+            nombre_tabla = tarea['Documento']
             # Limpiamos nombre de caracteres prohibidos
             nombre_limpio = re.sub(r'[\\/*?:"<>|]', "", nombre_tabla).strip()
-            
-            print(f"      ⬇️ [{i}/{len(datos)}] Procesando: {nombre_limpio}...", flush=True)
-            
-            try:
-                # stream=True es vital para no cargar PDFs gigantes en memoria de golpe
-                res_file = session.get(url_archivo, headers=headers, stream=True, timeout=60)
-                
-                if res_file.status_code == 200:
-                    content_type = res_file.headers.get('Content-Type', '').lower()
-                    
-                    # LOGICA DE DECISIÓN (INTACTA)
-                    if 'pdf' in content_type:
-                        # ES PDF
-                        extension = ".pdf"
-                        mime_type = 'application/pdf'
-                        contenido = res_file.content # Binario
-                    else:
-                        # NO ES PDF -> ASUMIMOS HTML (Extraer código)
-                        extension = ".html"
-                        mime_type = 'text/html; charset=utf-8'
-                        # Usamos .content para obtener los bytes crudos y que no se rompan los acentos
-                        contenido = res_file.content 
-                    
-                    # Evitar duplicar extensión si el nombre ya la trae
-                    if nombre_limpio.lower().endswith(extension):
-                        nombre_final = f"{i:03d}_{nombre_limpio}"
-                    else:
-                        nombre_final = f"{i:03d}_{nombre_limpio}{extension}"
-                    
-                    # Subir a GCS
-                    ruta_blob = f"{id_proyecto}/expediente_docs/{nombre_final}"
-                    blob_file = bucket.blob(ruta_blob)
-                    blob_file.upload_from_string(contenido, content_type=mime_type)
-                    
-                    contador_exitos += 1
-
-                    # --- [AQUÍ INSERTAMOS LA METADATA] ---
-                    # Esto ocurre solo si la descarga y subida fueron exitosas
-                    uri_gcs = f"gs://{bucket.name}/{blob_file.name}"
-                    info_extra = {
-                        "nombre_documento": nombre_tabla,
-                        "fecha_documento": fecha_tabla,
-                        "tipo_fuente": "Expediente Bitácora"
-                    }
-                    metadata_lista.append(crear_registro_metadata(uri_gcs, params_base, info_extra))
-                    # -------------------------------------
 
+            reutilizada = cas.reutilizable(tarea, res_file) if cas else None
+            if reutilizada is None and (res_file is None or res_file.status_code != 200):
+                status = res_file.status_code if res_file is not None else None
+                if status in descargas.ESTADOS_REINTENTABLES:
+                    # SEIA saturado, no un link roto: la fila queda pendiente para el próximo intento
+                    print(f"      ⏸️ [{i}/{len(datos)}] SEIA no responde (HTTP {status}), queda pendiente: {nombre_limpio}", flush=True)
+                    tiempos.contar("pendientes_por_sobrecarga")
                 else:
-                    print(f"      ⚠️ Link roto ({res_file.status_code})", flush=True)
+                    print(f"      ⚠️ [{i}/{len(datos)}] Link roto ({status or '-'}): {nombre_limpio}", flush=True)
+                    tiempos.contar("links_rotos")
+                    # Falla definitiva: reintentarla no cambia nada, no deja la etapa abierta
+                    if status is not None:
+                        filas_rotas.add(i)
+                return None
+
+            content_type = reutilizada["content_type"] if reutilizada else res_file.headers.get('Content-Type', '').lower()
+
+            # LOGICA DE DECISIÓN (INTACTA)
+            if 'pdf' in content_type:
+                # ES PDF
+                extension = ".pdf"
+                mime_type = 'application/pdf'
+            else:
+                # NO ES PDF -> ASUMIMOS HTML (Extraer código)
+                extension = ".html"
+                mime_type = 'text/html; charset=utf-8'
 
-            except Exception as e:
-                print(f"      ⚠️ Error descargando {i}: {e}", flush=True)
-                continue
+            # Evitar duplicar extensión si el nombre ya la trae
+            if nombre_limpio.lower().endswith(extension):
+                nombre_final = f"{i:03d}_{nombre_limpio}"
+            else:
+                nombre_final = f"{i:03d}_{nombre_limpio}{extension}"
+
+            ruta_blob = f"{id_proyecto}/expediente_docs/{nombre_final}"
+            if reutilizada:
+                hashes, uri_gcs = reutilizada, reutilizada['uri']
+                tiempos.contar("documentos_reutilizados")
+            else:
+                with tiempos.span("subida_gcs", ruta=ruta_blob) as span:
+                    if cas:
+                        # Almacén por hash: si otro proyecto ya trajo este contenido no se vuelve a subir
+                        hashes = cas.guardar_respuesta(tarea['url'], res_file, mime_type, extension, nombre_final)
+                        uri_gcs = hashes['uri']
+                    else:
+                        # Subir a GCS en streaming (bytes crudos, sin cargar el archivo completo en memoria)
+                        blob_file = bucket.blob(ruta_blob)
+                        hashes = transferencia.subir_respuesta_streaming(res_file, blob_file, mime_type)
+                        uri_gcs = f"gs://{bucket.name}/{blob_file.name}"
+                    span["bytes"] = hashes['bytes']
+                tiempos.contar("documentos_descargados")
+                tiempos.contar("bytes_descargados", hashes['bytes'])
+            print(f"      {'♻️' if reutilizada else '⬇️'} [{i}/{len(datos)}] OK: {nombre_final}", flush=True)
+
+            # Metadata solo si la descarga y subida fueron exitosas
+            info_extra = _info_expediente(tarea)
+            if manifiesto:
+                manifiesto.registrar(tarea['url'], uri_gcs, md5=hashes['md5'], fecha=tarea['Fecha'], info=info_extra,
+                                     sha256=hashes['sha256'], ruta_logica=ruta_blob,
+                                     tamano_bytes=hashes.get('bytes'), content_type=mime_type)
+            registro = crear_registro_metadata(uri_gcs, params_base, info_extra, nombre_final)
+            if checkpoint:
+                checkpoint.marcar_fila(i, registro)
+            return registro
+
+        # La numeración NNN_ se fija aquí según la posición en la tabla, no según el orden de llegada
+        tareas = [dict(doc, indice=i, url=doc['Enlace']) for i, doc in enumerate(datos, 1)]
+
+        # Modo incremental: las filas vigentes en el manifiesto no se descargan
+        registros_por_indice = {}
+        pendientes = []
+        for tarea in tareas:
+            registro_cp = checkpoint.fila(tarea['indice']) if checkpoint else None
+            entrada = manifiesto.vigente(tarea['url'], tarea['Fecha']) if (manifiesto and incremental) else None
+            if registro_cp:
+                registros_por_indice[tarea['indice']] = registro_cp
+            elif entrada:
+                registros_por_indice[tarea['indice']] = crear_registro_metadata(entrada['ruta_gcs'], params_base, entrada['info'], entrada.get('ruta_logica'))
+            else:
+                # Fila con fecha distinta a la registrada: el contenido pudo cambiar, no basta la caché por URL
+                previa = manifiesto.entradas.get(tarea['url']) if manifiesto else None
+                tarea['revalidar'] = bool(previa and previa.get('fecha') != tarea['Fecha'])
+                pendientes.append(tarea)
+        if incremental:
+            print(f"   ♻️ Incremental: {len(tareas) - len(pendientes)} vigentes, {len(pendientes)} nuevos/modificados.", flush=True)
+
+        sesion_descargas = descargas.crear_sesion(headers=headers, pool_size=max_concurrencia)
+        sesion_descargas.cookies.update(session.cookies)
+        resultados = descargas.descargar_concurrente(
+            pendientes, _subir_documento, sesion_descargas,
+            max_concurrencia=max_concurrencia,
+            preparar=cas.preparar if cas else None, tiempos=tiempos, nombre_span="documento_expediente",
+            stream=True, timeout=60
+        )
+        for tarea, registro in zip(pendientes, resultados):
+            if registro:
+                registros_por_indice[tarea['indice']] = registro
+        metadata_lista.extend(registros_por_indice[i] for i in sorted(registros_por_indice))
+        print(f"   ✅ Expediente: {len(metadata_lista)}/{len(datos)} documentos disponibles en GCS.", flush=True)
+
+        # La etapa queda completa si solo faltan links rotos; si quedaron fallas transitorias
+        # (SEIA saturado, circuito abierto, error de subida) el próximo intento retoma esas filas
+        if checkpoint:
+            if len(registros_por_indice) + len(filas_rotas) >= len(tareas):
+                checkpoint.marcar(cp.EXPEDIENTE, {"num_docs": len(datos), "registros": metadata_lista})
+            else:
+                checkpoint.guardar()
 
-        # --- 5. GENERAR INDICE EXCEL ---
+        # --- 5. INDICE EXCEL (opcional: el índice consultable es el catálogo Parquet, ver catalogo.py) ---
         if datos:
-            df = pd.DataFrame(datos)
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False)
-            output.seek(0)
-            
-            nombre_indice = f"Indice_Expediente_{id_seia}.xlsx"
-            blob_idx = bucket.blob(f"{id_proyecto}/expediente/{nombre_indice}")
-            blob_idx.upload_from_string(output.getvalue(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            if catalogo.INDICE_EXCEL:
+                nombre_indice = f"Indice_Expediente_{id_seia}.xlsx"
+                blob_idx = bucket.blob(f"{id_proyecto}/expediente/{nombre_indice}")
+                blob_idx.upload_from_string(catalogo.indice_excel(pd.DataFrame(datos)), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
             
             # Retornamos los 3 valores que espera el orquestador
             return len(datos), None, metadata_lista
@@ -351,9 +683,55 @@ def procesar_expediente_evaluacion(driver, wait, bucket, id_proyecto, v_busqueda
 # 4. FUNCIÓN PRINCIPAL (ORQUESTADOR)
 # ==========================================
 
-def ejecutar_scrapping(id_proyecto, nombre_proyecto, titular, fecha_presentacion, bucket_name="almacen_antecedentes", region=None, comuna=None):
-    logger, log_stream = obtener_logger()
-    driver = None
+def _guardar_reporte(bucket, id_proyecto, tiempos, perfilador, estado_reporte, cache_inicial=None):
+    """
+    Sube el reporte JSON (y el perfil, si se pidió) junto a metadata_import.jsonl.
+    La caché HTTP es del proceso: se informa lo ocurrido desde `cache_inicial` (incluye lo de
+    otros proyectos que corrieron en paralelo en el mismo proceso).
+    """
+    reporte = tiempos.reporte(proyecto_id=str(id_proyecto), control_tasa=control_tasa.CONTROL.estado(),
+                              cache_http=cache_http.estadisticas(desde=cache_inicial), **estado_reporte)
+    if perfilador.modo:
+        reporte["perfil"] = {"modo": perfilador.modo, "top": perfilador.resumen()}
+    for nombre, contenido in perfilador.salidas().items():
+        bucket.blob(f"{id_proyecto}/{nombre}").upload_from_string(contenido, content_type="application/octet-stream")
+    bucket.blob(f"{id_proyecto}/reporte_ejecucion.json").upload_from_string(
+        json.dumps(reporte, ensure_ascii=False), content_type="application/json")
+
+def limpiar_directorio_descargas(download_dir):
+    """Elimina restos de descargas previas (Excel, .crdownload) de la carpeta indicada."""
+    for f in os.listdir(download_dir):
+        ruta = os.path.join(download_dir, f)
+        if os.path.isfile(ruta):
+            try: os.remove(ruta)
+            except OSError: pass
+
+def ejecutar_scrapping(id_proyecto, nombre_proyecto, titular, fecha_presentacion, bucket_name="almacen_antecedentes", region=None, comuna=None, driver=None, download_dir=None, incremental=None, obtener_driver=None, tiempos=None, perfil=None):
+    """
+    Scrapea un proyecto completo.
+    Con `incremental=True` (o SCRAPER_INCREMENTAL=1) solo se descarga lo que no figura vigente
+    en el manifiesto del proyecto ({id_proyecto}/manifest.json).
+    La búsqueda y la ficha se resuelven por HTTP (seia_http); Chrome solo se levanta como respaldo
+    o si SCRAPER_MODO_BUSQUEDA=navegador.
+    Si se recibe `driver`, u `obtener_driver` (callable perezoso, ej: desde el pool de motor_lotes),
+    el driver se reutiliza y NO se cierra al terminar; en ese caso `download_dir` debe ser la
+    carpeta de descargas propia de ese driver.
+    Con `tiempos` (metricas.RegistroTiempos) el llamador recibe el desglose por etapa.
+    Al terminar (bien o mal) deja {id_proyecto}/reporte_ejecucion.json con etapas, spans y contadores.
+    `perfil` ("cprofile" | "muestreo", por defecto SCRAPER_PERFIL) además perfila la ejecución
+    y sube el resultado junto al reporte.
+    """
+    logger, log_stream = obtener_logger(id_proyecto)
+    driver_externo = driver is not None or obtener_driver is not None
+    if incremental is None:
+        incremental = os.getenv("SCRAPER_INCREMENTAL", "0") == "1"
+    manifiesto = None
+    checkpoint = None
+    tiempos = tiempos if tiempos is not None else RegistroTiempos()
+    perfilador = metricas.Perfilador(metricas.PERFIL if perfil is None else perfil)
+    cache_inicial = cache_http.estadisticas()
+    bucket = None
+    estado_reporte = {"estado": "error"}
     
     # 1. Definimos los parámetros base para la metadata (usamos valores por defecto si region/comuna son None)
     params_base = {
@@ -367,81 +745,219 @@ def ejecutar_scrapping(id_proyecto, nombre_proyecto, titular, fecha_presentacion
     registros_metadata = []
 
     try:
-        download_dir = "/tmp" if os.environ.get("K_SERVICE") else os.path.join(os.getcwd(), "downloads")
+        perfilador.iniciar()
+        if download_dir is None:
+            download_dir = "/tmp" if os.environ.get("K_SERVICE") else os.path.join(os.getcwd(), "downloads")
         if not os.path.exists(download_dir): os.makedirs(download_dir)
 
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        driver = configurar_driver(download_dir)
-        wait = WebDriverWait(driver, 20)
+        # GCS o directorio local según STORAGE_BACKEND (ver almacenamiento.py)
+        bucket = almacenamiento.obtener_bucket(bucket_name)
+        manifiesto = ManifiestoProyecto(bucket, id_proyecto)
+        # Si un intento anterior quedó a medias, se retoma desde la primera etapa/fila incompleta
+        checkpoint = cp.CheckpointProyecto(bucket, id_proyecto)
+        cas = almacen_cas.AlmacenCAS(bucket) if almacen_cas.USAR_CAS else None
+        def _driver():
+            # Chrome solo se levanta cuando de verdad se necesita
+            nonlocal driver
+            if driver is None:
+                with tiempos.etapa("arranque_driver"):
+                    driver = obtener_driver() if obtener_driver else configurar_driver(download_dir)
+            return driver
+
+        def _abrir_en_navegador(url):
+            d = _driver()
+            d.get(url)
+            esperar_documento_listo(d)
+            return d, WebDriverWait(d, 20)
+
+        params_err = f"1. **Nombre:** {nombre_proyecto}\n2. **Titular:** {titular}\n3. **F. Presentación:** {params_base['fecha_presentacion']}\n"
+
+        # Camino común: búsqueda y ficha por HTTP, sin navegador
+        resultado_http, sesion_http = None, None
+        if MODO_BUSQUEDA == "http":
+            sesion_http = descargas.crear_sesion(headers={"User-Agent": USER_AGENT})
+            try:
+                with tiempos.etapa("busqueda"):
+                    resultado_http = seia_http.buscar_proyecto(sesion_http, nombre_proyecto, titular, params_base["fecha_presentacion"])
+                with tiempos.etapa("apertura_ficha"):
+                    html_ficha, url_ficha = seia_http.obtener_ficha(sesion_http, resultado_http["url_ficha"])
+            except Exception as e:
+                print(f"   [SCRAPER] Búsqueda HTTP no resuelta ({e}); se usa Chrome.", flush=True)
+                resultado_http, sesion_http = None, None
+
+        if resultado_http:
+            # "Sin resultados" solo lo confirma Chrome (abajo): por HTTP no se distingue de una tabla sin dibujar
+            wait, ventana_busqueda, ventana_ficha = None, None, None
+            if not checkpoint.completada(cp.EXCEL_BUSQUEDA):
+                with tiempos.etapa("descarga_excel"):
+                    excel_http = None
+                    if resultado_http["url_excel"]:
+                        try: excel_http = seia_http.descargar_excel(sesion_http, resultado_http["url_excel"], download_dir)
+                        except Exception as e: print(f"   ⚠️ Excel de búsqueda no descargado por HTTP: {e}", flush=True)
+                    if not excel_http:
+                        # El Excel alimenta la fila de BigQuery: sin él se repite la búsqueda en Chrome solo para bajarlo
+                        print("   [SCRAPER] Excel de búsqueda sin URL válida por HTTP; se descarga con Chrome.", flush=True)
+                        try:
+                            d = _driver()
+                            realizar_busqueda(d, WebDriverWait(d, 20), nombre_proyecto, titular, params_base["fecha_presentacion"])
+                            descargar_excel(d, WebDriverWait(d, 20), download_dir)
+                        except Exception as e:
+                            print(f"   ⚠️ Excel de búsqueda no descargado con Chrome: {e}", flush=True)
+        else:
+            # Respaldo: flujo clásico con Chrome
+            driver = _driver()
+            wait = WebDriverWait(driver, 20)
 
-        realizar_busqueda(driver, wait, nombre_proyecto, titular, params_base["fecha_presentacion"])
-        ventana_busqueda = driver.current_window_handle
+            with tiempos.etapa("busqueda"):
+                realizar_busqueda(driver, wait, nombre_proyecto, titular, params_base["fecha_presentacion"])
+            ventana_busqueda = driver.current_window_handle
 
-        if driver.find_elements(By.CSS_SELECTOR, "td.dt-empty"):
-            params_err = f"1. **Nombre:** {nombre_proyecto}\n2. **Titular:** {titular}\n3. **F. Presentación:** {params_base['fecha_presentacion']}\n"
-            return f"⚠️ SIN RESULTADOS|{params_err}", log_stream.getvalue(), None
+            if driver.find_elements(By.CSS_SELECTOR, SEL_SIN_RESULTADOS):
+                estado_reporte["estado"] = "sin_resultados"
+                return f"⚠️ SIN RESULTADOS|{params_err}", log_stream.getvalue(), None
 
-        descargar_excel(driver, wait)
+            with tiempos.etapa("descarga_excel"):
+                descargar_excel(driver, wait, download_dir)
 
-        link_ficha = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "td.dt-head-center a.color-primary")))
-        driver.execute_script("arguments[0].click();", link_ficha)
-        wait.until(EC.number_of_windows_to_be(2))
-        
-        for handle in driver.window_handles:
-            if handle != ventana_busqueda:
-                driver.switch_to.window(handle); break
-        
-        ventana_ficha = driver.current_window_handle
-        time.sleep(5)
+            with tiempos.etapa("apertura_ficha"):
+                link_ficha = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, SEL_LINK_FICHA)))
+                driver.execute_script("arguments[0].click();", link_ficha)
+                wait.until(EC.number_of_windows_to_be(2))
+                
+                for handle in driver.window_handles:
+                    if handle != ventana_busqueda:
+                        driver.switch_to.window(handle); break
+                
+                ventana_ficha = driver.current_window_handle
+                esperar_documento_listo(driver)
+            html_ficha, url_ficha = driver.page_source, driver.current_url
 
         # A. Ficha Principal
         blob_ficha = bucket.blob(f"{id_proyecto}/ficha_principal.html")
-        blob_ficha.upload_from_string(driver.page_source, content_type='text/html')
+        if not checkpoint.completada(cp.FICHA):
+            with tiempos.etapa("ficha_principal"):
+                md5_ficha = transferencia.hashes_de_bytes(html_ficha.encode('utf-8'))[0]
+                entrada_ficha = manifiesto.entradas.get("ficha_principal")
+                if not (incremental and entrada_ficha and entrada_ficha.get("md5") == md5_ficha):
+                    blob_ficha.upload_from_string(html_ficha, content_type='text/html')
+                    manifiesto.registrar("ficha_principal", f"gs://{bucket_name}/{blob_ficha.name}", md5=md5_ficha)
+            checkpoint.marcar(cp.FICHA)
         registros_metadata.append(crear_registro_metadata(f"gs://{bucket_name}/{blob_ficha.name}", params_base, {"nombre_documento": "Ficha Principal HTML"}))
 
         # B. Documentos de la ficha (Pasamos params_base)
-        num_docs_ficha, meta_ficha = procesar_documentos_detalle(driver, wait, bucket, id_proyecto, ventana_busqueda, ventana_ficha, params_base)
+        if checkpoint.completada(cp.DETALLE):
+            guardado = checkpoint.datos(cp.DETALLE)
+            num_docs_ficha, meta_ficha = guardado["num_docs"], guardado["registros"]
+        else:
+            fallidos_antes = tiempos.contadores["documentos_detalle_fallidos"]
+            with tiempos.etapa("documentos_detalle"):
+                if MODO_DETALLE == "navegador":
+                    # SCRAPER_MODO_DETALLE=navegador vuelve al recorrido clásico con Chrome
+                    if driver is None or ventana_ficha is None:
+                        driver, wait = _abrir_en_navegador(url_ficha)
+                        ventana_ficha = driver.current_window_handle
+                    num_docs_ficha, meta_ficha = procesar_documentos_detalle(driver, wait, bucket, id_proyecto, ventana_busqueda, ventana_ficha, params_base, manifiesto, incremental, tiempos)
+                else:
+                    num_docs_ficha, meta_ficha = procesar_documentos_detalle_http(
+                        driver if ventana_ficha else None, wait, bucket, id_proyecto, ventana_busqueda, ventana_ficha, params_base, manifiesto, incremental, tiempos,
+                        html_ficha=html_ficha, url_ficha=url_ficha, session=sesion_http, abrir_navegador=_abrir_en_navegador,
+                        cas=cas
+                    )
+            # Con PDFs fallidos la etapa queda abierta: el próximo intento los vuelve a pedir
+            if tiempos.contadores["documentos_detalle_fallidos"] == fallidos_antes:
+                checkpoint.marcar(cp.DETALLE, {"num_docs": num_docs_ficha, "registros": meta_ficha})
         registros_metadata.extend(meta_ficha)
 
         # C. Expediente de evaluación (Pasamos params_base y recibimos 3 valores)
-        num_docs_expediente, fecha_max_expediente, meta_expediente = procesar_expediente_evaluacion(driver, wait, bucket, id_proyecto, ventana_busqueda, ventana_ficha, params_base)
+        if checkpoint.completada(cp.EXPEDIENTE):
+            guardado = checkpoint.datos(cp.EXPEDIENTE)
+            num_docs_expediente, meta_expediente = guardado["num_docs"], guardado["registros"]
+        else:
+            with tiempos.etapa("expediente"):
+                num_docs_expediente, fecha_max_expediente, meta_expediente = procesar_expediente_evaluacion(
+                    driver, wait, bucket, id_proyecto, ventana_busqueda, ventana_ficha, params_base,
+                    manifiesto=manifiesto, incremental=incremental, url_ficha=url_ficha, session=sesion_http,
+                    checkpoint=checkpoint, cas=cas, tiempos=tiempos
+                )
         registros_metadata.extend(meta_expediente)
 
         total_docs = num_docs_ficha + num_docs_expediente
 
         # D. Excel de la búsqueda
-        excel_local_path = None
-        for f in os.listdir(download_dir):
-            if f.endswith(".xlsx"):
-                excel_local_path = os.path.join(download_dir, f)
-                blob_xlsx = bucket.blob(f"{id_proyecto}/{f}")
+        excel_local_path = excel_descargado(download_dir)
+        if checkpoint.completada(cp.EXCEL_BUSQUEDA):
+            registros_metadata.append(checkpoint.datos(cp.EXCEL_BUSQUEDA)["registro"])
+        elif excel_local_path:
+            with tiempos.etapa("excel_busqueda"):
+                blob_xlsx = bucket.blob(f"{id_proyecto}/{os.path.basename(excel_local_path)}")
                 blob_xlsx.upload_from_filename(excel_local_path)
-                registros_metadata.append(crear_registro_metadata(f"gs://{bucket_name}/{blob_xlsx.name}", params_base, {"nombre_documento": "Excel de Resultados SEIA"}))
-                break
+                registro_xlsx = crear_registro_metadata(f"gs://{bucket_name}/{blob_xlsx.name}", params_base, {"nombre_documento": "Excel de Resultados SEIA"})
+                registros_metadata.append(registro_xlsx)
+            checkpoint.marcar(cp.EXCEL_BUSQUEDA, {"registro": registro_xlsx})
+        else:
+            # Sin Excel no hay fila para BigQuery: el proyecto queda parcial en el reporte
+            estado_reporte["excel_busqueda"] = "faltante"
+            print("   ⚠️ Proyecto sin Excel de búsqueda: no se actualizará su fila en BigQuery.", flush=True)
+
+        # Texto extraído (opcional): los PDF/HTML pasan a un registro por chunk de texto
+        if extraccion_texto.EXTRAER_TEXTO and registros_metadata:
+            with tiempos.etapa("extraccion_texto"):
+                registros_metadata = extraccion_texto.ExtractorTexto(bucket, tiempos).procesar_registros(registros_metadata, manifiesto)
 
         # E. Generación del archivo JSONL Maestro
         if registros_metadata:
-            jsonl_content = "\n".join([json.dumps(r, ensure_ascii=False) for r in registros_metadata])
-            blob_jsonl = bucket.blob(f"{id_proyecto}/metadata_import.jsonl")
-            blob_jsonl.upload_from_string(jsonl_content, content_type='application/jsonl')
-
+            with tiempos.etapa("metadata_jsonl"):
+                jsonl_content = "\n".join([json.dumps(r, ensure_ascii=False) for r in registros_metadata])
+                blob_jsonl = bucket.blob(f"{id_proyecto}/metadata_import.jsonl")
+                blob_jsonl.upload_from_string(jsonl_content, content_type='application/jsonl')
+
+        # F. Catálogo de documentos (Parquet por región, desde el manifiesto)
+        if catalogo.USAR_CATALOGO:
+            with tiempos.etapa("catalogo"):
+                try:
+                    m_seia = re.search(r"id_expediente=(\d+)", url_ficha or "")
+                    catalogo.escribir_proyecto(bucket, params_base, manifiesto, m_seia.group(1) if m_seia else None)
+                except Exception as e:
+                    print(f"   ⚠️ Catálogo de documentos no actualizado: {e}", flush=True)
+
+        # Proyecto completo: se descarta el checkpoint. Si quedaron filas del expediente
+        # o PDFs de la ficha pendientes se conserva para que el próximo intento retome solo eso.
+        if checkpoint.completada(cp.EXPEDIENTE) and checkpoint.completada(cp.DETALLE):
+            checkpoint.limpiar()
+
+        logger.info(tiempos.resumen())
         ruta_gcs = f"gs://{bucket_name}/{id_proyecto}/"
-        console_url = f"https://console.cloud.google.com/storage/browser/{bucket_name}/{id_proyecto}?project={storage_client.project}"
+        console_url = almacenamiento.url_consola(bucket, id_proyecto)
+        estado_reporte.update(estado="exitoso", total_docs=total_docs)
         
         return f"✅ EXITOSO|{ruta_gcs}|{console_url}|{total_docs}", log_stream.getvalue(), excel_local_path
 
     except Exception as e:
         # Imprimimos en consola para depurar si app.py se cuelga
         print(f"   [SCRAPER ERROR] {str(e)}", flush=True)
+        estado_reporte["error"] = str(e)
+        logger.info(tiempos.resumen())
         if driver:
             try: driver.save_screenshot(f"error_{id_proyecto}.png")
             except: pass
         return f"❌ ERROR: {str(e)}", log_stream.getvalue(), None
     
     finally:
+        # El manifiesto se guarda aunque el proyecto falle: lo ya subido no se repite en el próximo intento
+        if manifiesto:
+            try: manifiesto.guardar()
+            except Exception as e: print(f"   [SCRAPER] Error guardando manifiesto: {e}", flush=True)
+        if checkpoint and checkpoint.reanudando:
+            try: checkpoint.guardar()
+            except Exception as e: print(f"   [SCRAPER] Error guardando checkpoint: {e}", flush=True)
+        perfilador.detener()
+        if bucket is not None:
+            try: _guardar_reporte(bucket, id_proyecto, tiempos, perfilador, estado_reporte, cache_inicial)
+            except Exception as e: print(f"   [SCRAPER] Error guardando reporte de ejecución: {e}", flush=True)
+
         # --- MODIFICACIÓN 2: Cierre seguro del proceso ---
-        if driver:
+        # Los drivers del pool los administra motor_lotes (no se cierran aquí)
+        if driver and not driver_externo:
             try:
                 driver.quit()
                 print("   [SCRAPER] Driver cerrado correctamente.", flush=True)
@@ -0,0 +1,160 @@
+import os
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+import descargas
+
+# ==========================================
+# BÚSQUEDA SEIA SIN NAVEGADOR
+# ==========================================
+# Resuelve (nombre, titular, fecha) -> id_expediente, ficha y Excel de la
+# búsqueda usando solo HTTP. El formulario de buscarProyecto.php se lee del
+# propio HTML (action, method y campos ocultos), así que no dependemos de
+# conocer de antemano el endpoint que procesa la búsqueda.
+# Solo se confía en una señal positiva (un link a la ficha). Cualquier otra cosa,
+# incluida una tabla vacía o un "sin resultados" (el SEIA dibuja la tabla con
+# JavaScript y el HTML trae un placeholder vacío), lanza BusquedaNoResuelta y el
+# orquestador confirma con Chrome antes de marcar el proyecto SIN_RESULTADOS.
+
+SEIA_BASE_URL = os.getenv("SEIA_BASE_URL", "https://seia.sea.gob.cl").rstrip("/")
+URL_BUSQUEDA = f"{SEIA_BASE_URL}/busqueda/buscarProyecto.php"
+
+# id del input en el formulario -> clave del criterio de búsqueda
+CAMPOS_FORMULARIO = {
+    "projectName": "nombre",
+    "nombreTitular": "titular",
+    "startDateFechaP": "fecha",
+    "endDateFechaP": "fecha",
+}
+
+TEXTO_LINK_EXCEL = "Descargar en formato Excel"
+_RE_ID_EXPEDIENTE = re.compile(r"id_expediente=(\d+)")
+_FIRMA_XLSX = b"PK\x03\x04"
+
+
+class BusquedaNoResuelta(Exception):
+    """La búsqueda por HTTP no entregó un resultado interpretable (usar Chrome)."""
+
+
+def _leer_formulario(html, url_pagina):
+    soup = BeautifulSoup(html, 'lxml')
+    campo = soup.find(id="projectName")
+    form = campo.find_parent("form") if campo else None
+    if form is None:
+        raise BusquedaNoResuelta("No se encontró el formulario de búsqueda")
+
+    datos = {}
+    for inp in form.find_all("input"):
+        nombre, tipo = inp.get("name"), (inp.get("type") or "text").lower()
+        if not nombre or tipo in ("submit", "button", "image", "reset", "file"):
+            continue
+        if tipo in ("checkbox", "radio") and not inp.has_attr("checked"):
+            continue
+        datos[nombre] = inp.get("value", "")
+    for sel in form.find_all("select"):
+        if sel.get("name"):
+            opcion = sel.find("option", selected=True) or sel.find("option")
+            datos[sel["name"]] = opcion.get("value", opcion.get_text(strip=True)) if opcion else ""
+    for txt in form.find_all("textarea"):
+        if txt.get("name"):
+            datos[txt["name"]] = txt.get_text()
+
+    nombres_por_id = {id_campo: (form.find(id=id_campo) or {}).get("name") for id_campo in CAMPOS_FORMULARIO}
+    accion = urljoin(url_pagina, form.get("action") or url_pagina)
+    metodo = (form.get("method") or "get").lower()
+    return accion, metodo, datos, nombres_por_id
+
+
+def _interpretar_resultados(html, url_resultados):
+    soup = BeautifulSoup(html, 'lxml')
+
+    url_ficha, id_expediente = None, None
+    for a in soup.find_all("a"):
+        destino = (a.get("href") or "") + " " + (a.get("onclick") or "")
+        m = _RE_ID_EXPEDIENTE.search(destino)
+        if m:
+            id_expediente = m.group(1)
+            href = a.get("href") or ""
+            url_ficha = urljoin(url_resultados, href) if _RE_ID_EXPEDIENTE.search(href) else None
+            break
+
+    link_excel = soup.find("a", string=lambda t: t and TEXTO_LINK_EXCEL in t)
+    href_excel = link_excel.get("href") if link_excel else None
+    # "#" o "javascript:" son links que resuelve JavaScript: sin URL real queda para Chrome
+    href_excel = (href_excel or "").strip()
+    url_excel = urljoin(url_resultados, href_excel) if href_excel and not href_excel.startswith("#") \
+        and not href_excel.lower().startswith("javascript:") else None
+
+    if id_expediente is None:
+        # Sin link a la ficha no se distingue "no existe" de "la tabla la dibuja JavaScript": decide Chrome
+        raise BusquedaNoResuelta("La respuesta no trae un link a la ficha (¿sin resultados o tabla dibujada por JavaScript?)")
+
+    if url_ficha is None:
+        url_ficha = f"{SEIA_BASE_URL}/expediente/ficha/fichaPrincipal.php?modo=normal&id_expediente={id_expediente}"
+    return {"sin_resultados": False, "id_expediente": id_expediente, "url_ficha": url_ficha, "url_excel": url_excel}
+
+
+def buscar_proyecto(session, nombre, titular, f_pres):
+    """
+    Equivalente HTTP de scraper.realizar_busqueda. Retorna dict con id_expediente/url_ficha/url_excel
+    (sin_resultados=False); si no hay un resultado claro lanza BusquedaNoResuelta.
+    """
+    res = descargas.get_con_reintentos(session, URL_BUSQUEDA, timeout=30)
+    if res.status_code != 200:
+        raise BusquedaNoResuelta(f"HTTP {res.status_code} en el formulario de búsqueda")
+    accion, metodo, datos, nombres_por_id = _leer_formulario(res.text, res.url)
+
+    criterios = {"nombre": nombre, "titular": titular, "fecha": f_pres}
+    for id_campo, clave in CAMPOS_FORMULARIO.items():
+        datos[nombres_por_id.get(id_campo) or id_campo] = criterios[clave]
+
+    headers = {"Referer": res.url}
+    if metodo == "post":
+        res = session.post(accion, data=datos, headers=headers, timeout=30)
+    else:
+        res = descargas.get_con_reintentos(session, accion, params=datos, headers=headers, timeout=30)
+    if res.status_code != 200:
+        raise BusquedaNoResuelta(f"HTTP {res.status_code} al buscar")
+    return _interpretar_resultados(res.text, res.url)
+
+
+def _nombre_desde_respuesta(res, por_defecto):
+    disposicion = res.headers.get("Content-Disposition", "")
+    m = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', disposicion)
+    nombre = os.path.basename(m.group(1)) if m else por_defecto
+    return nombre if nombre.lower().endswith(".xlsx") else f"{nombre}.xlsx"
+
+
+def descargar_excel(session, url_excel, download_dir):
+    """
+    Descarga el Excel de la búsqueda a download_dir. Retorna la ruta local, o None si la
+    respuesta no es un .xlsx (ej: una página HTML de error o de sesión expirada con status 200).
+    """
+    # retener: el cupo del host se libera recién con el archivo ya escrito
+    with descargas.get_con_reintentos(session, url_excel, stream=True, timeout=60, retener=True) as res:
+        try:
+            if res.status_code != 200 or "html" in res.headers.get("Content-Type", "").lower():
+                return None
+            ruta = os.path.join(download_dir, _nombre_desde_respuesta(res, "resultado_busqueda.xlsx"))
+            with open(ruta, "wb") as f:
+                for bloque in res.iter_content(chunk_size=64 * 1024):
+                    f.write(bloque)
+        finally:
+            res.liberar_cupo()
+    # Un .xlsx es un ZIP: cualquier otra cosa no le sirve a leer_fila_excel
+    with open(ruta, "rb") as f:
+        es_xlsx = f.read(4) == _FIRMA_XLSX
+    if not es_xlsx:
+        os.remove(ruta)
+        return None
+    return ruta
+
+
+def obtener_ficha(session, url_ficha):
+    """HTML de la ficha principal y la URL final (tras redirecciones)."""
+    res = descargas.get_con_reintentos(session, url_ficha, timeout=30)
+    if res.status_code != 200:
+        raise BusquedaNoResuelta(f"HTTP {res.status_code} en la ficha")
+    return res.text, res.url
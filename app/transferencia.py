@@ -0,0 +1,146 @@
+import io
+import os
+import base64
+import hashlib
+
+import google_crc32c
+
+# ==========================================
+# SUBIDA EN STREAMING HTTP -> GCS
+# ==========================================
+# Conecta el cuerpo de una respuesta HTTP (stream=True) directamente con una
+# subida resumable de GCS en bloques de tamaño fijo. La memoria queda acotada
+# por CHUNK_SIZE sin importar el tamaño del documento, y el MD5/CRC32C se
+# calculan al vuelo para verificarlos contra lo que informa GCS.
+
+# GCS exige bloques múltiplos de 256 KB en subidas resumables
+_UNIDAD_GCS = 256 * 1024
+CHUNK_SIZE = max(1, int(os.getenv("GCS_CHUNK_MB", "8")) * 4) * _UNIDAD_GCS
+
+
+class ErrorIntegridad(Exception):
+    """El checksum calculado localmente no coincide con el informado por GCS."""
+
+
+class LectorConHash(io.RawIOBase):
+    """
+    Envuelve `response.raw` como archivo de solo lectura que calcula MD5, SHA-256 y CRC32C mientras se lee.
+    Conserva el último bloque leído para que la subida resumable pueda retroceder
+    (recover()) dentro de ese bloque sin volver a pedirlo a la red.
+    """
+
+    def __init__(self, raw):
+        super().__init__()
+        self._raw = raw
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._crc = google_crc32c.Checksum()
+        self._pos = 0            # posición lógica para tell()
+        self._leidos = 0         # bytes consumidos desde la red (y ya hasheados)
+        self._ultimo = b""       # último bloque entregado
+        self._inicio_ultimo = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence != io.SEEK_SET or not (self._inicio_ultimo <= offset <= self._leidos):
+            raise io.UnsupportedOperation("Solo se puede retroceder dentro del último bloque leído")
+        self._pos = offset
+        return self._pos
+
+    def _leer_red(self, size):
+        # urllib3 puede entregar menos bytes de los pedidos: juntamos hasta completar el bloque o EOF
+        partes, faltan = [], size
+        while faltan > 0:
+            dato = self._raw.read(faltan, decode_content=True)
+            if not dato:
+                break
+            partes.append(dato)
+            faltan -= len(dato)
+        return b"".join(partes)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+
+        # Relectura de un bloque ya entregado (tras un recover de la subida)
+        if self._pos < self._leidos:
+            desde = self._pos - self._inicio_ultimo
+            dato = self._ultimo[desde:desde + size]
+            self._pos += len(dato)
+            return dato
+
+        dato = self._leer_red(size)
+        if dato:
+            self._md5.update(dato)
+            self._sha256.update(dato)
+            self._crc.update(dato)
+            self._inicio_ultimo = self._leidos
+            self._ultimo = dato
+            self._leidos += len(dato)
+            self._pos = self._leidos
+        return dato
+
+    @property
+    def total_bytes(self):
+        return self._leidos
+
+    @property
+    def md5_b64(self):
+        return base64.b64encode(self._md5.digest()).decode("ascii")
+
+    @property
+    def sha256_hex(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def crc32c_b64(self):
+        return base64.b64encode(self._crc.digest()).decode("ascii")
+
+
+def hashes_de_bytes(contenido):
+    """MD5 y CRC32C en base64 (mismo formato que GCS) para contenido ya en memoria."""
+    md5_b64 = base64.b64encode(hashlib.md5(contenido).digest()).decode("ascii")
+    crc32c_b64 = base64.b64encode(google_crc32c.Checksum(contenido).digest()).decode("ascii")
+    return md5_b64, crc32c_b64
+
+
+def _verificar(blob, md5_b64, crc32c_b64):
+    # Subidas compuestas no traen md5Hash; en ese caso basta el CRC32C
+    if blob.crc32c is None and blob.md5_hash is None:
+        blob.reload()
+    if (blob.md5_hash and blob.md5_hash != md5_b64) or (blob.crc32c and blob.crc32c != crc32c_b64):
+        try: blob.delete()
+        except Exception: pass
+        raise ErrorIntegridad(f"Checksum no coincide para gs://{blob.bucket.name}/{blob.name}")
+
+
+def subir_respuesta_streaming(res, blob, content_type, chunk_size=CHUNK_SIZE):
+    """
+    Sube el cuerpo de `res` (requests, stream=True) a `blob` sin cargarlo completo en memoria.
+    Documentos más chicos que un bloque van en una sola petición simple.
+    Retorna dict con bytes, md5 y crc32c (base64) y sha256 (hex). Lanza ErrorIntegridad si GCS no coincide.
+    """
+    largo = res.headers.get("Content-Length")
+    if largo and largo.isdigit() and int(largo) <= chunk_size:
+        contenido = res.raw.read(decode_content=True)
+        md5_b64, crc32c_b64 = hashes_de_bytes(contenido)
+        sha256_hex = hashlib.sha256(contenido).hexdigest()
+        blob.upload_from_string(contenido, content_type=content_type)
+        total = len(contenido)
+    else:
+        lector = LectorConHash(res.raw)
+        blob.chunk_size = chunk_size
+        blob.upload_from_file(lector, content_type=content_type)
+        md5_b64, crc32c_b64, total = lector.md5_b64, lector.crc32c_b64, lector.total_bytes
+        sha256_hex = lector.sha256_hex
+
+    _verificar(blob, md5_b64, crc32c_b64)
+    return {"bytes": total, "md5": md5_b64, "crc32c": crc32c_b64, "sha256": sha256_hex}
@@ -1,5 +1,11 @@
+import html
+import zlib
+
 import streamlit as st
+import numpy as np
+import pandas as pd
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 
 def inyectar_estilos():
@@ -13,15 +19,79 @@ def inyectar_estilos():
         </style>
     """, unsafe_allow_html=True)
 
-def renderizar_mapa(lat, lon, df_resultados=None):
+# Color fijo por estado_proyecto: el mismo estado conserva su color aunque cambien los resultados.
+# Un estado que no está en la lista toma un color de la paleta según su nombre (también estable).
+COLORES_ESTADO = {
+    "Aprobado": "#16A34A",
+    "Rechazado": "#DC2626",
+    "En Calificación": "#F59E0B",
+    "En Admisión": "#0891B2",
+    "No Admitido a Tramitación": "#DB2777",
+    "Desistido": "#7C3AED",
+    "Abandonado": "#65A30D",
+    "Revocado": "#9F1239",
+    "Caducado": "#A16207",
+    "Sin estado": "#64748B",
+}
+PALETA_ESTADOS = ["#1E40AF", "#16A34A", "#DC2626", "#F59E0B", "#7C3AED", "#0891B2", "#DB2777", "#65A30D", "#64748B"]
+
+
+def color_estado(estado):
+    if estado in COLORES_ESTADO:
+        return COLORES_ESTADO[estado]
+    return PALETA_ESTADOS[zlib.crc32(str(estado).encode("utf-8")) % len(PALETA_ESTADOS)]
+
+# Cada punto llega como [lat, lon, color, popup]; Leaflet lo dibuja dentro del cluster
+_CALLBACK_PUNTO = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 5, color: row[2], fillColor: row[2], fillOpacity: 0.8, weight: 1});
+    marker.bindPopup(row[3]);
+    return marker;
+};
+"""
+
+
+def _clave_resultados(df_resultados):
+    if df_resultados is None or df_resultados.empty:
+        return None
+    cols = df_resultados[['id', 'latitud', 'longitud', 'estado_proyecto']]
+    return int(pd.util.hash_pandas_object(cols, index=False).sum()), len(cols)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _construir_mapa(lat, lon, clave, _df_resultados):
+    """Mapa folium armado una vez por (punto, set de resultados); los reruns lo reutilizan."""
     m = folium.Map(location=[lat, lon], zoom_start=11, tiles="cartodbpositron")
     folium.Marker([lat, lon], icon=folium.Icon(color='red')).add_to(m)
-    
-    if df_resultados is not None:
-        for _, r in df_resultados.iterrows():
-            folium.CircleMarker([r['latitud'], r['longitud']], radius=4, color='blue', fill=True).add_to(m)
-    
-    return st_folium(m, width="100%", height=300, key="mapa_final")
+    if clave is None:
+        return m
+
+    df = _df_resultados.dropna(subset=['latitud', 'longitud'])
+    estados = pd.Categorical(df['estado_proyecto'].fillna("Sin estado"))
+    colores = np.array([color_estado(e) for e in estados.categories], dtype=object)
+
+    # Capa en un solo arreglo (sin loop por fila): el cluster solo dibuja lo visible
+    datos = pd.DataFrame({
+        'lat': df['latitud'].astype(float).to_numpy(),
+        'lon': df['longitud'].astype(float).to_numpy(),
+        'color': colores[estados.codes],
+        'popup': (df['nombre_original'].astype(str).str.slice(0, 120)
+                  .str.replace('&', '&amp;').str.replace('<', '&lt;').str.replace('>', '&gt;').to_numpy()),
+    }).values.tolist()
+    FastMarkerCluster(datos, callback=_CALLBACK_PUNTO, disableClusteringAtZoom=13, spiderfyOnMaxZoom=False).add_to(m)
+
+    leyenda = "".join(f'<div><span style="color:{c}">●</span> {html.escape(str(e))}</div>'
+                      for e, c in zip(estados.categories, colores))
+    m.get_root().html.add_child(folium.Element(
+        f'<div style="position:fixed; bottom:12px; left:12px; z-index:9999; background:white; '
+        f'padding:6px 10px; border-radius:6px; font-size:12px; box-shadow:0 1px 4px #0003">{leyenda}</div>'))
+    return m
+
+
+def renderizar_mapa(lat, lon, df_resultados=None):
+    m = _construir_mapa(lat, lon, _clave_resultados(df_resultados), df_resultados)
+    # Sin objetos de retorno: mover o hacer zoom no dispara reruns de la app
+    return st_folium(m, width="100%", height=300, key="mapa_final", returned_objects=[])
 
 # ui_components.py (Añadir esta función)
 
@@ -0,0 +1,166 @@
+import os
+import gc
+import time
+import socket
+import threading
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from google.cloud import bigquery
+
+import cola_trabajos as cola
+import motor_lotes
+import data_manager as dm
+
+# ==========================================
+# WORKER DE SCRAPING (PROCESO INDEPENDIENTE)
+# ==========================================
+# Uso: python worker.py [--concurrencia 3] [--una-vez]
+# Drena la cola SQLite (cola_trabajos.py) con una concurrencia controlada,
+# independiente de la sesión de Streamlit.
+
+PROJECT_ID = os.getenv("PROJECT_ID", "geo-ambiental-482615")
+BQ_TABLE_PATH = os.getenv("BQ_TABLE_PATH", "geo-ambiental-482615.dataset_ambiental.seia_limpio")
+INTERVALO_SONDEO = float(os.getenv("WORKER_INTERVALO_SONDEO", "5"))
+# Las filas para seia_limpio se juntan y se aplican en un solo MERGE por lote
+LOTE_BQ_FILAS = int(os.getenv("WORKER_LOTE_BQ_FILAS", "25"))
+LOTE_BQ_SEGUNDOS = float(os.getenv("WORKER_LOTE_BQ_SEGUNDOS", "60"))
+LOTE_BQ_INTENTOS = 3
+# Cada cuánto se renueva el lease de un proyecto en curso (un scrape grande dura más que el lease)
+INTERVALO_LATIDO = float(os.getenv("WORKER_INTERVALO_LATIDO", str(max(cola.LEASE_SEGUNDOS / 3, 5))))
+
+
+class LoteActualizaciones:
+    """
+    Aplica a BigQuery, por lote, las filas de proyectos exitosos. Las filas viven en la
+    cola SQLite (tabla filas_bq, ver cola.finalizar_proyecto): solo se borran cuando el
+    MERGE confirma, así que una caída del worker o de BigQuery no pierde actualizaciones.
+    """
+
+    def __init__(self, bq_client):
+        self.bq_client = bq_client
+
+    def toca_enviar(self, conn):
+        n, antiguedad = cola.antiguedad_filas_bq(conn, LOTE_BQ_INTENTOS)
+        return n >= LOTE_BQ_FILAS or (n and antiguedad >= LOTE_BQ_SEGUNDOS)
+
+    def hay_pendientes(self, conn):
+        return cola.antiguedad_filas_bq(conn, LOTE_BQ_INTENTOS)[0] > 0
+
+    def enviar(self, conn):
+        lote = cola.filas_bq_pendientes(conn, LOTE_BQ_INTENTOS, limite=LOTE_BQ_FILAS * 4)
+        if not lote:
+            return
+        ids = [item_id for item_id, _ in lote]
+        ok, msg = dm.actualizar_lote(self.bq_client, BQ_TABLE_PATH, [fila for _, fila in lote])
+        print(f"   [WORKER] BigQuery lote de {len(lote)}: {msg}", flush=True)
+        if ok:
+            cola.confirmar_filas_bq(conn, ids)
+            return
+        # Se reintenta en los próximos envíos; agotados los intentos la fila queda guardada
+        # (y anotada) hasta que un worker vuelva a arrancar
+        cola.fallo_filas_bq(conn, ids, msg)
+        agotadas = set(ids) - {i for i, _ in cola.filas_bq_pendientes(conn, LOTE_BQ_INTENTOS)}
+        for item_id in agotadas:
+            cola.anotar_resultado(conn, item_id, f"⚠️ Error BQ (pendiente, se reintenta al reiniciar el worker): {msg}")
+
+
+def _latido(item_id, worker_id, detener):
+    """Renueva el lease mientras procesar_proyecto corre, para que otro worker no lo tome."""
+    conn = cola.conectar()
+    try:
+        while not detener.wait(INTERVALO_LATIDO):
+            try:
+                if not cola.renovar_lease(conn, item_id, worker_id):
+                    print(f"   [WORKER] ⚠️ El lease del ítem {item_id} ya no es de este worker.", flush=True)
+                    return
+            except Exception as e:
+                print(f"   [WORKER] ⚠️ No se pudo renovar el lease del ítem {item_id}: {e}", flush=True)
+    finally:
+        conn.close()
+
+
+def _procesar_item(item, pool, lote_bq, dir_resultados, worker_id):
+    conn = cola.conectar()  # una conexión SQLite por hilo
+    proyecto = item['proyecto']
+    detener_latido = threading.Event()
+    threading.Thread(target=_latido, args=(item['id'], worker_id, detener_latido), daemon=True).start()
+    try:
+        res, logs, excel_path = motor_lotes.procesar_proyecto(pool, proyecto, item['bucket'], dir_resultados)
+
+        if "✅ EXITOSO" in res:
+            fila = None
+            if excel_path:
+                try:
+                    fila = dm.leer_fila_excel(proyecto['id'], excel_path)
+                    if fila is None:
+                        res = f"{res}|⚠️ Error BQ: Excel vacío"
+                except Exception as e:
+                    res = f"{res}|⚠️ Error BQ: Error en procesamiento de datos: {e}"
+            # La fila queda en SQLite junto con el estado; recién entonces se borra el Excel
+            cola.finalizar_proyecto(conn, item['id'], cola.EXITOSO, res, logs, fila_bq=fila)
+            if excel_path and os.path.exists(excel_path): os.remove(excel_path)
+        elif "⚠️ SIN RESULTADOS" in res:
+            cola.finalizar_proyecto(conn, item['id'], cola.SIN_RESULTADOS, res, logs)
+        else:
+            cola.liberar_proyecto(conn, item['id'], res, logs)
+
+        print(f"   [WORKER] {proyecto['id']} (intento {item['intentos']}): {res.split('|')[0]}", flush=True)
+    except Exception as e:
+        cola.liberar_proyecto(conn, item['id'], f"❌ ERROR: {e}", traceback.format_exc())
+    finally:
+        detener_latido.set()
+        conn.close()
+        gc.collect()
+
+
+def ejecutar_worker(concurrencia=motor_lotes.MAX_WORKERS_DEFECTO, una_vez=False):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"🛠️ [WORKER] {worker_id} iniciado (concurrencia={concurrencia}, cola={cola.DB_PATH})", flush=True)
+
+    conn = cola.conectar()
+    reactivadas = cola.reactivar_filas_bq(conn)
+    if reactivadas:
+        print(f"   [WORKER] {reactivadas} filas pendientes para BigQuery de una ejecución anterior.", flush=True)
+    lote_bq = LoteActualizaciones(bigquery.Client(project=PROJECT_ID))
+    base_dir = motor_lotes.directorio_base()
+    dir_resultados = os.path.join(base_dir, "resultados")
+    os.makedirs(dir_resultados, exist_ok=True)
+    pool = motor_lotes.PoolDrivers(concurrencia, base_dir)
+
+    activos = set()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrencia) as ex:
+            while True:
+                # Llenamos los puestos libres con trabajo de la cola
+                while len(activos) < concurrencia:
+                    item = cola.tomar_siguiente(conn, worker_id)
+                    if item is None:
+                        break
+                    activos.add(ex.submit(_procesar_item, item, pool, lote_bq, dir_resultados, worker_id))
+
+                if lote_bq.toca_enviar(conn) or (not activos and lote_bq.hay_pendientes(conn)):
+                    lote_bq.enviar(conn)
+
+                if not activos:
+                    if una_vez and not lote_bq.hay_pendientes(conn):
+                        break
+                    time.sleep(INTERVALO_SONDEO)
+                    continue
+
+                _, activos = wait(activos, timeout=INTERVALO_SONDEO, return_when=FIRST_COMPLETED)
+    except KeyboardInterrupt:
+        print("🛑 [WORKER] Detenido por el usuario.", flush=True)
+    finally:
+        lote_bq.enviar(conn)
+        pool.cerrar()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de scraping SEIA")
+    parser.add_argument("--concurrencia", type=int, default=motor_lotes.MAX_WORKERS_DEFECTO)
+    parser.add_argument("--una-vez", action="store_true", help="Termina cuando la cola queda vacía")
+    args = parser.parse_args()
+    ejecutar_worker(args.concurrencia, args.una_vez)
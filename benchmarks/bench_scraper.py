@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import resource
+import contextlib
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seia_replay import ConfigReplay, iniciar_en_hilo, nombre_proyecto
+
+# ==========================================
+# BENCHMARK DEL SCRAPER CONTRA EL SEIA LOCAL
+# ==========================================
+# Corre el pipeline completo contra seia_replay.py (sin red ni GCS) y reporta
+# docs/s, MB/s, RSS máximo y el desglose por etapa de RegistroTiempos.
+#
+# Escenarios:
+#   proyecto      ejecutar_scrapping completo (búsqueda, ficha, detalle, expediente, JSONL)
+#   expediente    solo procesar_expediente_evaluacion (listado + descarga concurrente)
+#   revalidacion  ejecutar_scrapping por segunda vez sobre el mismo almacén (GET condicionales / CAS)
+#
+# Cada escenario corre en un proceso nuevo: así el RSS máximo es el suyo y no
+# arrastra cachés del anterior. El servidor corre en este proceso.
+#
+#   python benchmarks/bench_scraper.py --tamanos 10,100,1000 --latencia-ms 30 --json bench.json
+#   python benchmarks/bench_scraper.py --base bench.json --tolerancia 0.2   # exit 1 si hay regresión
+#
+# Con --cache-http 1 los escenarios usan la caché HTTP en disco (cache_http.py), compartida
+# por toda la corrida. Para medir sin red: se puebla una vez con un puerto fijo y luego
+#   python benchmarks/bench_scraper.py --puerto 8765 --cache-http offline --dir-cache-http ./cache_bench
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+ESCENARIOS = ("proyecto", "expediente", "revalidacion")
+BUCKET_BENCH = "bench"
+
+
+def _rss_max_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo informa en KB, macOS en bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _resultado_fallido(error):
+    return {"duracion_s": 0.0, "docs": 0, "docs_ok": 0, "rss_max_mb": _rss_max_mb(), "etapas": {},
+            "contadores": {}, "cache_http": {}, "error": error}
+
+
+def _correr_escenario(escenario, n_docs, id_expediente, url_base, dir_almacen, dir_descargas, cache, cola):
+    """Proceso hijo: mide un escenario y siempre deja un resultado en `cola` (con 'error' si falló)."""
+    resultado = None
+    try:
+        resultado = _medir_escenario(escenario, n_docs, id_expediente, url_base, dir_almacen, dir_descargas, cache)
+    except BaseException as e:
+        resultado = _resultado_fallido(f"{type(e).__name__}: {e}")
+    finally:
+        cola.put(resultado or _resultado_fallido("sin resultado"))
+
+
+def _medir_escenario(escenario, n_docs, id_expediente, url_base, dir_almacen, dir_descargas, cache):
+    """Configura el entorno, importa el scraper y mide un escenario. Retorna el dict de resultados."""
+    os.environ.update({
+        "CACHE_HTTP": cache["modo"],
+        "CACHE_HTTP_DIR": cache["dir"],
+        "SEIA_BASE_URL": url_base,
+        "STORAGE_BACKEND": "local",
+        "STORAGE_LOCAL_DIR": dir_almacen,
+        "SCRAPER_MODO_BUSQUEDA": "http",
+        "SCRAPER_MODO_DETALLE": "http",
+        "SCRAPER_INCREMENTAL": "0",
+    })
+    sys.path.insert(0, APP_DIR)
+    verbose = os.getenv("BENCH_VERBOSE") == "1"
+    salida = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+
+    with salida:
+        import scraper
+        import descargas
+        import seia_http
+        import almacenamiento
+        import almacen_cas
+        import cache_http
+        from manifiesto import ManifiestoProyecto
+        from metricas import RegistroTiempos
+
+        tiempos = RegistroTiempos()
+        id_proyecto = f"bench_{id_expediente}"
+        docs_ficha = n_docs // 10 if escenario != "expediente" else 0
+        nombre = nombre_proyecto(id_expediente, docs_ficha, n_docs - docs_ficha)
+        error = None
+
+        if escenario == "expediente":
+            session = descargas.crear_sesion(headers={"User-Agent": scraper.USER_AGENT})
+            resultado = seia_http.buscar_proyecto(session, nombre, "Titular Bench", "01/01/2024")
+            bucket = almacenamiento.obtener_bucket(BUCKET_BENCH)
+            cas = almacen_cas.AlmacenCAS(bucket) if almacen_cas.USAR_CAS else None
+            params_base = {"proyecto_id": id_proyecto, "nombre_proyecto": nombre}
+            t0 = time.perf_counter()
+            with tiempos.etapa("expediente"):
+                docs, _, registros = scraper.procesar_expediente_evaluacion(
+                    None, None, bucket, id_proyecto, None, None, params_base,
+                    manifiesto=ManifiestoProyecto(bucket, id_proyecto), url_ficha=resultado["url_ficha"],
+                    session=session, cas=cas, tiempos=tiempos)
+            duracion = time.perf_counter() - t0
+            completados = len(registros)
+        else:
+            if escenario == "revalidacion":
+                # Primera pasada (no se mide): deja el almacén y la caché por URL poblados
+                scraper.ejecutar_scrapping(id_proyecto, nombre, "Titular Bench", "01/01/2024",
+                                           bucket_name=BUCKET_BENCH, download_dir=dir_descargas)
+                descargas.crear_sesion().get(f"{url_base}/_bench/reiniciar", timeout=10)
+            t0 = time.perf_counter()
+            estado, _, _ = scraper.ejecutar_scrapping(id_proyecto, nombre, "Titular Bench", "01/01/2024",
+                                                      bucket_name=BUCKET_BENCH, download_dir=dir_descargas,
+                                                      tiempos=tiempos)
+            duracion = time.perf_counter() - t0
+            if estado.startswith("✅"):
+                docs = int(estado.split("|")[3])
+            else:
+                docs, error = 0, estado
+            completados = docs
+
+    return {
+        "duracion_s": duracion,
+        "docs": docs,
+        "docs_ok": completados,
+        "rss_max_mb": _rss_max_mb(),
+        "etapas": {k: round(v["total_s"], 3) for k, v in tiempos.totales().items()},
+        "contadores": dict(tiempos.contadores),
+        "cache_http": cache_http.estadisticas(),
+        "error": error,
+    }
+
+
+def correr(escenario, n_docs, id_expediente, servidor, cache):
+    """Mide un escenario en un proceso nuevo. Retorna el dict de resultados."""
+    with tempfile.TemporaryDirectory(prefix="bench_almacen_") as dir_almacen, \
+            tempfile.TemporaryDirectory(prefix="bench_descargas_") as dir_descargas:
+        ctx = mp.get_context("spawn")
+        cola = ctx.Queue()
+        proceso = ctx.Process(target=_correr_escenario,
+                              args=(escenario, n_docs, id_expediente, servidor.url, dir_almacen, dir_descargas, cache, cola))
+        servidor.reiniciar()
+        proceso.start()
+        resultado = None
+        while resultado is None:
+            try:
+                resultado = cola.get(timeout=1)
+            except queue.Empty:
+                if not proceso.is_alive():
+                    # Murió sin pasar por el finally (ej: señal, sin memoria): lo que alcanzó a dejar o un error
+                    try:
+                        resultado = cola.get(timeout=1)
+                    except queue.Empty:
+                        resultado = _resultado_fallido(f"el proceso terminó sin resultado (exitcode {proceso.exitcode})")
+        proceso.join()
+
+        stats = servidor.estadisticas()
+        duracion = resultado["duracion_s"] or 1e-9
+        resultado.update({
+            "escenario": escenario,
+            "n_docs": n_docs,
+            "docs_s": resultado["docs_ok"] / duracion,
+            "mb_s": stats["bytes"] / duracion / (1024 * 1024),
+            "peticiones": stats["peticiones"],
+            "errores_http": stats["errores"],
+            "no_modificados": stats["no_modificados"],
+        })
+        return resultado
+
+
+def _clave(r):
+    return f"{r['escenario']}/{r['n_docs']}"
+
+
+def imprimir(resultados):
+    print(f"\n{'escenario':<14}{'docs':>6}{'seg':>9}{'docs/s':>9}{'MB/s':>8}{'RSS MB':>9}{'5xx':>6}{'304':>6}")
+    for r in resultados:
+        print(f"{r['escenario']:<14}{r['n_docs']:>6}{r['duracion_s']:>9.2f}{r['docs_s']:>9.1f}{r['mb_s']:>8.1f}"
+              f"{r['rss_max_mb']:>9.0f}{r['errores_http']:>6.0f}{r['no_modificados']:>6.0f}")
+        if r["error"]:
+            print(f"   ❌ {r['error']}")
+        etapas = ", ".join(f"{k}={v:.2f}s" for k, v in r["etapas"].items())
+        print(f"   ⏱️ {etapas}")
+        if r.get("contadores"):
+            print("   🔢 " + ", ".join(f"{k}={v}" for k, v in sorted(r["contadores"].items())))
+        if r.get("cache_http"):
+            print("   🗄️ " + ", ".join(f"{k}={v}" for k, v in sorted(r["cache_http"].items())))
+
+
+def comparar(resultados, ruta_base, tolerancia):
+    """Compara contra un JSON previo. Retorna la lista de regresiones (texto)."""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = {_clave(r): r for r in json.load(f)["resultados"]}
+    regresiones = []
+    for r in resultados:
+        b = base.get(_clave(r))
+        if not b:
+            continue
+        if r["docs_s"] < b["docs_s"] * (1 - tolerancia):
+            regresiones.append(f"{_clave(r)}: docs/s {b['docs_s']:.1f} -> {r['docs_s']:.1f}")
+        if r["rss_max_mb"] > b["rss_max_mb"] * (1 + tolerancia):
+            regresiones.append(f"{_clave(r)}: RSS {b['rss_max_mb']:.0f} MB -> {r['rss_max_mb']:.0f} MB")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del scraper contra el SEIA local.")
+    parser.add_argument("--tamanos", default="10,100,1000", help="Documentos por proyecto, separados por coma.")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--latencia-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--kb-doc", type=int, default=200)
+    parser.add_argument("--fraccion-compartida", type=float, default=0.0)
+    parser.add_argument("--grabaciones", default=None)
+    parser.add_argument("--cache-http", default="0", choices=("0", "1", "offline"), help="Modo de CACHE_HTTP en los escenarios.")
+    parser.add_argument("--dir-cache-http", default=None, help="Directorio de la caché HTTP (por defecto uno temporal).")
+    parser.add_argument("--puerto", type=int, default=0, help="Puerto fijo del SEIA local (la caché HTTP se indexa por URL).")
+    parser.add_argument("--json", default=None, help="Guarda los resultados en este archivo.")
+    parser.add_argument("--base", default=None, help="JSON de una corrida anterior para detectar regresiones.")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args()
+
+    config = ConfigReplay(args.latencia_ms, args.jitter_ms, args.tasa_error, args.kb_doc,
+                          fraccion_compartida=args.fraccion_compartida, grabaciones=args.grabaciones)
+    servidor = iniciar_en_hilo(config, puerto=args.puerto)
+    print(f"🛰️ SEIA local en {servidor.url}", flush=True)
+
+    dir_temporal = None
+    if args.cache_http != "0" and not args.dir_cache_http:
+        dir_temporal = tempfile.TemporaryDirectory(prefix="bench_cache_http_")
+    cache = {"modo": args.cache_http, "dir": args.dir_cache_http or (dir_temporal.name if dir_temporal else "")}
+
+    resultados = []
+    try:
+        id_expediente = 900000
+        for escenario in [e.strip() for e in args.escenarios.split(",") if e.strip()]:
+            if escenario not in ESCENARIOS:
+                parser.error(f"Escenario desconocido: {escenario}")
+            for n_docs in [int(t) for t in args.tamanos.split(",") if t.strip()]:
+                id_expediente += 1
+                print(f"⏳ {escenario} con {n_docs} documentos...", flush=True)
+                resultados.append(correr(escenario, n_docs, str(id_expediente), servidor, cache))
+    finally:
+        servidor.shutdown()
+        if dir_temporal:
+            dir_temporal.cleanup()
+
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": vars(args), "resultados": resultados},
+                      f, ensure_ascii=False, indent=1)
+        print(f"\n💾 Resultados en {args.json}")
+
+    if args.base:
+        regresiones = comparar(resultados, args.base, args.tolerancia)
+        if regresiones:
+            print("\n🚨 Regresiones respecto de la base:")
+            for r in regresiones:
+                print(f"   - {r}")
+            return 1
+        print("\n✅ Sin regresiones respecto de la base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from html import escape
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+# ==========================================
+# SEIA LOCAL PARA PRUEBAS Y BENCHMARKS
+# ==========================================
+# Servidor HTTP que imita las páginas que usa el scraper:
+#   /busqueda/buscarProyecto.php            formulario y resultados de la búsqueda
+#   /busqueda/exportarExcel.php             Excel de resultados
+#   /expediente/ficha/fichaPrincipal.php    ficha principal (td.td-primary a)
+#   /expediente/xhr_documentos.php          listado del expediente (table#tbldocumentos)
+#   /documentos/...                         documentos (PDF o HTML, con ETag)
+#
+# Los proyectos son sintéticos: el nombre buscado los describe,
+# "bench-<id_expediente>-<docs_ficha>-<docs_expediente>", y la búsqueda deja
+# registrados sus tamaños para la ficha y el listado. Con --grabaciones
+# se responden primero las respuestas grabadas del sitio real (ver `grabar`), y lo
+# que no esté grabado cae en el generador sintético.
+#
+#   python benchmarks/seia_replay.py --puerto 8765 --latencia-ms 40 --tasa-error 0.02
+#   SEIA_BASE_URL=http://127.0.0.1:8765 STORAGE_BACKEND=local python app/worker.py
+#
+# /_bench/estadisticas entrega peticiones, bytes y errores servidos (JSON);
+# /_bench/reiniciar los pone en cero.
+
+RE_NOMBRE_BENCH = re.compile(r"bench-(\d+)-(\d+)-(\d+)", re.IGNORECASE)
+SEIA_REAL = "https://seia.sea.gob.cl"
+
+
+def nombre_proyecto(id_expediente, docs_ficha, docs_expediente):
+    """Nombre a buscar para que el servidor entregue ese proyecto sintético."""
+    return f"bench-{id_expediente}-{docs_ficha}-{docs_expediente}"
+
+
+class ConfigReplay:
+
+    def __init__(self, latencia_ms=0, jitter_ms=0, tasa_error=0.0, kb_doc=200, fraccion_html=0.1,
+                 fraccion_compartida=0.0, semilla=0, grabaciones=None):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tasa_error = tasa_error              # fracción de respuestas 503 (solo documentos y listado)
+        self.kb_doc = kb_doc
+        self.fraccion_html = fraccion_html        # documentos que responden HTML en vez de PDF
+        self.fraccion_compartida = fraccion_compartida  # documentos con el mismo contenido entre proyectos
+        self.semilla = semilla
+        self.grabaciones = grabaciones
+
+
+# ==========================================
+# CONTENIDO SINTÉTICO
+# ==========================================
+
+_FORMULARIO = """<html><body>
+<form id="formBusqueda" action="/busqueda/buscarProyecto.php" method="get">
+  <input type="hidden" name="_paginador_refresh" value="1">
+  <input type="text" id="projectName" name="nombre">
+  <input type="text" id="nombreTitular" name="titular">
+  <input type="text" id="startDateFechaP" name="presentacion_desde">
+  <input type="text" id="endDateFechaP" name="presentacion_hasta">
+  <select name="tipo"><option value="" selected>Todos</option><option value="DIA">DIA</option></select>
+  <input type="submit" value="Buscar">
+</form>
+</body></html>"""
+
+
+def _resultados(nombre):
+    m = RE_NOMBRE_BENCH.search(nombre or "")
+    if not m:
+        return '<html><body><table><tr><td class="dt-empty">No se encontraron resultados</td></tr></table></body></html>'
+    id_exp = m.group(1)
+    return f"""<html><body>
+<a href="/busqueda/exportarExcel.php?proyecto={id_exp}">Descargar en formato Excel</a>
+<table><tr><td><a href="/expediente/ficha/fichaPrincipal.php?modo=normal&id_expediente={id_exp}" target="_blank">{escape(nombre)}</a></td></tr></table>
+</body></html>"""
+
+
+def _ficha(id_exp, docs_ficha):
+    filas = "\n".join(
+        f'<tr><td class="td-primary"><a href="/documentos/ficha/{id_exp}/{k}.pdf">Documento {k} de la ficha</a></td></tr>'
+        for k in range(1, docs_ficha + 1))
+    return f"""<html><body><h1>Ficha del proyecto {id_exp}</h1>
+<table>{filas}</table>
+</body></html>"""
+
+
+def _listado(id_exp, docs_expediente):
+    filas = "\n".join(
+        f"<tr><td>{k}</td><td>Titular</td><td>Documento</td>"
+        f"<td><a href=\"/documentos/expediente/{id_exp}/{k}.pdf\">Resolución {k} expediente {id_exp}</a></td>"
+        f"<td>-</td><td>-</td><td>{1 + k % 28:02d}/{1 + k % 12:02d}/2024</td></tr>"
+        for k in range(1, docs_expediente + 1))
+    return f"""<table id="tbldocumentos">
+<tr><th>N</th><th>Remitente</th><th>Tipo</th><th>Documento</th><th>Folio</th><th>Firma</th><th>Fecha</th></tr>
+{filas}
+</table>"""
+
+
+def _excel(id_exp):
+    buffer = BytesIO()
+    pd.DataFrame([{"Expediente": id_exp, "Nombre": f"Proyecto sintético {id_exp}", "Estado": "En Calificación"}]
+                 ).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def _documento(ruta, config):
+    """Contenido determinista por ruta (o compartido entre proyectos) y su content-type."""
+    rnd = random.Random(f"{config.semilla}:{ruta}")
+    es_html = rnd.random() < config.fraccion_html
+    if rnd.random() < config.fraccion_compartida:
+        # Mismo contenido que el documento de igual número en cualquier proyecto
+        rnd = random.Random(f"{config.semilla}:compartido:{os.path.basename(ruta)}")
+    tamano = max(1, int(config.kb_doc * 1024 * (0.5 + rnd.random())))
+    if es_html:
+        cuerpo = f"<html><body><p>{rnd.getrandbits(64):x}</p>".encode() + b"x" * tamano + b"</body></html>"
+        return cuerpo, "text/html; charset=utf-8"
+    return b"%PDF-1.4\n" + rnd.randbytes(tamano) + b"\n%%EOF\n", "application/pdf"
+
+
+# ==========================================
+# GRABACIONES
+# ==========================================
+# {dir}/indice.json: {"/ruta?query": {"status", "content_type", "archivo"}}
+
+def _clave(ruta, query):
+    return f"{ruta}?{query}" if query else ruta
+
+
+def cargar_grabaciones(directorio):
+    if not directorio:
+        return {}
+    with open(os.path.join(directorio, "indice.json"), encoding="utf-8") as f:
+        indice = json.load(f)
+    return {clave: dict(r, archivo=os.path.join(directorio, r["archivo"])) for clave, r in indice.items()}
+
+
+def grabar(urls, directorio, base=SEIA_REAL):
+    """
+    Descarga `urls` del sitio real y las guarda para reproducirlas. Los links absolutos a `base`
+    en las respuestas de texto quedan relativos, así apuntan al servidor local.
+    """
+    import requests
+    os.makedirs(directorio, exist_ok=True)
+    ruta_indice = os.path.join(directorio, "indice.json")
+    indice = {}
+    if os.path.exists(ruta_indice):
+        with open(ruta_indice, encoding="utf-8") as f:
+            indice = json.load(f)
+
+    session = requests.Session()
+    session.headers["User-Agent"] = "Mozilla/5.0"
+    for url in urls:
+        res = session.get(url, timeout=60)
+        partes = urlparse(url)
+        clave = _clave(partes.path, partes.query)
+        contenido = res.content
+        tipo = res.headers.get("Content-Type", "application/octet-stream")
+        if tipo.startswith("text/") or "json" in tipo:
+            contenido = contenido.replace(base.encode(), b"")
+        archivo = hashlib.sha1(clave.encode()).hexdigest()
+        with open(os.path.join(directorio, archivo), "wb") as f:
+            f.write(contenido)
+        indice[clave] = {"status": res.status_code, "content_type": tipo, "archivo": archivo}
+        print(f"   💾 {res.status_code} {clave} ({len(contenido) / 1024:.0f} KB)")
+
+    with open(ruta_indice, "w", encoding="utf-8") as f:
+        json.dump(indice, f, ensure_ascii=False, indent=1)
+
+
+# ==========================================
+# SERVIDOR
+# ==========================================
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, cuerpo=b"", content_type="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(cuerpo)
+        self.server.contar(status, len(cuerpo))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        servidor, config = self.server, self.server.config
+        partes = urlparse(self.path)
+        ruta, params = partes.path, parse_qs(partes.query)
+
+        if ruta == "/_bench/estadisticas":
+            cuerpo = json.dumps(servidor.estadisticas()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            return
+        if ruta == "/_bench/reiniciar":
+            servidor.reiniciar()
+            self._responder(204)
+            return
+
+        if config.latencia_ms or config.jitter_ms:
+            time.sleep((config.latencia_ms + random.uniform(0, config.jitter_ms)) / 1000)
+
+        grabada = servidor.grabaciones.get(_clave(ruta, partes.query)) or servidor.grabaciones.get(ruta)
+        if grabada:
+            with open(grabada["archivo"], "rb") as f:
+                self._responder(grabada["status"], f.read(), grabada["content_type"])
+            return
+
+        inyectable = ruta.startswith("/documentos/") or ruta == "/expediente/xhr_documentos.php"
+        if inyectable and config.tasa_error and random.random() < config.tasa_error:
+            self._responder(503, b"Servicio no disponible")
+            return
+
+        id_exp = (params.get("id_expediente") or params.get("proyecto") or [""])[0]
+        if ruta == "/busqueda/buscarProyecto.php":
+            nombre = (params.get("nombre") or [None])[0]
+            if nombre is None:
+                self._responder(200, _FORMULARIO.encode())
+            else:
+                m = RE_NOMBRE_BENCH.search(nombre)
+                if m:
+                    servidor.registrar_proyecto(m.group(1), int(m.group(2)), int(m.group(3)))
+                self._responder(200, _resultados(nombre).encode())
+        elif ruta == "/busqueda/exportarExcel.php":
+            self._responder(200, _excel(id_exp), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            {"Content-Disposition": f'attachment; filename="resultado_{id_exp}.xlsx"'})
+        elif ruta == "/expediente/ficha/fichaPrincipal.php":
+            self._responder(200, _ficha(id_exp, servidor.proyecto(id_exp)[0]).encode())
+        elif ruta == "/expediente/xhr_documentos.php":
+            self._responder(200, _listado(id_exp, servidor.proyecto(id_exp)[1]).encode())
+        elif ruta.startswith("/documentos/"):
+            cuerpo, tipo = _documento(ruta, config)
+            etag = f'"{hashlib.md5(cuerpo).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._responder(304, headers={"ETag": etag})
+            else:
+                self._responder(200, cuerpo, tipo, {"ETag": etag})
+        else:
+            self._responder(404, b"No encontrado")
+
+
+class ServidorReplay(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, config):
+        super().__init__(direccion, _Manejador)
+        self.config = config
+        self.grabaciones = cargar_grabaciones(config.grabaciones)
+        self._proyectos = {}
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    @property
+    def url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def registrar_proyecto(self, id_expediente, docs_ficha, docs_expediente):
+        with self._lock:
+            self._proyectos[id_expediente] = (docs_ficha, docs_expediente)
+
+    def proyecto(self, id_expediente):
+        """Tamaños del proyecto; uno nunca buscado (ej: ficha abierta directo) usa 10 y 10."""
+        with self._lock:
+            return self._proyectos.get(id_expediente, (10, 10))
+
+    def contar(self, status, n_bytes):
+        with self._lock:
+            self._stats["peticiones"] += 1
+            self._stats["bytes"] += n_bytes
+            if status >= 500:
+                self._stats["errores"] += 1
+            elif status == 304:
+                self._stats["no_modificados"] += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reiniciar(self):
+        with self._lock:
+            self._stats = {"peticiones": 0, "bytes": 0, "errores": 0, "no_modificados": 0}
+
+
+def iniciar_en_hilo(config, host="127.0.0.1", puerto=0):
+    """Levanta el servidor en un hilo de fondo y lo retorna (server.url, server.shutdown())."""
+    servidor = ServidorReplay((host, puerto), config)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SEIA local (sintético o grabado) para pruebas y benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--kb-doc", type=int, default=200)
+    parser.add_argument("--fraccion-html", type=float, default=0.1)
+    parser.add_argument("--fraccion-compartida", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--grabaciones", default=None, help="Directorio creado con 'grabar'.")
+    sub = parser.add_subparsers(dest="comando")
+    p_grabar = sub.add_parser("grabar", help="Graba respuestas del sitio real para reproducirlas.")
+    p_grabar.add_argument("--dir", required=True)
+    p_grabar.add_argument("urls", nargs="+")
+    args = parser.parse_args()
+
+    if args.comando == "grabar":
+        grabar(args.urls, args.dir)
+        return
+
+    config = ConfigReplay(args.latencia_ms, args.jitter_ms, args.tasa_error, args.kb_doc, args.fraccion_html,
+                          args.fraccion_compartida, args.semilla, args.grabaciones)
+    servidor = ServidorReplay((args.host, args.puerto), config)
+    print(f"🛰️ SEIA local en {servidor.url} (latencia {args.latencia_ms} ms, errores {args.tasa_error:.0%})", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
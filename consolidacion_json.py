@@ -1,48 +1,138 @@
 import os
-from google.cloud import storage
+import sys
+import json
+import argparse
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+import almacenamiento
+from manifiesto_vertex import EscritorManifiesto, COMPLETO, DELTA
 
 # --- CONFIGURACIÓN ---
-PROJECT_ID = os.getenv("PROJECT_ID", "geo-ambiental-482615") 
+PROJECT_ID = os.getenv("PROJECT_ID", "geo-ambiental-482615")
 BUCKET_NAME = os.getenv("BUCKET_NAME", "almacen_antecedentes_482615")
 OUTPUT_FILE = "metadata_maestra.jsonl"
 OUTPUT_PATH = f"config_search/{OUTPUT_FILE}"
+# Solo el JSONL que deja el scraper en la raíz de cada proyecto
+PATRON_FUENTES = "*/metadata_import.jsonl"
+# Copia normalizada de cada proyecto: el maestro se arma componiendo estas partes
+PREFIJO_PARTES = "config_search/partes/"
+ESTADO_PATH = "config_search/_estado_consolidacion.json"
+HILOS = int(os.getenv("CONSOLIDACION_HILOS", "16"))
+MAX_COMPOSE = 32  # límite de GCS de objetos fuente por compose
+# Manifiesto particionado para Vertex (shards acotados + indice.json)
+PREFIJO_MANIFIESTO = "config_search/metadata_maestra/"
+
+
+def _ruta_parte(nombre_fuente):
+    return f"{PREFIJO_PARTES}{posixpath.dirname(nombre_fuente)}.jsonl"
+
+
+def _cargar_estado(bucket):
+    blob = bucket.blob(ESTADO_PATH)
+    if not blob.exists():
+        return {}
+    try:
+        return json.loads(blob.download_as_text())
+    except Exception as e:
+        print(f"   ⚠️ Estado ilegible, se reconsolida todo: {e}")
+        return {}
+
+
+def _actualizar_parte(bucket, nombre, generacion):
+    """Descarga una versión exacta del JSONL del proyecto y guarda su parte normalizada."""
+    texto = bucket.blob(nombre, generation=generacion).download_as_text().strip()
+    ruta = _ruta_parte(nombre)
+    if not texto:
+        return None
+    # JSONL estricto: cada parte termina en salto de línea para poder concatenarlas
+    bucket.blob(ruta).upload_from_string(texto + "\n", content_type='application/jsonl')
+    return ruta
+
+
+def _componer(bucket, partes, destino):
+    """Compose en árbol (de a 32 fuentes) sin descargar nada; el maestro nunca pasa por memoria."""
+    temporales = []
+    nivel, n_nivel = list(partes), 0
+    try:
+        while len(nivel) > MAX_COMPOSE:
+            siguiente = []
+            for i in range(0, len(nivel), MAX_COMPOSE):
+                tmp = bucket.blob(f"{PREFIJO_PARTES}_tmp/{n_nivel}_{i // MAX_COMPOSE}.jsonl")
+                tmp.compose([bucket.blob(r) for r in nivel[i:i + MAX_COMPOSE]])
+                temporales.append(tmp.name)
+                siguiente.append(tmp.name)
+            nivel, n_nivel = siguiente, n_nivel + 1
+        salida = bucket.blob(destino)
+        salida.content_type = 'application/jsonl'
+        salida.compose([bucket.blob(r) for r in nivel])
+    finally:
+        for nombre in temporales:
+            try:
+                bucket.blob(nombre).delete()
+            except Exception:
+                pass
+
+
+def _registros_de_partes(bucket, partes):
+    """Registros de las partes, descargando una a la vez."""
+    for ruta in partes:
+        for linea in bucket.blob(ruta).download_as_text().splitlines():
+            if linea.strip():
+                yield json.loads(linea)
 
-def consolidar_archivos():
+
+def consolidar_archivos(modo_shards=DELTA):
     print(f"🔌 Conectando al bucket: {BUCKET_NAME}...")
-    client = storage.Client(project=PROJECT_ID)
-    bucket = client.bucket(BUCKET_NAME)
-    
-    # 1. Listar todos los archivos del bucket
-    blobs = client.list_blobs(BUCKET_NAME)
-    
-    contenido_total = []
-    archivos_procesados = 0
-    
-    print("🔍 Buscando archivos .jsonl dispersos...")
-    
-    for blob in blobs:
-        # Filtramos solo los .jsonl, evitando el archivo de salida para no duplicar
-        if blob.name.endswith(".jsonl") and blob.name != OUTPUT_PATH:
+    bucket = almacenamiento.obtener_bucket(BUCKET_NAME, PROJECT_ID)
+
+    # 1. Listar solo los metadata_import.jsonl de cada proyecto
+    print(f"🔍 Buscando archivos '{PATRON_FUENTES}'...")
+    fuentes = {b.name: b.generation for b in almacenamiento.listar_blobs(bucket, match_glob=PATRON_FUENTES)}
+    estado = _cargar_estado(bucket)
+
+    cambiados = [n for n, gen in fuentes.items() if estado.get(n, {}).get("generacion") != gen]
+    eliminados = [n for n in estado if n not in fuentes]
+    print(f"   {len(fuentes)} proyectos · {len(cambiados)} nuevos/modificados · {len(eliminados)} eliminados")
+
+    # 2. Regenerar en paralelo solo las partes de proyectos que cambiaron
+    errores = 0
+    with ThreadPoolExecutor(max_workers=HILOS) as ex:
+        futuros = {ex.submit(_actualizar_parte, bucket, n, fuentes[n]): n for n in cambiados}
+        for futuro in as_completed(futuros):
+            nombre = futuros[futuro]
             try:
-                print(f"   - Leyendo: {blob.name}")
-                # Descargamos el texto y lo limpiamos de espacios extra
-                texto = blob.download_as_text().strip()
-                if texto:
-                    contenido_total.append(texto)
-                    archivos_procesados += 1
+                estado[nombre] = {"generacion": fuentes[nombre], "parte": futuro.result()}
+                print(f"   - Leído: {nombre}")
             except Exception as e:
-                print(f"   ⚠️ Error leyendo {blob.name}: {e}")
-
-    if contenido_total:
-        print(f"\n🧩 Unificando {archivos_procesados} archivos...")
-        
-        # Unimos todo con saltos de línea (formato JSONL estricto)
-        contenido_final = "\n".join(contenido_total)
-        
-        # 2. Subir el archivo maestro
-        blob_salida = bucket.blob(OUTPUT_PATH)
-        blob_salida.upload_from_string(contenido_final, content_type='application/jsonl')
-        
+                # Queda la parte anterior (si había); la generación no cambia y se reintenta la próxima vez
+                errores += 1
+                print(f"   ⚠️ Error leyendo {nombre}: {e}")
+
+    for nombre in eliminados:
+        parte = estado.pop(nombre).get("parte")
+        if parte and bucket.blob(parte).exists():
+            bucket.blob(parte).delete()
+
+    partes = sorted(e["parte"] for e in estado.values() if e.get("parte"))
+
+    if modo_shards:
+        # En delta basta leer las partes que cambiaron; el escritor descarta lo ya publicado
+        fuente_shards = partes if modo_shards == COMPLETO else sorted(
+            {estado[n]["parte"] for n in cambiados if estado.get(n, {}).get("parte")})
+        escritor = EscritorManifiesto(bucket, PREFIJO_MANIFIESTO)
+        entrada = escritor.escribir(_registros_de_partes(bucket, fuente_shards), modo_shards)
+        print(f"🗂️ Manifiesto {modo_shards}: {entrada['registros']} registros en {len(entrada['shards'])} shards "
+              f"(índice: gs://{BUCKET_NAME}/{PREFIJO_MANIFIESTO}indice.json)")
+
+    if partes:
+        print(f"\n🧩 Componiendo {len(partes)} archivos...")
+        # 3. Maestro compuesto directamente en GCS
+        _componer(bucket, partes, OUTPUT_PATH)
+
+        if errores:
+            print(f"⚠️ {errores} archivos no se pudieron leer: conservan su versión anterior (si existía) y se reintentarán en la próxima corrida.")
         print(f"✅ ¡Éxito! Archivo maestro creado en:")
         print(f"   gs://{BUCKET_NAME}/{OUTPUT_PATH}")
         print("\n--- INSTRUCCIONES PARA VERTEX AI ---")
@@ -50,9 +140,17 @@ def consolidar_archivos():
         print("2. Selecciona 'Cloud Storage'.")
         print(f"3. Elige la opción 'JSONL for unstructured data with metadata'.")
         print(f"4. En la ruta, selecciona ESTE archivo específico: gs://{BUCKET_NAME}/{OUTPUT_PATH}")
-        
+
     else:
         print("⚠️ No se encontraron archivos .jsonl en el bucket.")
 
+    # El estado va al final: si fallan los shards, el índice o el maestro, la próxima corrida
+    # vuelve a ver los mismos proyectos como cambiados y los publica
+    bucket.blob(ESTADO_PATH).upload_from_string(json.dumps(estado, ensure_ascii=False), content_type="application/json")
+
 if __name__ == "__main__":
-    consolidar_archivos()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Consolida los metadata_import.jsonl de cada proyecto")
+    parser.add_argument("--shards", choices=[DELTA, COMPLETO, "no"], default=DELTA,
+                        help="Manifiesto particionado: solo cambios (delta), todo (completo) o no generarlo")
+    args = parser.parse_args()
+    consolidar_archivos(None if args.shards == "no" else args.shards)
@@ -1,12 +1,17 @@
 import os
+import sys
 import json
 import re
-from google.cloud import storage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+import almacenamiento
+from manifiesto_vertex import EscritorManifiesto, COMPLETO, DELTA
 
 # --- CONFIGURACIÓN ---
 BUCKET_NAME = "almacen_antecedentes_482615"
 PREFIX = "biblioteca_legal/"  # Carpeta a escanear
 OUTPUT_FILE = "metadata_biblioteca_legal.jsonl"
+PREFIJO_MANIFIESTO = "config_search/biblioteca_legal/"
 
 def limpiar_id(nombre_archivo):
     """Genera un ID seguro para Vertex (solo alfanumérico y guiones bajos)."""
@@ -16,11 +21,10 @@ def limpiar_id(nombre_archivo):
 
 def generar_metadata():
     print(f"🔌 Conectando al bucket: {BUCKET_NAME}...")
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
+    bucket = almacenamiento.obtener_bucket(BUCKET_NAME)
     
     # Listamos los archivos en la carpeta específica
-    blobs = bucket.list_blobs(prefix=PREFIX)
+    blobs = almacenamiento.listar_blobs(bucket, prefix=PREFIX)
     
     registros = []
     
@@ -73,12 +77,18 @@ def generar_metadata():
         
         print("✅ Archivo JSONL generado exitosamente.")
         
-        # Opcional: Subir el JSONL al mismo bucket (raíz o carpeta config)
-        respuesta = input("¿Quieres subir este archivo JSONL al bucket ahora? (s/n): ")
+        # Opcional: Subir el manifiesto particionado (shards + indice.json) al bucket
+        respuesta = input("¿Quieres subir este manifiesto al bucket ahora? (s/n): ")
         if respuesta.lower() == 's':
-            blob_upload = bucket.blob(f"config_search/{OUTPUT_FILE}")
-            blob_upload.upload_from_filename(OUTPUT_FILE)
-            print(f"🚀 Subido a: gs://{BUCKET_NAME}/config_search/{OUTPUT_FILE}")
+            completo = input("¿Importación completa (c) o solo nuevos/modificados (d)? [d]: ").lower() == 'c'
+            escritor = EscritorManifiesto(bucket, PREFIJO_MANIFIESTO)
+            entrada = escritor.escribir(registros, COMPLETO if completo else DELTA)
+            if entrada["shards"]:
+                print(f"🚀 {entrada['registros']} registros en {len(entrada['shards'])} shards:")
+                for uri in escritor.uris(entrada, BUCKET_NAME):
+                    print(f"   {uri}")
+            else:
+                print("ℹ️ Sin cambios desde la última importación.")
     else:
         print("⚠️ No se encontraron archivos en esa carpeta.")
 
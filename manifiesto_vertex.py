@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import uuid
+import hashlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from almacenamiento import EscrituraPorLotes
+
+# ==========================================
+# MANIFIESTOS JSONL PARTICIONADOS PARA VERTEX AI SEARCH
+# ==========================================
+# En vez de un único JSONL gigante se escriben shards acotados por cantidad de
+# registros y por bytes, más un indice.json con la lista de shards. El modo
+# "delta" escribe solo los registros nuevos o modificados desde la última
+# importación (se comparan hashes por id), así que reindexar cuesta lo que cambió.
+#
+# {prefijo}indice.json            -> shards del último completo + deltas posteriores
+# {prefijo}_hashes.json           -> id -> hash del registro ya publicado
+# {prefijo}shards/<modo>-<ts>-NNNNN.jsonl
+
+MAX_REGISTROS_SHARD = int(os.getenv("SHARD_MAX_REGISTROS", "10000"))
+MAX_BYTES_SHARD = int(os.getenv("SHARD_MAX_MB", "100")) * 1024 * 1024
+COMPLETO, DELTA = "completo", "delta"
+
+
+def _hash_linea(linea):
+    return hashlib.sha1(linea.encode("utf-8")).hexdigest()[:16]
+
+
+class EscritorManifiesto:
+
+    def __init__(self, bucket, prefijo, max_registros=MAX_REGISTROS_SHARD, max_bytes=MAX_BYTES_SHARD):
+        self.bucket = bucket
+        self.prefijo = prefijo.rstrip("/") + "/"
+        self.max_registros = max_registros
+        self.max_bytes = max_bytes
+
+    def _leer_json(self, nombre, por_defecto):
+        blob = self.bucket.blob(self.prefijo + nombre)
+        if not blob.exists():
+            return por_defecto
+        try:
+            return json.loads(blob.download_as_text())
+        except Exception as e:
+            print(f"   ⚠️ {self.prefijo + nombre} ilegible, se ignora: {e}")
+            return por_defecto
+
+    def _subir_json(self, nombre, datos):
+        self.bucket.blob(self.prefijo + nombre).upload_from_string(
+            json.dumps(datos, ensure_ascii=False), content_type="application/json")
+
+    def escribir(self, registros, modo=DELTA):
+        """
+        Escribe los registros (dicts con 'id') en shards. En modo delta solo los
+        nuevos o modificados. Retorna la entrada agregada al índice.
+        """
+        sello = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        hashes = {} if modo == COMPLETO else self._leer_json("_hashes.json", {})
+        vistos = set()
+        repetidos = 0
+
+        shards, lineas, bytes_actual = [], [], 0
+        # Los shards se suben en paralelo mientras se siguen serializando registros
+        lote = EscrituraPorLotes(self.bucket)
+
+        def cerrar_shard():
+            nonlocal lineas, bytes_actual
+            if not lineas:
+                return
+            ruta = f"{self.prefijo}shards/{modo}-{sello}-{len(shards):05d}.jsonl"
+            lote.subir(ruta, "".join(lineas), content_type="application/jsonl")
+            shards.append({"ruta": ruta, "registros": len(lineas), "bytes": bytes_actual})
+            print(f"   📄 Shard {ruta} ({len(lineas)} registros, {bytes_actual / 1024:.0f} KB)")
+            lineas, bytes_actual = [], 0
+
+        with lote:
+            for registro in registros:
+                linea = json.dumps(registro, ensure_ascii=False, sort_keys=True) + "\n"
+                id_reg, h = str(registro["id"]), _hash_linea(linea)
+                if id_reg in vistos:
+                    repetidos += 1  # Vertex rechaza ids repetidos dentro de una importación
+                    continue
+                vistos.add(id_reg)
+                if modo == DELTA and hashes.get(id_reg) == h:
+                    continue
+                hashes[id_reg] = h
+
+                tamano = len(linea.encode("utf-8"))
+                if lineas and (len(lineas) >= self.max_registros or bytes_actual + tamano > self.max_bytes):
+                    cerrar_shard()
+                lineas.append(linea)
+                bytes_actual += tamano
+            cerrar_shard()
+        if repetidos:
+            print(f"   ⚠️ {repetidos} registros con id repetido quedaron fuera del manifiesto")
+
+        entrada = {"generado": sello, "modo": modo, "shards": shards,
+                   "registros": sum(s["registros"] for s in shards), "bytes": sum(s["bytes"] for s in shards)}
+
+        indice = self._leer_json("indice.json", {"completo": None, "deltas": []})
+        if modo == COMPLETO:
+            nuevas = {s["ruta"] for s in shards}
+            anteriores = [s["ruta"] for e in [indice.get("completo")] + indice.get("deltas", []) if e
+                          for s in e["shards"] if s["ruta"] not in nuevas]
+            indice = {"completo": entrada, "deltas": []}
+        else:
+            anteriores = []
+            if shards:
+                indice.setdefault("deltas", []).append(entrada)
+
+        # Primero el índice y los hashes; después se borran los shards que ya no referencia
+        self._subir_json("indice.json", indice)
+        self._subir_json("_hashes.json", hashes)
+        for ruta in anteriores:
+            try:
+                self.bucket.blob(ruta).delete()
+            except Exception:
+                pass
+        return entrada
+
+    def uris(self, entrada, bucket_name):
+        """URIs gs:// de los shards de una entrada, listas para el import de Vertex."""
+        return [f"gs://{bucket_name}/{s['ruta']}" for s in entrada["shards"]]